@@ -16,3 +16,13 @@
 # You should have received a copy of the GNU General Public License
 # along with  analyzarr.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+
+# HDF5 reads this when PyTables is first imported.  Its own file locking
+#   would stop worker processes reading a chest open for writing, so 
+#   sessions that share chests with workers (concurrent=True) turn it off, 
+#   and guard those chests with a lock file instead (see 
+#   lib/io/concurrency.py).  That is for the whole session, so it's opt-in:
+#   set ANALYZARR_CONCURRENT=1 before starting.
+if os.environ.get('ANALYZARR_CONCURRENT', '0') not in ('', '0'):
+    os.environ.setdefault('HDF5_USE_FILE_LOCKING', 'FALSE')
@@ -2,7 +2,9 @@ from traits.api import Int, Bool
 from analyzarr.ui.renderers import HasRenderer
 import tables as tb
 
-from analyzarr.lib.io.data_structure import filters
+from analyzarr.lib.io.data_structure import get_filters, get_chunkshape, \
+     get_image_id
+from analyzarr.lib.io.concurrency import writes_chest
 
 class ControllerBase(HasRenderer):
     # current image index
@@ -66,13 +68,21 @@ class ControllerBase(HasRenderer):
     def log_action(self, action, **parameters):
         self.parent.log_action(action, **parameters)
         
+    @writes_chest
     def add_data(self, data, name):
         import tables as tb
+        # cell stacks and images are chunked differently
+        if self.data_path == '/cells':
+            kind = 'cells'
+        else:
+            kind = 'raw'
         array = self.chest.create_carray(self.data_path,
                                          name,
                                          tb.Atom.from_dtype(data.dtype),
                                          data.shape,
-                                         filters = filters,
+                                         filters = get_filters(kind),
+                                         chunkshape = get_chunkshape(kind, 
+                                                data.shape, data.dtype),
                                          )
         array[:] = data
         self.chest.flush()        
@@ -93,8 +103,8 @@ class ControllerBase(HasRenderer):
             return data
         # pick out the indices for only the active image
         indices = target_table.get_where_list(
-            #'(omit==False) & (filename == "%s")' % self.get_active_name())
-            '(filename == "%s")' % filename)
+            #'(omit==False) & (image_id == %i)' % ...)
+            'image_id == %i' % get_image_id(self.chest, filename))
         # access the array data for those indices
         data=data[indices]
         return data
@@ -1,10 +1,12 @@
 from Base import ControllerBase
 from chaco.api import ArrayPlotData, BasePlotContainer, Plot
 
-from traits.api import Instance, on_trait_change
+from traits.api import Instance, Int, on_trait_change
 import numpy as np
 
 from save_plot import SaveFileController
+from analyzarr.lib.io import pyramid
+from analyzarr.lib.io.concurrency import writing
 
 import enaml
 with enaml.imports():
@@ -15,6 +17,8 @@ from enaml.stdlib.sessions import simple_session
 class BaseImageController(ControllerBase):
     plot = Instance(BasePlotContainer)
     plotdata = Instance(ArrayPlotData)
+    # raw images bigger than this on a side are shown from their pyramid
+    pyramid_min_size = Int(2048)
     
     def __init__(self, parent, treasure_chest=None, data_path='/rawdata', *args, **kw):
         super(BaseImageController, self).__init__(parent, treasure_chest, data_path,
@@ -22,18 +26,122 @@ class BaseImageController(ControllerBase):
         self.plotdata = ArrayPlotData()
         self._can_save = True
         self._can_change_idx = True
+        # pyramid of the active image, and the (level, bounds) shown from it
+        self._levels = None
+        self._loaded = None
+        self._image_shape = None
 
     def init_plot(self):
-        self.plotdata.set_data('imagedata', self.get_active_image())
+        self._show_active_image()
         self.plot = self.get_simple_image_plot(array_plot_data = self.plotdata,
                 title = self.get_active_name()
                 )
 
+    def get_active_levels(self):
+        """
+        Returns the pyramid of the active raw image (the image, then copies
+        downsampled 2x, 4x, ...), or None if the image is small enough to
+        show whole.
+        """
+        if self.data_path != '/rawdata':
+            return None
+        node = self.chest.list_nodes('/rawdata')[self.selected_index]
+        if len(node.shape) != 2 or max(node.shape) <= self.pyramid_min_size:
+            return None
+        # the pyramid is built the first time it's needed
+        with writing(self.chest):
+            return pyramid.get_levels(self.chest, node)
+
+    def _show_active_image(self):
+        # put the active image into plotdata - whole, or the pyramid level
+        #    that fits the screen.  The view is reset to the whole image.
+        self._levels = self.get_active_levels()
+        self._loaded = None
+        if self._levels is None:
+            self._image_bounds = None
+            self._view_bounds = None
+            active_image = self.get_active_image()
+            self._image_shape = active_image.shape
+            self.plotdata.set_data('imagedata', active_image)
+            return
+        height, width = self._levels[0].shape
+        self._image_shape = (height, width)
+        self._view_bounds = (0, width, 0, height)
+        self._load_view()
+
+    def _load_view(self):
+        """
+        Shows the pyramid level that matches the zoom, reading only the part
+        of it around the view.  Nothing is read while the view stays inside
+        what was last read, at the same level.
+        """
+        x0, x1, y0, y1 = self._view_bounds
+        screen_width, screen_height = 1024, 1024
+        if self._base_plot is not None and min(self._base_plot.bounds) > 1:
+            screen_width, screen_height = self._base_plot.bounds
+        scale = max((x1 - x0) / float(screen_width), 
+                    (y1 - y0) / float(screen_height))
+        level = pyramid.choose_level(len(self._levels), scale)
+        if self._loaded is not None:
+            loaded_level, (lx0, lx1, ly0, ly1) = self._loaded
+            if loaded_level == level and lx0 <= max(x0, 0) and \
+               ly0 <= max(y0, 0) and x1 <= lx1 and y1 <= ly1:
+                return
+        # read half a view extra on each side, so that panning doesn't 
+        #    read on every step
+        margin_x, margin_y = (x1 - x0) / 2.0, (y1 - y0) / 2.0
+        data, bounds = pyramid.read_region(self._levels, level, 
+                                           x0 - margin_x, x1 + margin_x,
+                                           y0 - margin_y, y1 + margin_y)
+        self._loaded = (level, bounds)
+        self._image_bounds = bounds
+        self.plotdata.set_data('imagedata', data)
+        if self._base_plot is not None:
+            grid_data_source = self._base_plot.plots['base_plot'][0].index
+            grid_data_source.set_data(
+                np.linspace(bounds[0], bounds[1], data.shape[1] + 1),
+                np.linspace(bounds[2], bounds[3], data.shape[0] + 1))
+
+    def _view_changed(self):
+        if self._levels is None or self._base_plot is None:
+            return
+        index_range = self._base_plot.index_range
+        value_range = self._base_plot.value_range
+        self._view_bounds = (index_range.low, index_range.high, 
+                             value_range.low, value_range.high)
+        self._load_view()
+
+    @on_trait_change('_base_plot')
+    def _follow_view(self, obj, name, old, new):
+        # follow zooming and panning on whichever plot shows the image
+        for plot, remove in ((old, True), (new, False)):
+            if plot is not None:
+                plot.index_range.on_trait_change(self._view_changed, 
+                                                 'updated', remove=remove)
+                plot.value_range.on_trait_change(self._view_changed, 
+                                                 'updated', remove=remove)
+
     def data_updated(self):
         # reinitialize data
         self.__init__(parent = self.parent, treasure_chest=self.chest,
                       data_path=self.data_path)
 
+    def nodes_added(self, names):
+        """
+        Picks up nodes added to data_path since the controller was made (for
+        example, by a watched folder) without rebuilding it.  The selected 
+        image stays selected and is not redrawn.
+        """
+        active_name = None
+        if self.numfiles > 0:
+            active_name = self.nodes[self.selected_index].name
+        self.nodes = self.chest.list_nodes(self.data_path)
+        self.numfiles = len(self.nodes)
+        if active_name is not None:
+            # new nodes may sort ahead of the active one
+            index = [node.name for node in self.nodes].index(active_name)
+            self.trait_setq(selected_index=index)
+
     # this is a 2D image for plotting purposes
     def get_active_image(self):
         nodes = self.chest.list_nodes('/rawdata')
@@ -49,17 +157,22 @@ class BaseImageController(ControllerBase):
         if self.chest is None or self.numfiles<1:
             return
         # get the old image for the sake of comparing image sizes
-        old_data = self.plotdata.get_data('imagedata')
-        active_image = self.get_active_image()
-        self.plotdata.set_data("imagedata", active_image)
+        old_shape = self._image_shape
+        self._show_active_image()
         self.set_plot_title(self.get_active_name())
-        if old_data.shape != active_image.shape:
-            grid_data_source = self._base_plot.range2d.sources[0]
-            grid_data_source.set_data(np.arange(active_image.shape[1]), 
-                                  np.arange(active_image.shape[0]))
+        image_shape = self._image_shape
+        if old_shape != image_shape:
+            if self._levels is None:
+                grid_data_source = self._base_plot.range2d.sources[0]
+                grid_data_source.set_data(np.arange(image_shape[1]), 
+                                      np.arange(image_shape[0]))
             self.plot = self.get_simple_image_plot(array_plot_data = self.plotdata,
                     title = self.get_active_name())
-            self.plot.aspect_ratio=(float(active_image.shape[1])/active_image.shape[0])
+            self.plot.aspect_ratio=(float(image_shape[1])/image_shape[0])
+        elif self._levels is not None:
+            # same size as the last image - show all of it
+            self._base_plot.index_range.set_bounds(*self._view_bounds[:2])
+            self._base_plot.value_range.set_bounds(*self._view_bounds[2:])
 
     def open_save_UI(self, plot_id='plot'):
         save_controller = SaveFileController(plot=self.get_plot(plot_id), parent=self)
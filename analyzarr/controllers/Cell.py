@@ -5,7 +5,9 @@ import numpy as np
 import tables as tb
 
 import analyzarr.lib.cv.peak_char as pc
-from analyzarr.lib.io.data_structure import filters
+from analyzarr.lib.io.data_structure import filters, get_image_id, \
+     get_image_name
+from analyzarr.lib.io.concurrency import writes_chest
 
 from pyface.api import ProgressDialog
 from enaml.application import Application
@@ -62,7 +64,7 @@ class CellController(BaseImageController):
         file_idx = cell_record['file_idx']
         # this is the corresponding record in the cell_peaks table:
         peak_record = self.chest.root.cell_peaks.read_where(
-            '(filename == "%s") & (file_idx == %i)'%(self.get_cell_parent(), file_idx)
+            '(image_id == %i) & (file_idx == %i)'%(cell_record['image_id'], file_idx)
             )[0]        
         for peak in range(self.numpeaks):
             x = peak_record['x%i'%peak]
@@ -107,11 +109,9 @@ class CellController(BaseImageController):
         cell_record = self.chest.root.cell_description.read(
                             start=self.selected_index,
                             stop=self.selected_index + 1)[0]
-        parent = self.get_cell_parent()
         # select that parent as the selected image (int because it is an index)
-        selected_image = int([x['idx'] for x in
-                                       self.chest.root.image_description.where(
-                                       'filename == "%s"' % parent)][0])
+        selected_image = int(self.chest.root.image_description[
+                                       cell_record['image_id']]['idx'])
 
         # return the cell data - the index is the index of this cell
         #    among only its indexed cells - not the universal index!
@@ -132,11 +132,12 @@ class CellController(BaseImageController):
                             start=self.selected_index,
                             stop=self.selected_index + 1)[0]
         # find the parent that this cell comes from
-        return cell_record['filename']
+        return get_image_name(self.chest, cell_record['image_id'])
 
     def get_omitted_indices(self, node_name):
         return self.chest.root.cell_description.read_where(
-            '(omit==True) & (filename == "%s")' % node_name, 
+            '(omit==True) & (image_id == %i)' % get_image_id(self.chest, 
+                                                            node_name), 
             field='file_idx').tolist()
         
     # TODO: is there any compelling reason that we need the whole stack at once?
@@ -201,6 +202,7 @@ class CellController(BaseImageController):
     def execute_characterize(self):
         self.characterize()
     
+    @writes_chest
     def omit_selected_index(self):
         cell_record=self.chest.root.cell_description[self.selected_index]
         # this is not the nicest - would be better to do a table join, 
@@ -210,7 +212,7 @@ class CellController(BaseImageController):
         #         (here is where the join would be nice...)
         
         peak_selected_idx = self.chest.root.cell_peaks.get_where_list(
-            '(filename == "%s") & (file_idx == %i)'%(cell_record["filename"], 
+            '(image_id == %i) & (file_idx == %i)'%(cell_record["image_id"], 
                                                cell_record["file_idx"]))[0]
         
         self.chest.root.cell_peaks.cols.omit[peak_selected_idx]=not cell_record["omit"]
@@ -221,7 +223,8 @@ class CellController(BaseImageController):
         self.omitted = not self.omitted
         self.log_action(action="omit cell", 
                         idx=cell_record["file_idx"], 
-                        image=cell_record["filename"],
+                        image=get_image_name(self.chest, 
+                                             cell_record["image_id"]),
                         state=cell_record["omit"])
     
     def get_peak_data(self, chars=[], indices=[]):
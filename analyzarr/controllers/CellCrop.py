@@ -1,4 +1,4 @@
-from traits.api import Instance, Range, Dict, Bool, Int, String, \
+from traits.api import Instance, Range, Dict, Bool, Int, String, Any, \
      on_trait_change
 from BaseImage import BaseImageController
 
@@ -6,14 +6,24 @@ from chaco.default_colormaps import gray
 from chaco.api import ArrayPlotData, BasePlotContainer, Plot
 
 from analyzarr.lib.cv import peak_char as pc
-from analyzarr.lib.cv import cv_funcs
-from analyzarr.lib.io.data_structure import CellsTable
+from analyzarr.lib.cv import ncc
+from analyzarr.lib.io.data_structure import CellsTable, get_image_id, \
+     append_rows
+from analyzarr.lib.io.concurrency import writes_chest
+
+import threading
 
 import numpy as np
 import tables as tb
 
 from enaml.application import Application
 
+def _find_peaks(CC):
+    # runs in ncc.xcorr_many's threads
+    pks=pc.two_dim_findpeaks((CC-CC.min())*255, xc_filter=False)
+    pks[:,2]=pks[:,2]/255+CC.min()
+    return pks
+
 class CellCropController(BaseImageController):
     zero=Int(0)
     template_plot = Instance(BasePlotContainer)
@@ -30,6 +40,19 @@ class CellCropController(BaseImageController):
     numpeaks_total = Int(0,cols=5)
     numpeaks_img = Int(0,cols=5)
     _session_id = String('')
+    # while the template is being moved, the cross correlation is shown 
+    #    from images downsampled by preview_factor, and redone at full 
+    #    resolution once it has been left alone for refine_delay ms.
+    progressive_CC = Bool(True)
+    preview_factor = Int(4)
+    refine_delay = Int(300)
+    # counts changes to the cross correlation shown, so that refinements
+    #    finishing after another change are thrown away
+    _CC_generation = Int(0)
+    # the active image, and its downsampled copy, for the correlation preview
+    _CC_image_name = String('')
+    _CC_image = Any
+    _CC_coarse_image = Any
 
     def __init__(self, parent, treasure_chest=None, data_path='/rawdata', 
                  *args, **kw):
@@ -69,8 +92,10 @@ class CellCropController(BaseImageController):
 
     @on_trait_change("selected_index, ShowCC")
     def update_image(self):
+        # anything being refined is for the old image
+        self._CC_generation += 1
         if self.ShowCC:
-            CC = cv_funcs.xcorr(self.template_data.get_data('imagedata'),
+            CC = ncc.xcorr(self.template_data.get_data('imagedata'),
                                      self.get_active_image())
             self.plotdata.set_data("imagedata",CC)
             self.plot = self.get_scatter_overlay_plot(array_plot_data=self.plotdata,
@@ -97,9 +122,52 @@ class CellCropController(BaseImageController):
                                       np.arange(self.get_active_image().shape[0]))
 
     def update_CC(self):
-        if self.ShowCC:
-            CC = cv_funcs.xcorr(self.template_data.get_data('imagedata'),
-                                     self.get_active_image())
+        if not self.ShowCC:
+            return
+        self._CC_generation += 1
+        template = self.template_data.get_data('imagedata')
+        factor = min(self.preview_factor, self.template_size // 4)
+        if not self.progressive_CC or factor < 2:
+            CC = ncc.xcorr(template, self.get_active_image())
+            self.plotdata.set_data("imagedata",CC)
+            return
+        image, coarse_image = self._get_CC_images(factor)
+        self.plotdata.set_data("imagedata", ncc.xcorr_preview(
+            template, coarse_image, factor, image.shape))
+        Application.instance().timed_call(self.refine_delay, self._refine_CC,
+                                          self._CC_generation, template, 
+                                          image)
+
+    def _get_CC_images(self, factor):
+        # the active image and its downsampled copy, read once per image 
+        #    rather than on every move of the template
+        name = self.get_active_name()
+        if (name != self._CC_image_name or self._CC_coarse_image is None or
+            self._CC_coarse_image.shape[0] != 
+            self._CC_image.shape[0] // factor):
+            self._CC_image = self.get_active_image()
+            self._CC_coarse_image = ncc.downsample(self._CC_image, factor)
+            self._CC_image_name = name
+        return self._CC_image, self._CC_coarse_image
+
+    def _refine_CC(self, generation, template, image):
+        # the template hasn't moved for refine_delay ms, unless generation 
+        #    is out of date.  The full resolution correlation is computed in
+        #    another thread, so the GUI doesn't wait for it.
+        if generation != self._CC_generation:
+            return
+        worker = threading.Thread(target=self._compute_CC,
+                                  args=(generation, template, image))
+        worker.daemon = True
+        worker.start()
+
+    def _compute_CC(self, generation, template, image):
+        # runs in a worker thread - the plot is only touched from the GUI's
+        CC = ncc.xcorr(template, image)
+        Application.instance().deferred_call(self._show_CC, generation, CC)
+
+    def _show_CC(self, generation, CC):
+        if generation == self._CC_generation and self.ShowCC:
             self.plotdata.set_data("imagedata",CC)
 
     @on_trait_change('template_left, template_top, template_size')
@@ -214,16 +282,31 @@ class CellCropController(BaseImageController):
             self.plot = self.get_scatter_overlay_plot(array_plot_data=self.plotdata,
                                                       )
             
-    def locate_peaks(self):
+    def locate_peaks(self, threads=None):
+        """
+        Finds the peaks of the template's cross correlation with each image.
+        Images are correlated and searched in a pool of threads (one per CPU
+        by default - see ncc.xcorr_many).  Images bigger than 
+        ncc.max_untiled_pixels are instead read and correlated a tile at a
+        time (see ncc.find_peaks_tiled).
+        """
+        template = self.template_data.get_data("imagedata")
+        nodes = self.chest.list_nodes('/rawdata')
+        large = []
+        small = []
+        for node in nodes:
+            if node.shape[-2] * node.shape[-1] > ncc.max_untiled_pixels:
+                large.append(node)
+            else:
+                small.append(node)
+        images = (node[:] for node in small)
+        peak_sets = ncc.xcorr_many(template, images, func=_find_peaks, 
+                                   threads=threads)
         peaks={}
-        for idx in xrange(self.numfiles):
-            self.set_active_index(idx)
-            CC = cv_funcs.xcorr(self.template_data.get_data("imagedata"),
-                                    self.get_active_image())
-            # 
-            pks=pc.two_dim_findpeaks((CC-CC.min())*255, xc_filter=False)
-            pks[:,2]=pks[:,2]/255+CC.min()
-            peaks[self.get_active_name()]=pks
+        for node, pks in zip(small, peak_sets):
+            peaks[node.name]=pks
+        for node in large:
+            peaks[node.name]=ncc.find_peaks_tiled(template, node, _find_peaks)
         self.peaks=peaks
         
     def mask_peaks(self,image_id):
@@ -231,6 +314,7 @@ class CellCropController(BaseImageController):
         mpeaks[:,2]=np.ma.masked_outside(mpeaks[:,2],self.thresh[0],self.thresh[1])
         return mpeaks
 
+    @writes_chest
     def crop_cells(self):
         rows = self.chest.root.cell_description.nrows
         if rows > 0:
@@ -243,6 +327,7 @@ class CellCropController(BaseImageController):
                 pass
             # recreate it
             self.chest.create_table('/', 'cell_description', CellsTable)
+            self.chest.root.cell_description.cols.image_id.create_index()
             # remove all existing entries in the data group
             for node in self.chest.list_nodes('/cells'):
                 self.chest.remove_node('/cells/' + node.name)
@@ -250,7 +335,7 @@ class CellCropController(BaseImageController):
         template_data = self.template_data.get_data('imagedata')
         self.parent.add_cell_data(template_data, name="template")
         # TODO: set attribute that tells where the template came from
-        row = self.chest.root.cell_description.row
+        table = self.chest.root.cell_description
         files=[]
         for idx in xrange(self.numfiles):
             # filter the peaks that are outside the selected threshold
@@ -261,19 +346,18 @@ class CellCropController(BaseImageController):
             tmp_sz=self.template_size
             data=np.zeros((peaks.shape[0],tmp_sz,tmp_sz), 
                           dtype=active_image.dtype)
+            image_id = get_image_id(self.chest, self.get_active_name())
             if data.shape[0] >0:
+                # store the peaks in the table
+                append_rows(table, peaks.shape[0], 
+                            file_idx=np.arange(peaks.shape[0]),
+                            input_data=self.data_path, image_id=image_id,
+                            x_coordinate=peaks[:, 0], 
+                            y_coordinate=peaks[:, 1])
                 for i in xrange(peaks.shape[0]):
-                    # store the peak in the table
-                    row['file_idx'] = i
-                    row['input_data'] = self.data_path
-                    row['filename'] = self.get_active_name()
-                    row['x_coordinate'] = peaks[i, 0]
-                    row['y_coordinate'] = peaks[i, 1]
-                    row.append()
                     # crop the cells from the given locations
                     data[i,:,:]=active_image[int(peaks[i, 0]):int(peaks[i, 0] + tmp_sz),
                                       int(peaks[i, 1]):int(peaks[i, 1] + tmp_sz)]
-                self.chest.root.cell_description.flush()
                 self.parent.add_cell_data(data, name=self.get_active_name())
                 # insert the data (one 3d array per file)
                 self.chest.set_node_attr('/cell_description', 'threshold', (self.thresh_lower, self.thresh_upper))
@@ -285,18 +369,16 @@ class CellCropController(BaseImageController):
                 self.chest.flush()
         average_data = np.average(data,axis=0).squeeze()
         self.parent.add_cell_data(average_data, name="average")
-        row = self.chest.root.cell_description.row
-        row['file_idx'] = 0
-        row['input_data'] = self.data_path
-        row['filename'] = "average"
-        row['x_coordinate'] = 0
-        row['y_coordinate'] = 0
-        row.append()
-        self.chest.root.cell_description.flush()
-        self.parent.update_cell_data()
+        # the average is also added as an image, which gives it its image id
         self.parent.add_image_data(average_data, "average")
+        append_rows(self.chest.root.cell_description, file_idx=0, 
+                    input_data=self.data_path,
+                    image_id=get_image_id(self.chest, "average"),
+                    x_coordinate=0, y_coordinate=0)
+        self.parent.update_cell_data()
         self.log_action(action="crop cells", files=files, thresh=self.thresh, 
                         template_position=(self.template_left, self.template_top), 
                         template_size=self.template_size, 
                         template_filename=self.template_filename)
+        self.parent.crop_controller = None
         Application.instance().end_session(self._session_id)
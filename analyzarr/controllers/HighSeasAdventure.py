@@ -21,6 +21,8 @@ from MDA_execute import MDAExecutionController
 
 from analyzarr.lib.cv import peak_char as pc
 from analyzarr.lib.io import file_import
+from analyzarr.lib.io.data_structure import get_image_id, append_rows
+from analyzarr.lib.io.concurrency import get_writer, writes_chest
 from analyzarr.testing.test_pattern import get_test_pattern
 from analyzarr.Release import version
 from analyzarr.ui.progress import PyFaceProgress
@@ -51,6 +53,8 @@ class HighSeasAdventure(HasTraits):
     image_controller = Instance(MappableImageController)
     cell_controller = Instance(CellController)
     mda_controller = Instance(MDAViewController)
+    # the open cell cropper, if any
+    crop_controller = Instance(CellCropController)
     
     def __init__(self, *args, **kw):
         super(HighSeasAdventure, self).__init__(*args, **kw)
@@ -58,6 +62,8 @@ class HighSeasAdventure(HasTraits):
         self.cell_controller = CellController(parent=self)
         self.mda_controller = MDAViewController(parent=self)
         self.chest = None
+        self._folder_watcher = None
+        self._watch_timer = None
 
     def update_cell_data(self):
         self.cell_controller = CellController(parent=self, 
@@ -77,11 +83,25 @@ class HighSeasAdventure(HasTraits):
         
     def update_image_data(self):
         self.image_controller.data_updated()
-        self.crop_controller.data_updated()
+        if self.crop_controller is not None:
+            self.crop_controller.data_updated()
 
-    def new_treasure_chest(self, filename):
+    def close_treasure_chest(self):
         if self.chest is not None:
+            writer = get_writer(self.chest)
+            if writer is not None:
+                writer.close()
             self.chest.close()
+        self.chest = None
+
+    def new_treasure_chest(self, filename, concurrent=False):
+        """
+        With concurrent, other processes can read the chest while it is
+        open here (see lib.io.concurrency).  This needs analyzarr started
+        with ANALYZARR_CONCURRENT=1.
+        """
+        self.stop_watching_folder()
+        self.close_treasure_chest()
         # first, clear any existing controllers
         self.image_controller = MappableImageController(parent=self)
         self.cell_controller = CellController(parent=self)
@@ -90,7 +110,7 @@ class HighSeasAdventure(HasTraits):
         prefix, ext = os.path.splitext(filename)
         if "chest" in ext:
             filename = prefix
-        chest = file_import.new_treasure_chest(filename)
+        chest = file_import.new_treasure_chest(filename, concurrent)
         self.chest = chest
         self.image_controller = MappableImageController(parent=self, 
                                                     treasure_chest=chest)
@@ -99,10 +119,10 @@ class HighSeasAdventure(HasTraits):
         self.title = " - %s" % os.path.split(filename)[1]
         self.has_chest=True
 
-    def open_treasure_chest(self, filename):
-        if self.chest is not None:
-            self.chest.close()
-        chest = file_import.open_treasure_chest(filename)
+    def open_treasure_chest(self, filename, concurrent=False):
+        self.stop_watching_folder()
+        self.close_treasure_chest()
+        chest = file_import.open_treasure_chest(filename, concurrent)
         self.chest = chest
         self.image_controller = MappableImageController(parent=self, 
                                                     treasure_chest=chest)
@@ -112,14 +132,82 @@ class HighSeasAdventure(HasTraits):
         self.title = " - %s" % os.path.split(filename)[1]
         self.has_chest=True
 
-    def import_files(self, file_list):
-        file_import.import_files(self.chest, file_list)
+    @writes_chest
+    def import_files(self, file_list, processes=1, tiff_workers=1):
+        file_import.import_files(self.chest, file_list, processes=processes,
+                                 tiff_workers=tiff_workers)
         self.image_controller = MappableImageController(parent=self, 
                                                     treasure_chest=self.chest)
         self.cell_controller = CellController(parent=self,
                                               treasure_chest=self.chest)
         self.log_action(action="import", files=file_list)
 
+    def watch_folder(self, folder, interval=2.0, **import_options):
+        """
+        Imports files into the open chest as they are written to folder,
+        checking every interval seconds.  New images are added to the image
+        view as they arrive.  import_options are passed on to 
+        file_import.import_files.
+        """
+        from pyface.timer.api import Timer
+        from analyzarr.lib.io.watch_folder import FolderWatcher
+        self.stop_watching_folder()
+        self._folder_watcher = FolderWatcher(self.chest, folder, 
+                                             **import_options)
+        self._watch_timer = Timer(int(interval * 1000), 
+                                  self._poll_watched_folder)
+        self.log_action(action="watch folder", folder=folder)
+
+    def stop_watching_folder(self):
+        if self._watch_timer is not None:
+            self._watch_timer.Stop()
+        self._watch_timer = None
+        self._folder_watcher = None
+
+    @writes_chest
+    def _poll_watched_folder(self):
+        new_nodes = self._folder_watcher.poll()
+        if new_nodes:
+            self.image_controller.nodes_added(new_nodes)
+            if self.crop_controller is not None:
+                self.crop_controller.nodes_added(new_nodes)
+            self.log_action(action="import", files=new_nodes)
+
+    def benchmark_codecs(self, kind='raw', apply=False, **options):
+        """
+        Measures the compression settings on a sample of the open chest's
+        data, prints the results and returns the recommended storage
+        policy.  If apply is True, new datasets of that kind are stored with
+        the recommended policy.  options are passed on to
+        benchmark.benchmark_codecs.
+        """
+        from analyzarr.lib.io import benchmark
+        results = benchmark.benchmark_codecs(self.chest, kind=kind, **options)
+        print benchmark.format_results(results)
+        policy = benchmark.recommend_policy(results, kind=kind, apply=apply)
+        print "Recommended policy for %s data: %s" % (kind, policy)
+        if apply:
+            self.log_action(action="set storage policy", kind=kind, **policy)
+        return policy
+
+    def compact_treasure_chest(self):
+        """
+        Repacks the open chest to give back the space left by rerunning
+        analyses, then reopens it.  Prints and returns the compaction report
+        (see lib.io.compaction).
+        """
+        from analyzarr.lib.io import compaction
+        filename = self.chest.filename
+        concurrent = get_writer(self.chest) is not None
+        self.close_treasure_chest()
+        try:
+            report = compaction.compact_chest(filename)
+        finally:
+            self.open_treasure_chest(filename, concurrent)
+        print compaction.format_report(report)
+        self.log_action(action="compact chest", **report)
+        return report
+
     def load_test_data(self):
         # create the test pattern
         tp = get_test_pattern((256,256))
@@ -132,11 +220,11 @@ class HighSeasAdventure(HasTraits):
         self.import_files(['tp.png'])
         # delete the file for cleanliness?
 
-    def characterize_peaks(self):
+    def characterize_peaks(self, processes=1):
         has_cells = self.cell_controller.get_num_files()>0
         # TODO: need to make peak width a user-specified value, or some
         #   auto-detect algorithm...
-        self.image_controller.characterize_peaks()
+        self.image_controller.characterize_peaks(processes=processes)
         if has_cells:
             # TODO: cell_controller accesses the database for 
             #  the image controller here.  Need to clean up.
@@ -150,6 +238,7 @@ class HighSeasAdventure(HasTraits):
         Application.instance().add_factories([cell_cropper])
         session_id = Application.instance().start_session('cropper')
         crop_controller._session_id = session_id
+        self.crop_controller = crop_controller
         
     def open_MDA_UI(self):
         mda_controller = MDAExecutionController(parent=self, 
@@ -160,6 +249,7 @@ class HighSeasAdventure(HasTraits):
         session_id = Application.instance().start_session('mda')
         mda_controller._session_id = session_id
         
+    @writes_chest
     def log_action(self, action, **parameters):
         """
         action - a short string describing the action itself (e.g. crop cells)
@@ -167,20 +257,15 @@ class HighSeasAdventure(HasTraits):
             a string that can then be recovered as a dictionary at some later date.
         version - the version of analyzarr used to perform that action
         """
-        row = self.chest.root.log.row
-        row['date']=time()
-        row['action']=action
         # record parameter dictionary as string.  Can be brought back with:
         #   dict2 = eval(string_from_table)
         # http://stackoverflow.com/questions/4547274/convert-a-python-dict-to-a-string-and-back
-        row['parameters'] = parameters
-        row['version'] = version
-        row.append()
-        self.chest.root.log.flush()
+        append_rows(self.chest.root.log, date=time(), action=action,
+                    parameters=str(parameters), version=version)
 
     def get_peak_data(self, node_name):
         indices = self.chest.get_node('/image_peaks').get_where_list(
-                    '(filename=="%s")'%node_name)
+                    'image_id == %i' % get_image_id(self.chest, node_name))
         return self.chest.root.image_peaks[indices]
 
     def find_best_matching_global_peaks(self, target_locations_x_y, node_name):
@@ -190,6 +275,7 @@ class HighSeasAdventure(HasTraits):
         indices=[pc.best_match(coords, target) for target in target_locations_x_y]
         return self.get_peak_data(node_name=node_name)[indices]
 
+    @writes_chest
     def map_global_peaks_to_cells(self):        
         try:
             # wipe out old results
@@ -207,13 +293,14 @@ class HighSeasAdventure(HasTraits):
         names = [item for sublist in names for item in sublist]
         # make tuples of each column name and 'f8' for the data type
         dtypes = zip(names, ['f8', ] * peaks.shape[0]*9)
-        # prepend the filename and index columns
-        dtypes = [('filename', '|S250'), ('file_idx', 'i4'), ('omit', 'bool')] + dtypes
+        # prepend the image id and index columns
+        dtypes = [('image_id', 'i4'), ('file_idx', 'i4'), ('omit', 'bool')] + dtypes
         # create an empty recarray with our data type
         desc = np.recarray((0,), dtype=dtypes)
         # create the table using the empty description recarray
         self.chest.create_table(self.chest.root,
                                'cell_peaks', description=desc)
+        self.chest.root.cell_peaks.cols.image_id.create_index()
         
         self.chest.set_node_attr('/cell_peaks','number_of_peaks', peaks.shape[0])
         self.chest.flush()
@@ -223,7 +310,7 @@ class HighSeasAdventure(HasTraits):
         for node in self.image_controller.get_node_iterator():
             cell_data = self.cell_controller.get_cell_set(node.name)
             data = np.zeros((cell_data.shape[0]),dtype=dtypes)
-            data["filename"] = node.name
+            data["image_id"] = get_image_id(self.chest, node.name)
             data['file_idx'] = np.arange(cell_data.shape[0])
             for idx, peak in enumerate(peaks):            
                 #TODO: need to rework this whole get_expression_data concept.  It is
@@ -2,7 +2,9 @@ from chaco.api import ArrayPlotData, BasePlotContainer, Plot
 from traits.api import Instance, Bool, Int, List, String, on_trait_change, HasTraits, Range
 import tables as tb
 # how much to compress the data
-from analyzarr.lib.io.data_structure import filters
+from analyzarr.lib.io.data_structure import get_filters, get_image_id, \
+     append_rows
+from analyzarr.lib.io.concurrency import writes_chest
 
 import numpy as np
 import sys
@@ -133,7 +135,7 @@ class MDAExecutionController(HasTraits):
 
     def get_input_data(self, standardize=True, normalize=False):
         if self.on_peaks:
-            # query the peak table for all fields EXCEPT the filename, file 
+            # query the peak table for all fields EXCEPT the image id, file 
             #   index and peak location (we use shifts only)
             # data has peak characteristics in columns; each cell is a row.
             data = self.get_peak_data()
@@ -166,19 +168,19 @@ class MDAExecutionController(HasTraits):
         data = (data/data.max(axis=0))-0.5
         return data, colmin, colmax
 
+    @writes_chest
     def store_MDA_results(self, factors, scores, eigenvalues=None):
         if self.on_peaks:
             score_table_title='peak_scores'
             # each row of this table is a component
             # we should copy the column titles from the cell peaks table
-            # but we remove the file index and filename fields, they're irrelevant.
+            # but we remove the image id and file index fields, they're irrelevant.
             factor_dtype = self.chest.root.cell_peaks.dtype.descr[2:]
             table_description = np.zeros((0,), dtype=factor_dtype)
             fs = self.chest.create_table('/mda_results/'+self.context, 'peak_factors',
                          description=table_description)
             self.chest.set_node_attr('/mda_results/'+self.context, 'on_peaks', True)
             data = np.zeros((self.number_to_derive), dtype=factor_dtype)
-            row = fs.row
             # record the factors
             indices = range(self.chest.get_node_attr('/cell_peaks','number_of_peaks'))
             chars = ['dx', 'dy', 'h', 'o', 'e', 'sx', 'sy']
@@ -198,7 +200,7 @@ class MDAExecutionController(HasTraits):
             #   we use this for recording the X and Y coordinates of peaks,
             #   which we do not feed into MDA itself.
             peak_record = self.chest.root.cell_peaks.read_where(
-                'filename == "average"')[0]
+                'image_id == %i' % get_image_id(self.chest, "average"))[0]
             for idx in coordinate_data_indices:
                 data[idx] = peak_record[idx]
             fs.append(data)
@@ -208,7 +210,7 @@ class MDAExecutionController(HasTraits):
             fs = self.chest.create_carray('/mda_results/'+self.context, 'image_factors',
                                      tb.Atom.from_dtype(factors.dtype),
                                      factors.shape,
-                                     filters=filters
+                                     filters=get_filters('factors')
                                      )
             fs[:] = factors
             self.chest.set_node_attr('/mda_results/'+self.context, 'on_peaks', False)
@@ -218,29 +220,30 @@ class MDAExecutionController(HasTraits):
         # make tuples of each column name and 'f8' for the data type
         dtypes = zip(names, ['f8', ] * self.number_to_derive)
         # prepend the index column
-        dtypes = [('filename', '|S30'), ('file_idx', 'i4')] + dtypes
+        dtypes = [('image_id', 'i4'), ('file_idx', 'i4')] + dtypes
         desc = np.recarray((0,), dtype=dtypes)        
         ss = self.chest.create_table('/mda_results/'+self.context, score_table_title, 
                                     description=desc)
         # arrange data to populate the table
         if self.on_peaks:
             data = np.zeros((self.chest.root.cell_peaks.nrows), dtype=dtypes)
-            data['filename']=self.chest.root.cell_peaks.col('filename')
+            data['image_id']=self.chest.root.cell_peaks.col('image_id')
             data['file_idx']=self.chest.root.cell_peaks.col('file_idx')
         else:
             data = np.zeros((self.chest.root.cell_description.nrows), dtype=dtypes)
-            data['filename']=self.chest.root.cell_description.col('filename')
+            data['image_id']=self.chest.root.cell_description.col('image_id')
             data['file_idx']=self.chest.root.cell_description.col('file_idx')            
         for col in xrange(self.number_to_derive):
             data[names[col]] = scores[:, col]
         # get the table and append the data to it
         ss.append(data)
+        ss.cols.image_id.create_index()
         ss.flush()
         if eigenvalues is not None:
             ev = self.chest.create_carray('/mda_results/'+self.context, 'Eigenvalues',
                                      tb.Atom.from_dtype(eigenvalues.dtype),
                                      eigenvalues.shape,
-                                     filters=filters
+                                     filters=get_filters('eigenvalues')
                                      )
             ev[:] = eigenvalues
         self.chest.flush()
@@ -329,13 +332,8 @@ or remove some variables.  For images, you can subsample." % (data.shape[1], dat
         import time
         # first add an entry to our table of analyses performed
         datestr = MDA_type + time.strftime("_%Y-%m-%d %H:%M:%S", time.localtime())
-        data_record = self.chest.root.mda_description.row
-        data_record['context'] = datestr
-        data_record['mda_type'] = MDA_type
-        #data_record['input_data'] = self.data_controller.summarize_data()
-        #data_record['treatments'] = self.data_controller.summarize
-        data_record.append()
-        self.chest.root.mda_description.flush()
+        append_rows(self.chest.root.mda_description, context=datestr,
+                    mda_type=MDA_type)
         self.chest.create_group('/mda_results', datestr)
         self.context = datestr
         self.chest.flush()
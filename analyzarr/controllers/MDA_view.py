@@ -4,7 +4,7 @@ from traits.api import Instance, Bool, Int, List, String, Array, \
 from BaseImage import BaseImageController
 import tables as tb
 # how much to compress the data
-from analyzarr.lib.io.data_structure import filters
+from analyzarr.lib.io.data_structure import filters, get_image_id
 
 import numpy as np
 
@@ -143,19 +143,20 @@ class MDAViewController(BaseImageController):
             
     def render_active_score_image(self, context):
         self.score_plotdata.set_data('imagedata', self.get_active_image())
+        image_id = get_image_id(self.chest, self.get_active_name())
         values = self.chest.root.cell_description.read_where(
-                'filename == "%s"' % self.get_active_name(),
+                'image_id == %i' % image_id,
                 field='y_coordinate',)
     
         indices = self.chest.root.cell_description.read_where(
-                'filename == "%s"' % self.get_active_name(),
+                'image_id == %i' % image_id,
                 field='x_coordinate',)
         if self.chest.get_node_attr('/mda_results/'+context, 'on_peaks'):
             scores = self.chest.get_node('/mda_results/'+context+'/peak_scores')          
         else:
             scores = self.chest.get_node('/mda_results/'+context+'/image_scores')
         color = scores.read_where(
-            'filename == "%s"' % self.get_active_name(),
+            'image_id == %i' % image_id,
             field='c%i' % self.component_index,
         )
         self.score_plotdata.set_data('index', values)
@@ -4,6 +4,23 @@ import numpy as np
 import tables as t
 
 from analyzarr.ui.progress import PyFaceProgress
+from analyzarr.lib.io.concurrency import writing, writes_chest, map_chest
+
+def _peak_attribs(data, name, peak_width=None):
+    import analyzarr.lib.cv.peak_char as pc
+    # uses default median filter radius of 5 pixels
+    if name=="average":
+        return pc.peak_attribs_image(data,xc_filter=False,
+                                     kill_edges=False)
+    else:
+        return pc.peak_attribs_image(data,peak_width=peak_width)
+
+def _characterize_node(reader, args):
+    # runs in a worker process - see concurrency.map_chest
+    name, peak_width = args
+    with reader.reading() as h5file:
+        data = h5file.get_node('/rawdata', name)[:]
+    return _peak_attribs(data, name, peak_width)
 
 class MappableImageController(BaseImageController):
     _can_map_peaks = Bool(False)
@@ -30,13 +47,21 @@ class MappableImageController(BaseImageController):
                 self.parent.show_image_view=True
                 self.update_peak_map_choices()
     
+    def nodes_added(self, names):
+        had_images = self.numfiles > 0
+        super(MappableImageController, self).nodes_added(names)
+        if not had_images and self.numfiles > 0:
+            self.init_plot()
+            self._can_crop_cells = True
+            self.parent.show_image_view=True
+            self.update_peak_map_choices()
+
+    @writes_chest
     def add_data(self, data, name):
         super(MappableImageController, self).add_data(data, name)
-        row = self.chest.root.image_description.row
-        row["idx"]=self.chest.root.image_description.nrows
-        row["filename"]="average"
-        row.append()
-        self.chest.root.image_description.flush()
+        from analyzarr.lib.io.data_structure import append_rows
+        table = self.chest.root.image_description
+        append_rows(table, idx=table.nrows, filename="average")
     
     def get_characteristic_name(self):
         return self._characteristics[self._characteristic]
@@ -68,45 +93,57 @@ class MappableImageController(BaseImageController):
     def get_numpeaks(self):
         return self.chest.root.image_peaks.nrows
     
-    def characterize_peaks(self, peak_width=None, progress_object=PyFaceProgress()):
-        from analyzarr.lib.io.data_structure import ImagePeakTable
-        import analyzarr.lib.cv.peak_char as pc
+    def characterize_peaks(self, peak_width=None, progress_object=PyFaceProgress(),
+                           processes=1):
+        """
+        With processes other than 1, images are characterized by the worker
+        processes of a chest opened for concurrent access, which read the 
+        chest themselves (see lib.io.concurrency).  Otherwise, or if the 
+        chest wasn't opened that way, they are characterized here.
+        """
+        from analyzarr.lib.io.data_structure import ImagePeakTable, \
+             get_image_id
+        nodes = self.chest.list_nodes('/rawdata')
+        peak_sets = None
+        if processes != 1:
+            peak_sets = map_chest(self.chest, _characterize_node,
+                                  [(node.name, peak_width) for node in nodes])
         # clear out the existing peak data table
         # TODO: there's probably a better way to intelligently only recalculate
         #    peaks as necessary for new images, or if peak_width changes.
-        try:
-            # wipe out old results
-            self.chest.remove_node('/image_peaks')
-        except:
-            # any errors will be because the table doesn't exist. That's OK.
-            pass
-        self.chest.create_table('/', 'image_peaks', ImagePeakTable)
-        table = self.chest.root.image_peaks
-        nodes = self.chest.list_nodes('/rawdata')
+        with writing(self.chest):
+            try:
+                # wipe out old results
+                self.chest.remove_node('/image_peaks')
+            except:
+                # any errors will be because the table doesn't exist. That's OK.
+                pass
+            self.chest.create_table('/', 'image_peaks', ImagePeakTable)
+            table = self.chest.root.image_peaks
+            table.cols.image_id.create_index()
         progress_object.initialize("Characterizing peaks on images", int(len(
                                                                     nodes)))
-        for node in nodes:
-            # uses default median filter radius of 5 pixels
-            if node.name=="average":
-                peak_data = pc.peak_attribs_image(node[:],xc_filter=False,
-                                                  kill_edges=False)
+        for node_idx, node in enumerate(nodes):
+            if peak_sets is None:
+                peak_data = _peak_attribs(node[:], node.name, peak_width)
             else:
-                peak_data = pc.peak_attribs_image(node[:],peak_width=peak_width)
-            # prepend the filename and index columns
-            dtypes = ['i8','|S250']+['f8']*9
+                peak_data = peak_sets[node_idx]
+            # prepend the index and image id columns
+            dtypes = ['i8','i4']+['f8']*9
             dtypes = zip(table.colnames, dtypes)
             rows = peak_data.shape[0]
             cols = peak_data.shape[1]
-            # prepend the filename and index columns
+            # prepend the index and image id columns
             data = np.zeros(rows,dtype=dtypes)
-            data['filename'] = node.name
+            data['image_id'] = get_image_id(self.chest, node.name)
             data['file_idx'] = np.arange(rows)
             for name_idx in xrange(cols):
                 data[table.colnames[name_idx+2]] = peak_data[:, name_idx]
             # populate the peak_data table
-            self.chest.root.image_peaks.append(data)
-            self.chest.root.image_peaks.flush()
-            self.chest.flush()
+            with writing(self.chest):
+                self.chest.root.image_peaks.append(data)
+                self.chest.root.image_peaks.flush()
+                self.chest.flush()
             progress_object.increment()
             
         # update the menu since we now (probably) have peaks to map.
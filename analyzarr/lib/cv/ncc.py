@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2012, Michael Sarahan
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+    Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+    Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+
+# Normalized cross-correlation (OpenCV's CV_TM_CCOEFF_NORMED) with numpy's 
+#   FFT.  Unlike cv_funcs.xcorr, nothing is quantized to 8 bits, so 16-bit 
+#   and float data keep their precision.  The correlation is done with one 
+#   FFT of the image; the local sums that normalize it come from summed-area
+#   tables.  Template spectra are cached (see get_correlator), and
+#   xcorr_many correlates a series of images in a pool of threads - numpy's 
+#   FFTs and array arithmetic release the GIL.
+
+from collections import OrderedDict
+from itertools import islice
+from threading import Lock
+from time import time
+
+import numpy as np
+
+def _fast_size(n):
+    # the smallest 2**a * 3**b * 5**c >= n - FFTs of these sizes are fast
+    best = 2 * n
+    f5 = 1
+    while f5 < best:
+        f35 = f5
+        while f35 < best:
+            size = f35
+            while size < n:
+                size *= 2
+            best = min(best, size)
+            f35 *= 3
+        f5 *= 5
+    return best
+
+def _window_sums(image, shape):
+    """
+    Returns the sum of image over every shape-sized window that fits in it,
+    from a summed-area table.
+    """
+    table = np.zeros((image.shape[0] + 1, image.shape[1] + 1))
+    np.cumsum(image, axis=0, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    th, tw = shape
+    return (table[th:, tw:] - table[:-th, tw:] - 
+            table[th:, :-tw] + table[:-th, :-tw])
+
+class TemplateCorrelator(object):
+    """
+    Correlates one template with any number of images.  The template is
+    normalized once, and its spectrum is computed once for each FFT size
+    (images of the same shape share one), so only the image is transformed
+    per call.  correlate may be called from several threads at once.
+    """
+    def __init__(self, template):
+        # in double precision: an offset of tens of thousands (16-bit 
+        #   detectors) leaves too much of the mean behind in single
+        template = np.asarray(template, dtype=np.float64)
+        self.shape = template.shape
+        self.template = template - template.mean()
+        # whatever is left of the mean, to take out of the correlation
+        self.residual_mean = self.template.mean()
+        self.norm = np.sqrt(np.sum(self.template**2))
+        # conjugated template spectra, by FFT size
+        self._spectra = {}
+
+    def _spectrum(self, shape):
+        spectrum = self._spectra.get(shape)
+        if spectrum is None:
+            spectrum = np.conj(np.fft.rfft2(self.template, shape))
+            self._spectra[shape] = spectrum
+        return spectrum
+
+    def correlate(self, image):
+        """
+        Returns the normalized cross-correlation of the template with image 
+        - see xcorr.
+        """
+        # removing the image's mean first keeps the numbers small, so the 
+        #   FFT and summed-area tables don't lose the detail to an offset
+        image = np.asarray(image, dtype=np.float64)
+        image = image - image.mean()
+        th, tw = self.shape
+        rows, cols = image.shape
+        if th > rows or tw > cols:
+            raise ValueError("The template (%ix%i) is bigger than the image "
+                             "(%ix%i)." % (th, tw, rows, cols))
+        # correlate by multiplying spectra.  The FFT is at least as big as 
+        #   the image, so the positions we keep don't wrap around.
+        shape = (_fast_size(rows), _fast_size(cols))
+        spectrum = np.fft.rfft2(image, shape)
+        spectrum *= self._spectrum(shape)
+        numerator = np.fft.irfft2(spectrum, shape)[:rows - th + 1, 
+                                                   :cols - tw + 1]
+        # the template has zero mean, so the image's local mean drops out of
+        #   the numerator (but for rounding, taken out here), and only its 
+        #   local variance is needed.
+        sums = _window_sums(image, (th, tw))
+        numerator -= sums * self.residual_mean
+        variance = _window_sums(image**2, (th, tw)) - sums**2 / (th * tw)
+        denominator = self.norm * np.sqrt(np.maximum(variance, 0))
+        result = np.zeros(numerator.shape, dtype=np.float32)
+        # flat windows (or a flat template) correlate with nothing.  The 
+        #   tolerance allows for rounding in the summed-area tables.
+        valid = denominator > 1e-6 * self.norm * np.sqrt(
+            np.mean(image**2) * th * tw)
+        result[valid] = numerator[valid] / denominator[valid]
+        return np.clip(result, -1, 1)
+
+
+# the correlators of the last few templates used, so that redrawing the 
+#   correlation of the same template (e.g. while browsing images) doesn't
+#   transform it again.
+_correlators = OrderedDict()
+_max_correlators = 4
+_correlators_lock = Lock()
+
+def get_correlator(template):
+    """
+    Returns the TemplateCorrelator of template, reusing a recent one for 
+    the same data.
+    """
+    template = np.ascontiguousarray(template)
+    key = (template.shape, template.dtype.str, template.tobytes())
+    with _correlators_lock:
+        correlator = _correlators.pop(key, None)
+        if correlator is None:
+            correlator = TemplateCorrelator(template)
+            if len(_correlators) >= _max_correlators:
+                _correlators.popitem(last=False)
+        _correlators[key] = correlator
+    return correlator
+
+def xcorr(template, image):
+    """
+    Returns the normalized cross-correlation of template with image, for
+    every position of the template that lies entirely inside the image (the
+    top left corner of the template at each pixel of the result).  The 
+    result has shape (rows - template rows + 1, columns - template columns
+    + 1), like OpenCV's matchTemplate with CV_TM_CCOEFF_NORMED.  Values run 
+    from -1 to 1; positions where the image is flat are 0.
+    """
+    return get_correlator(template).correlate(image)
+
+def downsample(image, factor):
+    """
+    Returns image shrunk by factor in each direction, each pixel the mean 
+    of a factor x factor block.  Rows and columns left over are dropped.
+    """
+    image = np.asarray(image, dtype=np.float32)
+    rows = image.shape[0] // factor
+    cols = image.shape[1] // factor
+    blocks = image[:rows * factor, :cols * factor].reshape(
+        rows, factor, cols, factor)
+    return blocks.mean(axis=3).mean(axis=1)
+
+def xcorr_preview(template, coarse_image, factor, shape):
+    """
+    Returns a quick approximation of xcorr(template, image), where 
+    coarse_image is downsample(image, factor) and shape is image's shape.
+    The template is downsampled the same way and correlated with 
+    coarse_image, and the result blown back up to the shape xcorr would 
+    return - about factor**2 times less work.  The template should be at 
+    least 2 * factor pixels across.
+    """
+    th, tw = np.shape(template)
+    coarse = TemplateCorrelator(downsample(template, factor)).correlate(
+        coarse_image)
+    # the blown up result always covers the full one
+    return coarse.repeat(factor, axis=0).repeat(factor, axis=1)[
+        :shape[0] - th + 1, :shape[1] - tw + 1]
+
+def xcorr_many(template, images, func=None, threads=None):
+    """
+    Correlates template with each of images in a pool of threads (one per 
+    CPU by default), yielding the results in order.  If func is given, 
+    func(result) is yielded instead, and is also run in the pool - e.g. to
+    find peaks in each result.
+
+    images may be any iterable, e.g. a generator reading them from a chest.
+    It is only read from the calling thread, one image per thread at a 
+    time, so PyTables nodes can be read this way and only that many images
+    are in memory at once.
+    """
+    from multiprocessing import cpu_count
+    from multiprocessing.pool import ThreadPool
+    correlator = get_correlator(template)
+    if func is None:
+        work = correlator.correlate
+    else:
+        work = lambda image: func(correlator.correlate(image))
+    if threads is None:
+        threads = cpu_count()
+    pool = ThreadPool(threads)
+    try:
+        images = iter(images)
+        while True:
+            batch = list(islice(images, threads))
+            if not batch:
+                break
+            for result in pool.map(work, batch):
+                yield result
+    finally:
+        pool.close()
+        pool.join()
+
+# Tiled correlation, for images too big to correlate in one piece (e.g.
+#   stitched montages).  It is overlap-save: each tile of the result is
+#   correlated from the part of the image under it, plus a template-sized
+#   halo below and to the right, so tiles don't depend on each other and
+#   only one is in memory at a time.
+
+# images with more pixels than this are correlated in tiles by 
+#   CellCropController.locate_peaks
+max_untiled_pixels = 4096 * 4096
+
+def _tile_origins(length, tile_size):
+    return xrange(0, length, tile_size)
+
+def _correlate_region(correlator, source, top, left, bottom, right):
+    # the correlation over result rows top:bottom and columns left:right,
+    #   reading only the part of source those positions cover
+    th, tw = correlator.shape
+    return correlator.correlate(source[top:bottom + th - 1, 
+                                       left:right + tw - 1])
+
+def xcorr_tiles(template, source, tile_size=1024):
+    """
+    Correlates template with source (a 2D array, CArray or memmap) in tiles
+    of at most tile_size x tile_size result pixels, yielding (top, left, 
+    tile) for each, where tile is that part of what xcorr would return.  
+    Only one tile's worth of source is read at a time.
+    """
+    correlator = get_correlator(template)
+    th, tw = correlator.shape
+    rows = source.shape[0] - th + 1
+    cols = source.shape[1] - tw + 1
+    for top in _tile_origins(rows, tile_size):
+        for left in _tile_origins(cols, tile_size):
+            yield top, left, _correlate_region(
+                correlator, source, top, left, 
+                min(top + tile_size, rows), min(left + tile_size, cols))
+
+def find_peaks_tiled(template, source, find_peaks, tile_size=1024, 
+                     margin=None, merge_distance=10):
+    """
+    Finds peaks in the correlation of template with source without 
+    correlating all of it at once.  find_peaks(correlation) is called on
+    each tile and must return an array with one row per peak, starting 
+    with its row and column in the tile (e.g. two_dim_findpeaks).  Returns 
+    the peaks of all tiles, with their row and column in the whole 
+    correlation.
+
+    Each tile is correlated with a margin around it (the template size by 
+    default), so peaks near its borders are found with their surroundings,
+    and only the peaks inside the tile itself are kept.  Peaks of 
+    neighbouring tiles closer than merge_distance are then merged, keeping
+    the higher (third column).
+    """
+    from scipy.spatial import cKDTree
+    correlator = get_correlator(template)
+    th, tw = correlator.shape
+    if margin is None:
+        margin = max(th, tw)
+    rows = source.shape[0] - th + 1
+    cols = source.shape[1] - tw + 1
+    peak_sets = []
+    tile_ids = []
+    for top in _tile_origins(rows, tile_size):
+        bottom = min(top + tile_size, rows)
+        for left in _tile_origins(cols, tile_size):
+            right = min(left + tile_size, cols)
+            region_top = max(top - margin, 0)
+            region_left = max(left - margin, 0)
+            region = _correlate_region(correlator, source, 
+                                       region_top, region_left,
+                                       min(bottom + margin, rows),
+                                       min(right + margin, cols))
+            peaks = np.array(find_peaks(region), dtype=np.float64)
+            if peaks.size == 0:
+                continue
+            peaks[:, 0] += region_top
+            peaks[:, 1] += region_left
+            # keep the peaks of this tile - the margins belong to others
+            own = ((peaks[:, 0] >= top) & (peaks[:, 0] < bottom) &
+                   (peaks[:, 1] >= left) & (peaks[:, 1] < right))
+            peak_sets.append(peaks[own])
+            tile_ids.append(np.repeat(len(tile_ids), own.sum()))
+    if not peak_sets:
+        return np.zeros((0, 3))
+    peaks = np.vstack(peak_sets)
+    tile_ids = np.concatenate(tile_ids)
+    # merge peaks split across tile borders
+    keep = np.ones(len(peaks), dtype=bool)
+    if merge_distance > 0 and len(peaks) > 1:
+        pairs = cKDTree(peaks[:, :2]).query_pairs(merge_distance)
+        for i, j in pairs:
+            if tile_ids[i] != tile_ids[j]:
+                keep[j if peaks[i, 2] >= peaks[j, 2] else i] = False
+    return peaks[keep]
+
+def benchmark_xcorr(template, image, repeat=3):
+    """
+    Times xcorr against the OpenCV version (cv_funcs.xcorr) on the given
+    data.  Returns a dict with the fastest time of each in seconds ('fft'
+    and 'opencv'), and the largest difference between their results.
+    Without OpenCV, only the FFT version is timed.
+    """
+    functions = [('fft', xcorr)]
+    try:
+        from analyzarr.lib.cv import cv_funcs
+        functions.append(('opencv', cv_funcs.xcorr))
+    except ImportError:
+        pass
+    results = {}
+    outputs = {}
+    for name, function in functions:
+        best = None
+        for trial in xrange(repeat):
+            start = time()
+            outputs[name] = function(template, image)
+            elapsed = time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+    if 'opencv' in outputs:
+        results['max_difference'] = float(np.abs(outputs['fft'] - 
+                                                 outputs['opencv']).max())
+    return results
@@ -191,7 +191,7 @@ def two_dim_findpeaks(image, peak_width=None, medfilt_radius=5, xc_filter=True,
              iterate_structure
         from scipy.ndimage import gaussian_filter
         
-        from analyzarr.lib.cv.cv_funcs import xcorr
+        from analyzarr.lib.cv.ncc import xcorr
 
         if medfilt_radius is not None:
             image = medfilt(image, medfilt_radius)
@@ -250,7 +250,8 @@ def two_dim_findpeaks(image, peak_width=None, medfilt_radius=5, xc_filter=True,
         detected_peaks = np.vstack((detected_peaks[0],detected_peaks[1])).T
         
         if kill_duplicates:
-            detected_peaks=_kill_duplicates(detected_peaks)
+            detected_peaks=_kill_duplicates(detected_peaks, heights=
+                cleaned_image[detected_peaks[:,0], detected_peaks[:,1]])
         if kill_edges:
             detected_peaks=_kill_edges(image, detected_peaks, peak_width/8)
         
@@ -264,34 +265,78 @@ def two_dim_findpeaks(image, peak_width=None, medfilt_radius=5, xc_filter=True,
     
         return peaks
 
-def _kill_duplicates(arr, minimum_distance=10):
+def _kill_duplicates(arr, minimum_distance=10, heights=None):
     """
-    Attempts to eliminate garbage coordinates
+    Attempts to eliminate garbage coordinates: of peaks closer together than
+    minimum_distance, only the highest is kept (greedy non-maximum 
+    suppression).
     
-    arr is a 2D array of (npeaks)x4 coordinates.
+    arr is a 2D array of (npeaks)x2 or more coordinates.
         0:1 is the x and y coordinates.
-        2 is the peak height
+        2 is the peak height, if present
         3 is the peak width
+    heights is an array of the peak heights, if arr doesn't have them.  
+    Without heights, the peak listed first is kept.
+
+    Returns the peaks kept, in their original order.
     """
-    import scipy
-    from scipy.spatial import KDTree
-    tree = KDTree(arr)
-    
-    match_list = tree.query_ball_tree(tree,minimum_distance)
-    match_list=[list_item for list_item in match_list if len(list_item)>1]
-    
-    chuck_list=[]
-    
-    for match in match_list:
-        # compile the heights from the table
-        #heights=arr[match][:,2]
-        #best=np.argmax(heights)
-        match.remove(match[0])
-        chuck_list += match
-        
-    keepers = range(arr.shape[0])
-    [keepers.remove(chuck) for chuck in chuck_list if chuck in keepers]
-    return arr[keepers]
+    from scipy.spatial import cKDTree
+    npeaks = arr.shape[0]
+    if npeaks < 2:
+        return arr
+    if heights is None:
+        if arr.shape[1] > 2:
+            heights = arr[:, 2]
+        else:
+            heights = np.zeros(npeaks)
+    # rank 0 is the highest peak; ties go to the one listed first
+    rank = np.empty(npeaks, dtype=np.intp)
+    rank[np.argsort(-np.asarray(heights), kind='mergesort')] = np.arange(
+        npeaks)
+    try:
+        # unbalanced trees build much faster, and are as quick to search 
+        #   for points scattered over an image
+        tree = cKDTree(arr[:, :2], balanced_tree=False, compact_nodes=False)
+        pairs = tree.query_pairs(minimum_distance, output_type='ndarray')
+    except TypeError:
+        # scipy before 0.19 only returns a set
+        tree = cKDTree(arr[:, :2])
+        pairs = np.array(list(tree.query_pairs(minimum_distance)), 
+                         dtype=np.intp).reshape(-1, 2)
+    stronger = np.where(rank[pairs[:, 0]] < rank[pairs[:, 1]], 
+                        pairs[:, 0], pairs[:, 1])
+    weaker = pairs[:, 0] + pairs[:, 1] - stronger
+    # 0: undecided, 1: kept, -1: suppressed.  Peaks are decided from the 
+    #   highest down: a peak is kept unless a stronger neighbour was kept.
+    #   A couple of vectorized rounds settle most of them first - each keeps
+    #   the peaks with no undecided stronger neighbour, and suppresses their
+    #   weaker neighbours.
+    state = np.zeros(npeaks, dtype=np.int8)
+    for round_ in xrange(2):
+        waiting = np.zeros(npeaks, dtype=bool)
+        waiting[weaker] = True
+        state[(state == 0) & ~waiting] = 1
+        state[weaker[state[stronger] == 1]] = -1
+        # only pairs of undecided peaks are left to resolve
+        undecided = (state[stronger] == 0) & (state[weaker] == 0)
+        stronger = stronger[undecided]
+        weaker = weaker[undecided]
+    # the rest (e.g. along chains of peaks getting steadily lower) in one 
+    #   pass in order of height, looking up each one's stronger neighbours 
+    #   in a compressed sparse row list
+    order = np.argsort(weaker, kind='mergesort')
+    neighbours = stronger[order].tolist()
+    starts = np.zeros(npeaks + 1, dtype=np.intp)
+    np.cumsum(np.bincount(weaker, minlength=npeaks), out=starts[1:])
+    starts = starts.tolist()
+    remaining = np.flatnonzero(state == 0)
+    kept = (state >= 0).tolist()
+    for peak in remaining[np.argsort(rank[remaining])].tolist():
+        for neighbour in neighbours[starts[peak]:starts[peak + 1]]:
+            if kept[neighbour]:
+                kept[peak] = False
+                break
+    return arr[np.array(kept, dtype=bool)]
     
 def _kill_edges(image, peaks, edge_width):
     upper_bound_width=image.shape[0]-edge_width
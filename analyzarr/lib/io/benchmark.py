@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2012, Michael Sarahan
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+    Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+    Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+import shutil
+import tempfile
+from time import time
+
+import numpy as np
+import tables as tb
+
+from data_structure import storage_policy, set_storage_policy, \
+     get_chunkshape, CellsTable, append_rows, RowBuffer
+
+# codecs tried when none are given.  Blosc's own compressors are only tried
+#   if this build of PyTables has them.
+default_codecs = ['blosc:blosclz', 'blosc:lz4', 'blosc:lz4hc', 'blosc:zstd',
+                  'zlib']
+default_levels = [1, 3, 5, 8]
+# shuffle modes: none, byte shuffle, bit shuffle
+default_shuffles = ['none', 'byte', 'bit']
+
+kind_paths = {'raw': '/rawdata', 'cells': '/cells'}
+
+def _available_codecs(codecs):
+    try:
+        blosc_codecs = tb.blosc_compressor_list()
+    except AttributeError:
+        blosc_codecs = ['blosclz']
+    available = []
+    for codec in codecs:
+        if codec.startswith('blosc:'):
+            if codec.split(':', 1)[1] not in blosc_codecs:
+                continue
+        elif tb.which_lib_version(codec) is None:
+            continue
+        available.append(codec)
+    return available
+
+def _make_filters(codec, level, shuffle):
+    options = dict(complib=codec, complevel=level, shuffle=(shuffle == 'byte'))
+    if shuffle == 'bit':
+        options['bitshuffle'] = True
+    return tb.Filters(**options)
+
+def sample_chest(h5file, kind='raw', max_bytes=2**26):
+    """
+    Returns a list of arrays read from the chest's datasets of the given
+    kind ('raw' or 'cells'), totalling no more than about max_bytes.  These
+    are the sample benchmark_codecs measures.
+    """
+    sample = []
+    total = 0
+    for node in h5file.list_nodes(kind_paths[kind]):
+        if not isinstance(node, tb.Array):
+            continue
+        if kind == 'cells' and node.name in ('template', 'average'):
+            continue
+        nbytes = node.size_in_memory
+        if sample and total + nbytes > max_bytes:
+            break
+        if nbytes > max_bytes:
+            # one big dataset - take as many leading rows (or frames) as fit
+            rows = max(1, node.shape[0] * max_bytes // nbytes)
+            data = node[:rows]
+        else:
+            data = node[:]
+        sample.append(data)
+        total += data.nbytes
+    if not sample:
+        raise ValueError("No %s data in the chest to sample." % kind)
+    return sample
+
+def benchmark_codecs(data, kind='raw', codecs=None, levels=None,
+                     shuffles=None, repeat=3):
+    """
+    Measures how fast each compression setting writes and reads a sample of
+    data, and how well it compresses it.
+
+    Parameters
+    ----------
+    data : an open chest (tables.File), a numpy array, or a list of arrays
+        When a chest is given, its datasets of the given kind are sampled
+        with sample_chest.
+    kind : 'raw' or 'cells'
+        The kind of dataset the sample stands for.  This sets the chunkshape
+        used, and is the policy recommend_policy changes.
+    codecs, levels, shuffles : lists
+        The settings to try.  Every combination is measured.  shuffles are
+        any of 'none', 'byte' and 'bit'.
+    repeat : int
+        Each write and read is timed this many times, and the fastest kept.
+
+    Returns
+    -------
+    A list with a dict for each setting, fastest writes first:
+        codec, level, shuffle - the setting
+        write, read - throughput in MB/s of uncompressed data
+        ratio - uncompressed size over compressed size
+    """
+    if isinstance(data, tb.File):
+        data = sample_chest(data, kind)
+    elif isinstance(data, np.ndarray):
+        data = [data]
+    if codecs is None:
+        codecs = default_codecs
+    if levels is None:
+        levels = default_levels
+    if shuffles is None:
+        shuffles = default_shuffles
+    codecs = _available_codecs(codecs)
+    try:
+        tb.Filters(complib='blosc', bitshuffle=True)
+    except (TypeError, ValueError):
+        # this PyTables can't bitshuffle
+        shuffles = [shuffle for shuffle in shuffles if shuffle != 'bit']
+    megabytes = sum(arr.nbytes for arr in data) / 2.0**20
+    tmpdir = tempfile.mkdtemp()
+    results = []
+    try:
+        for codec in codecs:
+            for level in levels:
+                for shuffle in shuffles:
+                    # only blosc can bitshuffle
+                    if shuffle == 'bit' and not codec.startswith('blosc'):
+                        continue
+                    filters = _make_filters(codec, level, shuffle)
+                    result = _time_setting(os.path.join(tmpdir, 'bench.h5'),
+                                           data, kind, filters, repeat)
+                    result.update(codec=codec, level=level, shuffle=shuffle)
+                    result['write'] = megabytes / result['write']
+                    result['read'] = megabytes / result['read']
+                    results.append(result)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    results.sort(key=lambda result: -result['write'])
+    return results
+
+def _time_setting(filename, data, kind, filters, repeat):
+    write_time = read_time = None
+    for trial in xrange(repeat):
+        h5file = tb.open_file(filename, 'w')
+        try:
+            start = time()
+            arrays = []
+            for idx, arr in enumerate(data):
+                ds = h5file.create_carray('/', 'data%i' % idx,
+                            tb.Atom.from_dtype(arr.dtype), arr.shape,
+                            filters=filters,
+                            chunkshape=get_chunkshape(kind, arr.shape,
+                                                      arr.dtype))
+                ds[:] = arr
+                arrays.append(ds)
+            h5file.flush()
+            elapsed = time() - start
+            write_time = elapsed if write_time is None else \
+                         min(write_time, elapsed)
+            stored = sum(ds.size_on_disk for ds in arrays)
+            in_memory = sum(ds.size_in_memory for ds in arrays)
+        finally:
+            h5file.close()
+        h5file = tb.open_file(filename, 'r')
+        try:
+            start = time()
+            for node in h5file.list_nodes('/'):
+                node[:]
+            elapsed = time() - start
+            read_time = elapsed if read_time is None else \
+                        min(read_time, elapsed)
+        finally:
+            h5file.close()
+    # guard against timer resolution on tiny samples
+    return dict(write=max(write_time, 1e-6), read=max(read_time, 1e-6),
+                ratio=float(in_memory) / max(stored, 1))
+
+def recommend_policy(results, kind='raw', ratio_tolerance=0.9, apply=False):
+    """
+    Picks the setting from benchmark_codecs results that writes fastest while
+    compressing at least ratio_tolerance times as well as the best setting
+    measured.  Ties in write speed are broken by read speed.
+
+    Returns a dict of storage policy settings for the kind of dataset.  If
+    apply is True, the policy is also set with
+    data_structure.set_storage_policy, so it is used for new datasets.
+    """
+    if not results:
+        raise ValueError("No benchmark results to recommend a policy from.")
+    best_ratio = max(result['ratio'] for result in results)
+    candidates = [result for result in results
+                  if result['ratio'] >= ratio_tolerance * best_ratio]
+    best = max(candidates, key=lambda result: (result['write'],
+                                                result['read']))
+    policy = dict(complib=best['codec'], complevel=best['level'],
+                  shuffle=(best['shuffle'] == 'byte'),
+                  bitshuffle=(best['shuffle'] == 'bit'),
+                  chunk_bytes=storage_policy[kind]['chunk_bytes'])
+    if apply:
+        set_storage_policy(kind, **policy)
+    return policy
+
+def format_results(results):
+    """
+    Returns the benchmark_codecs results as a text table.
+    """
+    lines = ['%-15s %5s %7s %10s %10s %7s' % ('codec', 'level', 'shuffle',
+                                               'write MB/s', 'read MB/s',
+                                               'ratio')]
+    for result in results:
+        lines.append('%-15s %5i %7s %10.1f %10.1f %7.2f' % (
+            result['codec'], result['level'], result['shuffle'],
+            result['write'], result['read'], result['ratio']))
+    return '\n'.join(lines)
+
+def benchmark_appends(nrows=100000, repeat=3):
+    """
+    Measures how fast rows are added to a table like cell_description: one
+    at a time through table.row, through a RowBuffer, and all at once with
+    append_rows.  Returns a dict of rows per second for each ('row', 
+    'buffer' and 'bulk'), the fastest of repeat runs.
+    """
+    x = np.random.random(nrows) * 1000
+    y = np.random.random(nrows) * 1000
+    def by_row(table):
+        row = table.row
+        for i in xrange(nrows):
+            row['file_idx'] = i
+            row['input_data'] = '/rawdata'
+            row['image_id'] = 0
+            row['x_coordinate'] = x[i]
+            row['y_coordinate'] = y[i]
+            row.append()
+        table.flush()
+    def by_buffer(table):
+        with RowBuffer(table) as rows:
+            for i in xrange(nrows):
+                rows.add(file_idx=i, input_data='/rawdata', image_id=0,
+                         x_coordinate=x[i], y_coordinate=y[i])
+    def in_bulk(table):
+        append_rows(table, nrows, file_idx=np.arange(nrows), 
+                    input_data='/rawdata', image_id=0, x_coordinate=x,
+                    y_coordinate=y)
+    tmpdir = tempfile.mkdtemp()
+    results = {}
+    try:
+        filename = os.path.join(tmpdir, 'bench.h5')
+        for name, append in (('row', by_row), ('buffer', by_buffer), 
+                             ('bulk', in_bulk)):
+            best = None
+            for trial in xrange(repeat):
+                h5file = tb.open_file(filename, 'w')
+                try:
+                    table = h5file.create_table('/', 'cells', CellsTable)
+                    start = time()
+                    append(table)
+                    elapsed = max(time() - start, 1e-6)
+                finally:
+                    h5file.close()
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = nrows / best
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return results
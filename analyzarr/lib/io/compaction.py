@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2012, Michael Sarahan
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+    Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+    Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Chest compaction.  HDF5 doesn't give back the space of removed nodes, and
+#   peak characterization, cell cropping and MDA remove and recreate their
+#   results every time they're run - so chests grow well beyond the size of
+#   the data in them.  compact_chest copies everything still in a chest into
+#   a new file, written with the current storage policy, and puts it in the
+#   place of the old one.
+
+import os
+import shutil
+import sys
+import tempfile
+from time import time
+
+import tables as tb
+
+from data_structure import get_filters, get_chunkshape
+from concurrency import ChestLock
+
+def _array_kind(node):
+    # the storage policy kind of an array, by where it lives in the chest
+    path = node._v_pathname
+    if path.startswith('/rawdata/') or path.startswith('/pyramids/'):
+        return 'raw'
+    if path.startswith('/cells/'):
+        return 'cells'
+    if path.startswith('/mda_results/'):
+        if node.name == 'image_factors':
+            return 'factors'
+        if node.name == 'Eigenvalues':
+            return 'eigenvalues'
+    return None
+
+def _copy_leaf(node, parent):
+    if isinstance(node, tb.Table):
+        # tables keep their own filters, and their indexes are rebuilt
+        return node.copy(parent, node.name, propindexes=True)
+    kind = _array_kind(node)
+    if kind is None or not isinstance(node, tb.CArray):
+        return node.copy(parent, node.name)
+    return node.copy(parent, node.name, filters=get_filters(kind),
+                     chunkshape=get_chunkshape(kind, node.shape, node.dtype))
+
+def _copy_chest(src, dst):
+    src.root._v_attrs._f_copy(dst.root)
+    for group in src.walk_groups('/'):
+        if group._v_pathname == '/':
+            new_group = dst.root
+        else:
+            new_group = dst.create_group(group._v_parent._v_pathname,
+                                         group._v_name, group._v_title)
+            group._v_attrs._f_copy(new_group)
+        for node in src.list_nodes(group, classname='Leaf'):
+            _copy_leaf(node, new_group)
+
+def _replace(tmpname, filename):
+    try:
+        os.rename(tmpname, filename)
+    except OSError:
+        if sys.platform != 'win32':
+            raise
+        # Windows won't rename over an existing file
+        os.remove(filename)
+        os.rename(tmpname, filename)
+
+def compact_chest(filename):
+    """
+    Repacks a chest into a new file, leaving out the space of removed nodes
+    and rewriting its datasets with the current storage policy (see
+    data_structure.storage_policy).  The chest must not be open.
+
+    The new file is written next to the old one, and only renamed over it
+    once it is complete, so an interrupted compaction leaves the chest as it
+    was.  If the chest is shared (see concurrency.py), readers are kept out
+    until the new file is in place.
+
+    Returns a dict with the size in bytes before and after, the bytes
+    reclaimed, and the time taken in seconds.
+    """
+    start = time()
+    filename = os.path.abspath(filename)
+    lock = None
+    if os.path.exists(filename + '.lock'):
+        lock = ChestLock(filename)
+        lock.acquire(exclusive=True)
+    try:
+        before = os.path.getsize(filename)
+        fd, tmpname = tempfile.mkstemp(suffix='.compacting',
+                                       dir=os.path.dirname(filename))
+        os.close(fd)
+        try:
+            src = tb.open_file(filename, 'r')
+            try:
+                dst = tb.open_file(tmpname, 'w', title=src.title)
+                try:
+                    _copy_chest(src, dst)
+                finally:
+                    dst.close()
+            finally:
+                src.close()
+            # make sure the new file is on disk before it replaces the old
+            with open(tmpname, 'rb') as f:
+                os.fsync(f.fileno())
+            # mkstemp makes files only the owner can read
+            shutil.copymode(filename, tmpname)
+            _replace(tmpname, filename)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+        if lock is not None:
+            # readers must reopen - their file is gone
+            lock.set_generation(lock.get_generation() + 1)
+    finally:
+        if lock is not None:
+            lock.release()
+            lock.close()
+    after = os.path.getsize(filename)
+    return dict(before=before, after=after, reclaimed=before - after,
+                seconds=time() - start)
+
+def format_report(report):
+    """
+    Returns a compact_chest report as a line of text.
+    """
+    mb = 2.0**20
+    return ("Compacted %.1f MB to %.1f MB (%.1f MB reclaimed) in %.1f s" % (
+            report['before'] / mb, report['after'] / mb,
+            report['reclaimed'] / mb, report['seconds']))
+
+if __name__ == '__main__':
+    # python -m analyzarr.lib.io.compaction chest [chest ...]
+    for chest in sys.argv[1:]:
+        print "%s: %s" % (chest, format_report(compact_chest(chest)))
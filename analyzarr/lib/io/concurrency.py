@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2012, Michael Sarahan
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+    Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+    Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# One writer, many readers.  PyTables can't use HDF5's SWMR mode, so a chest
+#   opened for concurrent access is shared with a lock file next to it
+#   (<chest>.lock):
+#
+#   - the writer (the GUI session) keeps the chest open as usual, but holds
+#     the lock exclusively while it writes, and flushes before letting go.
+#     Each time it lets go, it counts up the generation number kept in the
+#     lock file.
+#   - readers (worker processes) open the chest read-only, and only read it
+#     while holding the lock shared.  When the generation has changed since
+#     they last read, they reopen the chest first, so they never use
+#     metadata the writer has since changed.
+#
+# Readers should hold the lock only as long as it takes to read their
+#   inputs - the writer waits for them.
+
+# HDF5's own file locking, which would stop readers opening a chest that
+#   is open for writing, has to be off - the lock file does that job here.
+#   HDF5 only looks at the setting when PyTables is first imported, so it 
+#   is turned off for the whole session, and only when asked for with 
+#   ANALYZARR_CONCURRENT=1 (see analyzarr/__init__.py).
+
+import os
+import weakref
+from contextlib import contextmanager
+from functools import wraps
+
+import tables as tb
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no shared locks - readers take turns.
+    fcntl = None
+    import msvcrt
+
+def check_file_locking():
+    """
+    Raises RuntimeError unless HDF5's file locking is turned off, as sharing
+    a chest needs.
+    """
+    if os.environ.get('HDF5_USE_FILE_LOCKING', '').upper() != 'FALSE':
+        raise RuntimeError("Concurrent chests need HDF5's file locking "
+                           "turned off: set ANALYZARR_CONCURRENT=1 (or "
+                           "HDF5_USE_FILE_LOCKING=FALSE) before starting "
+                           "analyzarr.")
+
+def _lock_filename(filename):
+    return os.path.abspath(filename) + '.lock'
+
+class ChestLock(object):
+    """
+    The lock file of a chest, which also holds its generation number.
+    """
+    def __init__(self, filename):
+        self.filename = _lock_filename(filename)
+        self._fobj = open(self.filename, 'a+b')
+
+    def acquire(self, exclusive=False):
+        if fcntl is not None:
+            fcntl.flock(self._fobj.fileno(),
+                        fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        else:
+            self._fobj.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._fobj.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except IOError:
+                    # LK_LOCK gives up after 10 seconds
+                    pass
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._fobj.fileno(), fcntl.LOCK_UN)
+        else:
+            self._fobj.seek(0)
+            msvcrt.locking(self._fobj.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @contextmanager
+    def held(self, exclusive=False):
+        self.acquire(exclusive)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_generation(self):
+        self._fobj.seek(0)
+        text = self._fobj.read().strip()
+        return int(text) if text else 0
+
+    def set_generation(self, generation):
+        self._fobj.seek(0)
+        self._fobj.truncate()
+        self._fobj.write(str(generation).encode('ascii'))
+        self._fobj.flush()
+        os.fsync(self._fobj.fileno())
+
+    def close(self):
+        self._fobj.close()
+
+
+class ChestWriter(object):
+    """
+    The writing side of a chest opened for concurrent access.  Wrap writes
+    in writing(); nested calls share the outer one's lock.
+    """
+    def __init__(self, h5file):
+        self.h5file = h5file
+        self.lock = ChestLock(h5file.filename)
+        self._depth = 0
+
+    @contextmanager
+    def writing(self):
+        if self._depth == 0:
+            self.lock.acquire(exclusive=True)
+        self._depth += 1
+        try:
+            yield self.h5file
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                try:
+                    self.h5file.flush()
+                    self.lock.set_generation(self.lock.get_generation() + 1)
+                finally:
+                    self.lock.release()
+
+    def close(self):
+        self.lock.close()
+
+
+class ChestReader(object):
+    """
+    The reading side of a chest opened for concurrent access, for use in
+    another process.  Read inside reading(), which yields the chest (opened
+    read-only, and reopened if the writer has changed it since the last
+    read).  Nodes must not be kept from one reading() to the next.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = ChestLock(filename)
+        self.h5file = None
+        self._generation = None
+
+    @contextmanager
+    def reading(self):
+        with self.lock.held():
+            generation = self.lock.get_generation()
+            if self.h5file is None or generation != self._generation:
+                if self.h5file is not None:
+                    self.h5file.close()
+                self.h5file = tb.open_file(self.filename, 'r')
+                self._generation = generation
+            yield self.h5file
+
+    def close(self):
+        if self.h5file is not None:
+            self.h5file.close()
+            self.h5file = None
+        self.lock.close()
+
+
+# the writer of each chest opened for concurrent access
+_writers = weakref.WeakKeyDictionary()
+
+def share_chest(h5file):
+    """
+    Makes h5file (open for writing) the writer of a chest shared with reader
+    processes, and returns its ChestWriter.
+    """
+    check_file_locking()
+    if h5file not in _writers:
+        _writers[h5file] = ChestWriter(h5file)
+    return _writers[h5file]
+
+def get_writer(h5file):
+    """
+    Returns the ChestWriter of h5file, or None if it isn't shared.
+    """
+    if h5file is None:
+        return None
+    return _writers.get(h5file)
+
+@contextmanager
+def writing(h5file):
+    """
+    Holds the write lock of h5file while writing, if it is shared.
+    """
+    writer = get_writer(h5file)
+    if writer is None:
+        yield h5file
+    else:
+        with writer.writing():
+            yield h5file
+
+def writes_chest(method):
+    """
+    Decorator for controller methods that write to self.chest.  When the
+    chest is shared, readers wait until the method is done.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kw):
+        with writing(self.chest):
+            return method(self, *args, **kw)
+    return wrapper
+
+
+# The pool of reader processes.  A process forked while a chest is open
+#   shares HDF5's view of that file with its parent, and would never see
+#   what the writer adds, even after reopening it.  So the workers are 
+#   started before the chest is opened, and kept for later chests.
+_pool = None
+# each worker's readers, by chest filename
+_readers = {}
+
+def start_workers(processes=None):
+    """
+    Starts the worker processes used by map_chest (one per CPU by default),
+    if they aren't running yet.  Call this before opening the chests they
+    will read - open_treasure_chest does, for concurrent chests.
+    """
+    global _pool
+    check_file_locking()
+    if _pool is None:
+        from multiprocessing import Pool
+        _pool = Pool(processes)
+    return _pool
+
+def stop_workers():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+
+def _call_worker(args):
+    filename, func, item = args
+    if filename not in _readers:
+        _readers[filename] = ChestReader(filename)
+    return func(_readers[filename], item)
+
+class _LocalReader(object):
+    # reads the writer's own handle, for map_chest without workers
+    def __init__(self, h5file):
+        self.h5file = h5file
+
+    @contextmanager
+    def reading(self):
+        yield self.h5file
+
+def map_chest(h5file, func, items):
+    """
+    Calls func(reader, item) for each item in the worker processes (see
+    start_workers), and returns the results in order.  Each worker reads 
+    the chest through its own ChestReader, so the chest is not copied.  func
+    must be a module-level function, and should hold reader.reading() only
+    while it reads, e.g.:
+
+        def characterize(reader, name):
+            with reader.reading() as h5file:
+                data = h5file.get_node('/rawdata', name)[:]
+            return peak_attribs_image(data)
+
+    Results are returned to this process to be written by the writer.  
+    Pending writes are flushed first, so the workers see them.  Without 
+    workers, or if the chest isn't shared, func is called here instead.
+    """
+    writer = get_writer(h5file)
+    if _pool is None or writer is None:
+        reader = _LocalReader(h5file)
+        return [func(reader, item) for item in items]
+    if writer._depth > 0:
+        # the workers would wait for the write lock forever
+        raise RuntimeError("map_chest can't be used while writing the chest.")
+    with writer.writing():
+        h5file.flush()
+    filename = os.path.abspath(h5file.filename)
+    return _pool.map(_call_worker, [(filename, func, item) for item in items])
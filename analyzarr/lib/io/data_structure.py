@@ -11,10 +11,95 @@ Redistribution and use in source and binary forms, with or without modification,
 THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import warnings
+import weakref
+
+import numpy as np
 import tables
 
+# the old one-size-fits-all setting.  New datasets use get_filters(kind).
 filters = tables.Filters(complib='blosc', complevel=8)
 
+# how each kind of dataset is stored: codec, compression level, shuffle mode
+#   and the rough size of a chunk in bytes.  Our data are noisy, so high 
+#   compression levels cost a lot of write time for very little gain.  Use
+#   set_storage_policy (or io.benchmark.benchmark_codecs on your own data) to
+#   change these.
+storage_policy = {
+    # raw images are chunked in tiles of whole rows.
+    'raw': dict(complib='blosc', complevel=3, shuffle=True, bitshuffle=False,
+                chunk_bytes=2**18),
+    # cell stacks are chunked in whole cells (template size).
+    'cells': dict(complib='blosc', complevel=3, shuffle=True, 
+                  bitshuffle=False, chunk_bytes=2**18),
+    # spectrum images are chunked in tiles of pixels with whole spectra.
+    'spectra': dict(complib='blosc', complevel=3, shuffle=True, 
+                    bitshuffle=False, chunk_bytes=2**20),
+    'factors': dict(complib='blosc', complevel=5, shuffle=True, 
+                    bitshuffle=False, chunk_bytes=None),
+    'eigenvalues': dict(complib='blosc', complevel=5, shuffle=True, 
+                        bitshuffle=False, chunk_bytes=None),
+    }
+
+def set_storage_policy(kind, **settings):
+    """
+    Changes how new datasets of the given kind ('raw', 'cells', 'spectra', 
+    'factors' or 'eigenvalues') are stored.  settings are any of complib, complevel, 
+    shuffle, bitshuffle and chunk_bytes.  Existing datasets are not changed.
+    """
+    if kind not in storage_policy:
+        raise ValueError("Unknown kind of dataset: %s" % kind)
+    for key in settings:
+        if key not in storage_policy[kind]:
+            raise ValueError("Unknown storage setting: %s" % key)
+    storage_policy[kind].update(settings)
+
+def get_filters(kind):
+    """
+    Returns the tables.Filters for a kind of dataset.
+    """
+    policy = storage_policy[kind]
+    options = dict(complib=policy['complib'], complevel=policy['complevel'],
+                   shuffle=policy['shuffle'])
+    # older PyTables doesn't know bitshuffle - only ask for it when it's on.
+    if policy['bitshuffle']:
+        options['shuffle'] = False
+        options['bitshuffle'] = True
+    return tables.Filters(**options)
+
+def get_chunkshape(kind, shape, dtype):
+    """
+    Returns the chunkshape for a new dataset of the given kind, or None to 
+    let PyTables pick.
+    
+    raw images (2D, or 3D stacks of frames) are chunked in tiles of whole 
+    rows, so that reading a region of an image touches few chunks.  Cell 
+    stacks (cells, rows, columns) are chunked in whole cells, so a chunk 
+    always holds complete cells.  Spectrum images (rows, columns, energy) 
+    are chunked in square tiles of pixels, each with its whole spectrum, so
+    a pixel's spectrum is one chunk, and a map of any energy window reads
+    each chunk once.
+    """
+    chunk_bytes = storage_policy[kind]['chunk_bytes']
+    if chunk_bytes is None or len(shape) not in (2, 3) or 0 in shape:
+        return None
+    itemsize = np.dtype(dtype).itemsize
+    if kind == 'cells':
+        if len(shape) != 3:
+            return None
+        cell_bytes = shape[1] * shape[2] * itemsize
+        ncells = max(1, min(shape[0], chunk_bytes // cell_bytes))
+        return (ncells, shape[1], shape[2])
+    if kind == 'spectra':
+        npixels = max(1, chunk_bytes // (shape[-1] * itemsize))
+        if len(shape) == 2:
+            return (min(shape[0], npixels), shape[-1])
+        side = max(1, int(np.sqrt(npixels)))
+        return (min(shape[0], side), min(shape[1], side), shape[-1])
+    row_bytes = shape[-1] * itemsize
+    nrows = max(1, min(shape[-2], chunk_bytes // row_bytes))
+    return (1,) * (len(shape) - 2) + (nrows, shape[-1])
+
 class MdaResultsTable(tables.IsDescription):
     idx = tables.Int64Col(pos=0)
     # the MDA type and the date it was run - an identifier for each run.
@@ -36,14 +121,17 @@ class ImageDataTable(tables.IsDescription):
     filename = tables.StringCol(250)
     # treatments - any prior processing (for example, reconstruction)
     treatments = tables.StringCol(250)
+    # hash of the file's contents, prefixed by the hash name (xxh64:..., 
+    #   sha1:...) - used to spot files that are already imported.
+    content_hash = tables.StringCol(48)
 
 
 class ImagePeakTable(tables.IsDescription):
     file_idx = tables.Int64Col(pos=0)
     # metadata = tables.
     # attributes - tags
-    # name of a file
-    filename = tables.StringCol(250, pos=1)
+    # the image the peak is on (its row in image_description)
+    image_id = tables.Int32Col(pos=1)
     # peak position on parent image
     x = tables.Float64Col(pos=2)
     y = tables.Float64Col(pos=3)
@@ -67,8 +155,8 @@ class CellsTable(tables.IsDescription):
     # description of where data came from (as a path in the file, for example:
     # '/root/rawdata'
     input_data = tables.StringCol(250)
-    # filename that the data is from
-    filename = tables.StringCol(250,pos=1)
+    # the image that the data is from (its row in image_description)
+    image_id = tables.Int32Col(pos=1)
     # the upper left coordinate of the parent image where this
     # cell was cropped from.
     x_coordinate = tables.Float32Col(pos=3)
@@ -83,6 +171,32 @@ class LogTable(tables.IsDescription):
     version = tables.StringCol(20,pos=3)
 
 
+class ImportManifestTable(tables.IsDescription):
+    # full path of a file in a journaled import
+    path = tables.StringCol(500, pos=0)
+    # size and modification time of the file when it was imported
+    size = tables.Int64Col(pos=1)
+    mtime = tables.Float64Col(pos=2)
+    # the name of its data in /rawdata
+    node_name = tables.StringCol(250, pos=3)
+    # pending, done, or aborted (the import stopped before it was done)
+    state = tables.StringCol(10, pos=4)
+    # which part of the file was imported - see file_import._import_variant
+    variant = tables.StringCol(250, pos=5)
+
+
+class ImageMetadataTable(tables.IsDescription):
+    # the image the tag belongs to (its row in image_description)
+    image_id = tables.Int32Col(pos=0)
+    # the tag's path in the file's tag tree, e.g. for DM3:
+    #   'ImageTags.Microscope Info.Indicated Magnification'
+    key = tables.StringCol(255, pos=1)
+    # numbers (and booleans) are stored in value; strings in text, with
+    #   value NaN.
+    value = tables.Float64Col(pos=2)
+    text = tables.StringCol(255, pos=3)
+
+
 class SpectrumDataTable(tables.IsDescription):
     idx = tables.Int64Col(pos=0)
     # name of a file
@@ -91,17 +205,94 @@ class SpectrumDataTable(tables.IsDescription):
     treatments = tables.StringCol(250)
 
 
+def make_rows(table, nrows, **columns):
+    """
+    Returns a structured array of nrows rows for table, with the given 
+    columns filled in.  Each column is a value for every row, or a sequence
+    of nrows values.  Other columns hold the table's defaults.
+    """
+    rows = np.zeros(nrows, dtype=table.dtype)
+    for name, default in table.coldflts.iteritems():
+        if name not in columns:
+            rows[name] = default
+    for name, values in columns.iteritems():
+        rows[name] = values
+    return rows
+
+def append_rows(table, nrows=1, **columns):
+    """
+    Appends nrows rows to table in one call - see make_rows.  Much faster 
+    than appending them one at a time through table.row.
+    """
+    if nrows > 0:
+        table.append(make_rows(table, nrows, **columns))
+        table.flush()
+
+class RowBuffer(object):
+    """
+    Collects rows that are made one at a time, and appends them to a table
+    in batches of batch_size.  Use as a context manager, so that any rows 
+    left over are appended at the end (even if an error stops the writing).
+    """
+    def __init__(self, table, batch_size=1024):
+        self.table = table
+        self.batch_size = batch_size
+        self._rows = []
+
+    def add(self, **columns):
+        self._rows.append(columns)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    @property
+    def next_row(self):
+        """
+        The row number in the table that the next row added will have.
+        """
+        return self.table.nrows + len(self._rows)
+
+    def flush(self):
+        if self._rows:
+            # fill in whole columns at once - setting fields row by row is 
+            #   no faster than table.row
+            names = set()
+            for row in self._rows:
+                names.update(row)
+            defaults = self.table.coldflts
+            columns = dict((name, [row.get(name, defaults[name]) 
+                                   for row in self._rows]) for name in names)
+            self.table.append(make_rows(self.table, len(self._rows), 
+                                        **columns))
+            self._rows = []
+        self.table.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
 def get_image_h5file(filename):
     # split off any extension in the filename - we add our own.
     h5file = tables.open_file('%s.chest' % filename, 'w')
 
     # data outline keeps records of what data are available - the linkage
     # between which cells came from which images, locations, etc.
-    h5file.create_table('/', 'image_description', ImageDataTable)
+    image_description = h5file.create_table('/', 'image_description', 
+                                             ImageDataTable)
+    # imports look images up by content hash and by name; index both so that
+    #   doesn't scan the whole table.
+    image_description.cols.content_hash.create_index()
+    image_description.cols.filename.create_index()
     
-    h5file.create_table('/', 'image_peaks', ImagePeakTable)
+    # peaks and cells are looked up by the image they're on.
+    image_peaks = h5file.create_table('/', 'image_peaks', ImagePeakTable)
+    image_peaks.cols.image_id.create_index()
 
-    h5file.create_table('/', 'cell_description', CellsTable)
+    cell_description = h5file.create_table('/', 'cell_description', 
+                                           CellsTable)
+    cell_description.cols.image_id.create_index()
 
     h5file.create_table('/', 'mda_description', MdaResultsTable)
     #cell_peak_table = h5file.create_table('/', 'cell_peaks',
@@ -149,15 +340,227 @@ def get_image_h5file(filename):
     return h5file
 
 
+class ImageIds(object):
+    """
+    Maps image names to image ids and back.  An image's id is its row in 
+    the image_description table; the peak, cell and score tables store the 
+    id rather than repeating the image's name on every row.
+    
+    Rows are only ever added to image_description, so the map just reads 
+    any rows added since it last looked.
+    """
+    def __init__(self, h5file):
+        self.h5file = h5file
+        self._ids = {}
+        self._names = []
+
+    def _update(self):
+        table = self.h5file.root.image_description
+        if table.nrows > len(self._names):
+            for name in table.read(start=len(self._names), field='filename'):
+                self._ids.setdefault(name, len(self._names))
+                self._names.append(name)
+
+    def get_id(self, name):
+        if name not in self._ids:
+            self._update()
+        try:
+            return self._ids[name]
+        except KeyError:
+            raise ValueError("No image named %s in the chest." % name)
+
+    def get_name(self, image_id):
+        if image_id >= len(self._names):
+            self._update()
+        return self._names[image_id]
+
+# one map per open chest - it goes away with the chest.
+_image_ids = weakref.WeakKeyDictionary()
+
+def get_image_ids(h5file):
+    if h5file not in _image_ids:
+        _image_ids[h5file] = ImageIds(h5file)
+    return _image_ids[h5file]
+
+def get_image_id(h5file, name):
+    return get_image_ids(h5file).get_id(name)
+
+def get_image_name(h5file, image_id):
+    return get_image_ids(h5file).get_name(image_id)
+
+def upgrade_image_ids(h5file):
+    """
+    Chests made before image ids had the image's name in a filename column
+    of the peak, cell and score tables.  This replaces that column with the
+    image_id column in each of those tables.  Images that aren't in
+    image_description (yet) get an id of -1.
+    """
+    tables_to_check = [name for name in ('image_peaks', 'cell_description',
+                                         'cell_peaks') if name in h5file.root]
+    if 'mda_results' in h5file.root:
+        for node in h5file.walk_nodes('/mda_results', classname='Table'):
+            if node.name in ('image_scores', 'peak_scores'):
+                tables_to_check.append(node._v_pathname)
+    ids = get_image_ids(h5file)
+    for path in tables_to_check:
+        table = h5file.get_node('/' + path.lstrip('/'))
+        if 'filename' not in table.colnames or 'image_id' in table.colnames:
+            continue
+        dtypes = [('image_id', '<i4') if name == 'filename' else 
+                  (name, dtype) for name, dtype in table.dtype.descr]
+        old_data = table.read()
+        data = np.zeros(old_data.shape, dtype=dtypes)
+        for name in table.colnames:
+            if name != 'filename':
+                data[name] = old_data[name]
+        names, inverse = np.unique(old_data['filename'], return_inverse=True)
+        image_ids = []
+        for name in names:
+            try:
+                image_ids.append(ids.get_id(name))
+            except ValueError:
+                image_ids.append(-1)
+        data['image_id'] = np.array(image_ids, dtype='i4')[inverse]
+        new_table = h5file.create_table(table._v_parent, 
+                                        '_upgrading_' + table.name,
+                                        description=np.zeros((0,), 
+                                                             dtype=dtypes),
+                                        filters=table.filters)
+        new_table.append(data)
+        new_table.cols.image_id.create_index()
+        table.attrs._f_copy(new_table)
+        name = table.name
+        table.remove()
+        new_table.move(newname=name)
+    h5file.flush()
+
+
+def get_import_manifest(h5file):
+    # made on first use, so chests from before journaled imports get one too.
+    if '/import_manifest' in h5file:
+        return _upgrade_import_manifest(h5file)
+    manifest = h5file.create_table('/', 'import_manifest', 
+                                   ImportManifestTable)
+    manifest.cols.path.create_index()
+    h5file.flush()
+    return manifest
+
+
+def _upgrade_import_manifest(h5file):
+    # manifests from before the variant column are copied into a new table,
+    #   their rows having the variant of a plain import ('').
+    manifest = h5file.root.import_manifest
+    if 'variant' in manifest.colnames:
+        return manifest
+    old_data = manifest.read()
+    new_table = h5file.create_table('/', '_upgrading_import_manifest', 
+                                    ImportManifestTable, 
+                                    expectedrows=max(len(old_data), 1))
+    if len(old_data):
+        data = np.zeros(old_data.shape, dtype=new_table.dtype)
+        for name in manifest.colnames:
+            data[name] = old_data[name]
+        new_table.append(data)
+    new_table.cols.path.create_index()
+    manifest.attrs._f_copy(new_table)
+    manifest.remove()
+    new_table.move(newname='import_manifest')
+    h5file.flush()
+    return new_table
+
+
+def get_metadata_table(h5file):
+    # made on first use, like the import manifest.  Queries are by tag, and 
+    #   an image's tags are looked up by its id - index both.
+    if '/image_metadata' in h5file:
+        return h5file.root.image_metadata
+    table = h5file.create_table('/', 'image_metadata', ImageMetadataTable)
+    table.cols.key.create_index()
+    table.cols.image_id.create_index()
+    h5file.flush()
+    return table
+
+def _metadata_string(table, column, text):
+    # text as stored in a string column of the metadata table: utf-8, and
+    #   cut to the column's width (older chests have narrower columns)
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    width = table.coldtypes[column].itemsize
+    if len(text) > width:
+        warnings.warn("image_metadata %s longer than %i characters cut off:"
+                      " %r" % (column, width, text))
+        text = text[:width]
+    return text
+
+def add_image_metadata(h5file, image_id, tags):
+    """
+    Stores a dictionary of tags for an image in the image_metadata table.
+    Only numbers and strings are stored; anything else is left out.  Keys 
+    and strings too long for the table are cut off, with a warning.
+    """
+    table = get_metadata_table(h5file)
+    rows = []
+    for key, value in sorted(tags.iteritems()):
+        if isinstance(value, basestring):
+            rows.append((image_id, _metadata_string(table, 'key', key), 
+                         np.nan, _metadata_string(table, 'text', value)))
+        elif isinstance(value, (bool, int, long, float, np.number)):
+            rows.append((image_id, _metadata_string(table, 'key', key), 
+                         float(value), ''))
+    if rows:
+        table.append(rows)
+        table.flush()
+
+def get_image_metadata(h5file, name):
+    """
+    Returns the stored tags of an image as a dictionary.
+    """
+    if '/image_metadata' not in h5file:
+        return {}
+    tags = {}
+    for row in h5file.root.image_metadata.where(
+            'image_id == value', condvars={'value': get_image_id(h5file, name)}):
+        if np.isnan(row['value']):
+            tags[row['key']] = row['text']
+        else:
+            tags[row['key']] = row['value']
+    return tags
+
+def select_images(h5file, key, condition=None):
+    """
+    Returns the names of the images that have the tag key, and for which 
+    condition holds.  condition is a PyTables condition on the value or
+    text columns, e.g. 'value > 0.5' or 'text == "TEM"'.  Combine selections
+    with set operations, e.g. all frames at 8 MX, exposed for over 0.5 s:
+
+        select_images(h5file, 'ImageTags.Microscope Info.Indicated '
+                      'Magnification', 'value == 8e6') & \
+        select_images(h5file, 'ImageTags.DataBar.Exposure Time (s)', 
+                      'value > 0.5')
+    """
+    if '/image_metadata' not in h5file:
+        return set()
+    query = 'key == tag'
+    if condition is not None:
+        query = '(key == tag) & (%s)' % condition
+    table = h5file.root.image_metadata
+    key = _metadata_string(table, 'key', key)
+    return set(get_image_name(h5file, image_id) for image_id in 
+               table.read_where(query, condvars={'tag': key}, 
+                                field='image_id'))
+
 def get_spectrum_h5file(filename):
     # split off any extension in the filename - we add our own.
     h5file = tables.open_file('%s.chest'%filename,'w')
     data_outline = h5file.create_table('/', 'image_description', 
                                      SpectrumDataTable)
+    data_outline.cols.filename.create_index()
+    # spectrum images (rows, columns, energy) as CArrays, one per file.
     imgGroup = h5file.create_group('/', 'rawdata')
     # image MDA results group
     mdaGroup = h5file.create_group('/', 'mda_results')
 
     h5file.flush()
+    return h5file
 
     
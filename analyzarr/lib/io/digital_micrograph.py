@@ -188,6 +188,8 @@ from __future__ import division
 import os
 import mmap
 import re
+import hashlib
+import cPickle
 import numpy as np
 
 #from analyzarr.axes import DataAxis
@@ -281,23 +283,31 @@ def read_string(f, iarray, endian):
         if iarray[0] != 18:
             print('File address:', f.tell())
             raise DM3DataTypeError(iarray[0])
-        data = ''
-        if endian == 'little':
-            s = binIO.L_char
-        elif endian == 'big':
-            s = binIO.B_char
-        for char in xrange(iarray[1]):
-            data += s.unpack(f.read(1))[0]
         #~ if '\x00' in data:      # it's a Unicode string (TagData)
             #~ uenc = 'utf_16_'+endian[0]+'e'
             #~ data = unicode(data, uenc, 'replace')
-        try:
-            data = data.decode('utf8')
-        except:
-            # Sometimes the dm3 file strings are encoded in latin-1
-            # instead of utf8
-            data = data.decode('latin-1', errors = 'ignore')
-        return data
+        return _decode_string(f.read(iarray[1]))
+
+def _numpy_dtype(iarray, endian):
+    """Return the numpy dtype of a simple type, or of a struct made of
+    simple types, defined by iarray, with a given endianness.
+    """
+    if endian == 'little':
+        byte_order = '<'
+    else:
+        byte_order = '>'
+    if iarray[0] in _simple_type:
+        return np.dtype(byte_order + _numpy_type[iarray[0]])
+    elif iarray[0] == 15:
+        field_type =  [iarray[i] for i in xrange(4, len(iarray), 2)]
+        for dtype in field_type:
+            if dtype not in _simple_type:
+                raise DM3DataTypeError(dtype)
+        # fields are packed one after the other, with no padding.
+        return np.dtype([('f%i' % i, byte_order + _numpy_type[dtype])
+                         for i, dtype in enumerate(field_type)])
+    else:
+        raise DM3DataTypeError(iarray[0])
 
 def read_struct(f, iarray, endian):
     """Read a struct, defined by iarray, from file f
@@ -318,25 +328,20 @@ def read_struct(f, iarray, endian):
         # n_fields = iarray[2]
         # field_name_length = [iarray[i] for i in xrange(3, len(iarray), 2)]
         # field_name_length always 0?
-        field_type =  [iarray[i] for i in xrange(4, len(iarray), 2)]
-        # field_ctype = [_data_type[iarray[i]][2] for i in xrange(4, len(iarray), 2)]
-        field_addr = []
-        # field_bytes = [_data_type[i][1] for i in field_type]
-        field_value = []
-        for dtype in field_type:
-            if dtype in _simple_type:
-                field_addr.append(f.tell())
-                read_data = _data_type[dtype][0]
-                data = read_data(f, endian)
-                field_value.append(data)
-            else:
-                raise DM3DataTypeError(dtype)    
+        dtype = _numpy_dtype(iarray, endian)
+        address = f.tell()
+        field_addr = [address + dtype.fields[name][1] for name in dtype.names]
+        field_value = np.frombuffer(f.read(dtype.itemsize), dtype)[0].tolist()
         return zip(field_addr, field_value)
     
 def read_array(f, iarray, endian):
     """Read an array, defined by iarray, from file f
     with a given endianness (byte order).
     endian can be either 'big' or 'little'.
+
+    Arrays of simple types are returned as numpy arrays, and arrays of
+    structs as structured arrays with one field (f0, f1, ...) per struct
+    field.  Both are read in one go.
     """
     if (endian != 'little') and (endian != 'big'):
         print('File address:', f.tell())
@@ -348,18 +353,34 @@ def read_array(f, iarray, endian):
         arraysize = iarray[-1]
         if arraysize == 0:
             return None
-        eltype = _data_type[iarray[1]][0] # same for all elements
-        if len(iarray) > 3:  # complex type
+        if iarray[1] in _simple_type or iarray[1] == 15:
+            dtype = _numpy_dtype(iarray[1:-1], endian)
+            data = np.frombuffer(f.read(dtype.itemsize * arraysize), dtype)
+            # store in the platform's byte order (this also copies the 
+            #   data out of the file buffer)
+            data = data.astype(dtype.newbyteorder('='))
+            if iarray[1] == 4: # it's actually a string
+                # disregard values that are not characters:
+                data = data[data < 256].astype(np.uint8).tostring()
+        else:
+            eltype = _data_type[iarray[1]][0] # same for all elements
             subiarray = iarray[1:-1]
             data = [eltype(f, subiarray, endian)
                     for element in xrange(arraysize)]
-        else: # simple type
-            data = [eltype(f, endian) for element in xrange(arraysize)]
-            if iarray[1] == 4: # it's actually a string
-                # disregard values that are not characters:
-                data = [chr(i) for i in data if i in xrange(256)]
-                data = reduce(lambda x, y: x + y, data)
         return data
+
+# numpy equivalents of the simple types in _data_type below
+_numpy_type = {
+    2 : 'i2',
+    3 : 'i4',
+    4 : 'u2',
+    5 : 'u4',
+    6 : 'f4',
+    7 : 'f8',
+    8 : 'u1',
+    9 : 'i1',
+    10 : 'i1',
+    }
     
 # _data_type dictionary.
 # The first element of the InfoArray in the TagType
@@ -393,6 +414,16 @@ def parse_tag_group(f, endian='big'):
     n_tags = binIO.read_long(f, endian)
     return bool(is_sorted), bool(is_open), n_tags
 
+def _decode_string(data):
+    """Decode the raw bytes of a dm3 string.
+    """
+    try:
+        return data.decode('utf8')
+    except:
+        # Sometimes the dm3 file strings are encoded in latin-1
+        # instead of utf8
+        return data.decode('latin-1', errors = 'ignore')
+
 def parse_tag_entry(f, endian='big'):
     """Parse a tag entry of the given DM3 file f.
     Returns the tuple (tag_id, tag_name_length, tag_name).
@@ -400,21 +431,15 @@ def parse_tag_entry(f, endian='big'):
     """
     tag_id = binIO.read_byte(f, endian)
     tag_name_length = binIO.read_short(f, endian)
-    str_infoarray = (18, tag_name_length)
-    tag_name_arr = read_string(f, str_infoarray, endian)
-    if len(tag_name_arr):
-        tag_name = reduce(lambda x, y: x + y, tag_name_arr)
-    else:
-        tag_name = ''
+    # tag names are 1-Byte chars, so read them in one go.
+    tag_name = _decode_string(f.read(tag_name_length))
     return tag_id, tag_name_length, tag_name
 
 def parse_tag_type(f):
     """Parse a tag type of the given DM3 file f.
     Returns the tuple infoArray.
     """
-    str_infoarray = (18, 4)
-    delim = read_string(f, str_infoarray, 'big')
-    delimiter = reduce(lambda x, y: x + y, delim)
+    delimiter = f.read(4)
     if delimiter != '%%%%':
         print('Wrong delimiter: "%s".' % str(delimiter))
         print('File address:', f.tell())
@@ -492,7 +517,7 @@ def parse_header(f, data_dict, endian='big', debug=0):
     return bool(is_little_endian[1])
 
 def crawl_dm3(f, data_dict, endian, ntags, group_name='root',
-             skip=0, debug=0,depth=1):
+             skip=0, debug=0,depth=1, lazy=False):
     """Recursively scan the ntags TagEntrys in DM3 file f
     with a given endianness (byte order) looking for
     TagTypes (data) or TagGroups (groups).
@@ -502,6 +527,8 @@ def crawl_dm3(f, data_dict, endian, ntags, group_name='root',
     '.' as separator.
     e.g. key = 'root.dir0.dir1.dir2.value0'
     If skip != 0 the data reading is actually skipped.
+    If lazy is True, the data is not read either: each tag gets the tuple
+    (file address, infoarray) instead, which LazyTag can read later.
     If debug > 0, 3, 5, 10 useful debug information is printed on screen.
     """
     depth+=1
@@ -550,6 +577,10 @@ def crawl_dm3(f, data_dict, endian, ntags, group_name='root',
             if image_data_pattern.search(data_key):
                 # don't read the data now          
                 data_dict[data_key] = parse_image_data(f, infoarray)
+            elif lazy:
+                # only note where the value is and how to read it.
+                data_dict[data_key] = (f.tell(), infoarray)
+                f.seek(_infoarray_databytes(infoarray), 1)
             else:
                 data_dict[data_key] = parse_tag_data(f, infoarray,
                                                        endian, skip)
@@ -610,15 +641,159 @@ def crawl_dm3(f, data_dict, endian, ntags, group_name='root',
                 print('Crawling at address:', f.tell())
             ntags = parse_tag_group(f)[2]
             crawl_dm3(f, data_dict, endian, ntags, group_name,
-                      skip, debug, depth) # recursion
+                      skip, debug, depth, lazy) # recursion
         else:
             print('File address:', f.tell())
             raise DM3TagIDError(tag_id)
 
-def open_dm3(fname, skip=0, debug=0, log=''):
+class LazyTag(object):
+    """A tag whose value is read from the file the first time it is used.
+
+    Indexing it gives the same (file address, value) pair that is stored
+    for tags read straight away, so data_dict.ls(...)[1][1] works with both.
+    """
+    def __init__(self, filename, address, infoarray, endian):
+        self.filename = filename
+        self.address = address
+        self.infoarray = infoarray
+        self.endian = endian
+        self._value = None
+        self._read = False
+
+    @property
+    def value(self):
+        if not self._read:
+            with open(self.filename, 'rb') as f:
+                f.seek(self.address)
+                self._value = parse_tag_data(f, self.infoarray, 
+                                             self.endian)[1]
+            self._read = True
+        return self._value
+
+    def __getitem__(self, index):
+        if index == 0:
+            return self.address
+        return (self.address, self.value)[index]
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        yield self.address
+        yield self.value
+
+    def __repr__(self):
+        return repr((self.address, self.value))
+
+# The tag index of files opened with lazy=True is kept here, so opening them
+#   again doesn't need to crawl the file.  Set to None to turn this off.
+tag_cache_dir = os.path.join(os.path.expanduser('~'), '.analyzarr', 'dm3_tags')
+# Past this many entries (or bytes), the least recently used are removed.
+tag_cache_max_files = 1000
+tag_cache_max_bytes = 2**28
+
+def _tag_index_path(fname):
+    # a file that has been changed gets a new entry.
+    stat = os.stat(fname)
+    key = '%s:%i:%r' % (os.path.abspath(fname), stat.st_size, stat.st_mtime)
+    if isinstance(key, unicode):
+        key = key.encode('utf8')
+    return os.path.join(tag_cache_dir, hashlib.md5(key).hexdigest() + '.pkl')
+
+def _load_tag_index(fname):
+    if tag_cache_dir is None:
+        return None
+    path = _tag_index_path(fname)
+    try:
+        with open(path, 'rb') as f:
+            data_dict = cPickle.load(f)
+    except Exception:
+        # not cached yet (or the cache file is unreadable) - crawl the file.
+        return None
+    try:
+        # mark it as used, so _prune_tag_cache keeps it
+        os.utime(path, None)
+    except OSError:
+        pass
+    return data_dict
+
+def _save_tag_index(fname, data_dict):
+    if tag_cache_dir is None:
+        return
+    path = _tag_index_path(fname)
+    tmp_path = path + '.%i.tmp' % os.getpid()
+    try:
+        if not os.path.isdir(tag_cache_dir):
+            os.makedirs(tag_cache_dir)
+        with open(tmp_path, 'wb') as f:
+            cPickle.dump(data_dict, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+        _prune_tag_cache()
+    except (IOError, OSError):
+        print "Could not save the tag index of %s in %s" % (fname, 
+                                                            tag_cache_dir)
+
+def _prune_tag_cache():
+    # removes the least recently used entries until the cache is within 
+    #   tag_cache_max_files and tag_cache_max_bytes.
+    entries = []
+    for name in os.listdir(tag_cache_dir):
+        if not name.endswith('.pkl'):
+            continue
+        path = os.path.join(tag_cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # removed by another process in the meantime
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    count = len(entries)
+    total = sum(entry[1] for entry in entries)
+    for mtime, size, path in entries:
+        if count <= tag_cache_max_files and total <= tag_cache_max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        count -= 1
+        total -= size
+
+def _defer_tags(fname, data_dict):
+    """Replaces the (file address, infoarray) entries left by a lazy crawl
+    with LazyTags.  Everything else (the header and the image data entries)
+    already holds its value.
+    """
+    if data_dict['DM3.isLittleEndian'][1]:
+        fendian = 'little'
+    else:
+        fendian = 'big'
+    for key, (address, value) in data_dict.iteritems():
+        if isinstance(value, tuple):
+            data_dict[key] = LazyTag(fname, address, value, fendian)
+
+def _iter_tags(dictionary, path=''):
+    """Yields (key, tag) for every tag in a nested tag dictionary, where
+    key is the path of the tag using '.' as separator.
+    """
+    for key, value in dictionary.iteritems():
+        if path:
+            key = path + '.' + key
+        if isinstance(value, dict):
+            for item in _iter_tags(value, key):
+                yield item
+        else:
+            yield key, value
+
+def open_dm3(fname, skip=0, debug=0, log='', lazy=False, cache_tags=True):
     """Open a DM3 file given its name and return the dictionary data_dict
     containint the parsed information.
     If skip != 0 the data is actually skipped.
+    If lazy is True, the tag values are only read when they are first used
+    (see LazyTag), and, unless cache_tags is False, the tag index is cached
+    in tag_cache_dir so that the file is not crawled again the next time it
+    is opened.
     Optionally, a debug value debug > 0 may be given.
     If log='filename' is specified, the keys, file address and
     (part of) the data parsed in data_dict are written in the log file.
@@ -628,57 +803,65 @@ def open_dm3(fname, skip=0, debug=0, log=''):
     byte order. The TagData are stored in the platform's
     byte order (e.g. 'big' for Mac, 'little' for PC).
     """
-    with open(fname, 'r+b') as dm3file:
-        fmap = mmap.mmap(dm3file.fileno(), 0, access=mmap.ACCESS_READ)
+    data_dict = None
+    if lazy and cache_tags:
+        data_dict = _load_tag_index(fname)
+    if data_dict is None:
         data_dict = {}
-        if parse_header(fmap, data_dict, debug=debug):
-            fendian = 'little'
-        else:
-            fendian = 'big'
-        rntags = parse_tag_group(fmap)[2]
-        if debug > 3:
-            print('Total tags in root group:', rntags)
-        rname = 'DM3'
-        crawl_dm3(fmap, data_dict, fendian, rntags, group_name=rname,
-                  skip=skip, debug=debug)
-#         if platform.system() in ('Linux', 'Unix'):
-#             try:
-#                 fmap.flush()
-#             except:
-#                 print("Error. Could not write to file", fname)
-#         if platform.system() in ('Windows', 'Microsoft'):
-#             if fmap.flush() == 0:
-#                 print("Error. Could not write to file", fname)
-        fmap.close()
-
-        if log:
-            exists = overwrite(log)
-            if exists:
-                with open(log, 'w') as logfile:
-                    for key in data_dict:
+        with open(fname, 'rb') as dm3file:
+            fmap = mmap.mmap(dm3file.fileno(), 0, access=mmap.ACCESS_READ)
+            if parse_header(fmap, data_dict, debug=debug):
+                fendian = 'little'
+            else:
+                fendian = 'big'
+            rntags = parse_tag_group(fmap)[2]
+            if debug > 3:
+                print('Total tags in root group:', rntags)
+            rname = 'DM3'
+            crawl_dm3(fmap, data_dict, fendian, rntags, group_name=rname,
+                      skip=skip, debug=debug, lazy=lazy)
+#             if platform.system() in ('Linux', 'Unix'):
+#                 try:
+#                     fmap.flush()
+#                 except:
+#                     print("Error. Could not write to file", fname)
+#             if platform.system() in ('Windows', 'Microsoft'):
+#                 if fmap.flush() == 0:
+#                     print("Error. Could not write to file", fname)
+            fmap.close()
+        if lazy and cache_tags:
+            _save_tag_index(fname, data_dict)
+    if lazy:
+        _defer_tags(fname, data_dict)
+
+    if log:
+        exists = overwrite(log)
+        if exists:
+            with open(log, 'w') as logfile:
+                for key in data_dict:
+                    try:
+                        line = '%s    %s    %s' % (key, data_dict[key][0],
+                                                   data_dict[key][1][:10])
+                    except:
                         try:
-                            line = '%s    %s    %s' % (key, data_dict[key][0],
-                                                       data_dict[key][1][:10])
+                            line = '%s    %s    %s' % (key,
+                                                       data_dict[key][0],
+                                                       data_dict[key][1])
                         except:
-                            try:
-                                line = '%s    %s    %s' % (key,
-                                                           data_dict[key][0],
-                                                           data_dict[key][1])
-                            except:
-                                line = '%s    %s    %s' % (key,
-                                                           data_dict[key][0],
-                                                           data_dict[key][1])
-                        print >> logfile, line, '\n'
-                print('Logfile %s saved in current directory' & log)
-                
-        # Convert data_dict into a file system-like dictionary, datadict_fs
+                            line = '%s    %s    %s' % (key,
+                                                       data_dict[key][0],
+                                                       data_dict[key][1])
+                    print >> logfile, line, '\n'
+            print('Logfile %s saved in current directory' & log)
+            
+    # Convert data_dict into a file system-like dictionary, datadict_fs
 
-        datadict_fs = {}
-        for nodes in data_dict.items():
-            fsdict(nodes[0].split('.'), nodes[1], datadict_fs)
+    datadict_fs = {}
+    for nodes in data_dict.items():
+        fsdict(nodes[0].split('.'), nodes[1], datadict_fs)
 
-        fsbrowser =  DictionaryBrowser(datadict_fs) # browsable dictionary'
-        return fsbrowser
+    fsbrowser =  DictionaryBrowser(datadict_fs) # browsable dictionary'
+    return fsbrowser
    
 class DM3ImageFile(object):
     """ 
@@ -745,8 +928,17 @@ class DM3ImageFile(object):
     scale = ['Scale',]          # in brightdir + 'Group[X]
 
     def __init__(self, fname, data_id=1, order = None, SI = None, 
-                 record_by = None, output_level=1):
+                 record_by = None, output_level=1, load_data=True,
+                 lazy_tags=False, cache_tags=True):
         self.filename = fname
+        # if load_data is False, the image data is not read when the file
+        #   is opened.  Use iter_data_chunks to get at it piece by piece.
+        self.load_data = load_data
+        # if lazy_tags is True, tags are only read when they are used, and
+        #   old_code_tags is None.
+        self.lazy_tags = lazy_tags
+        # if cache_tags is False, the tag index isn't cached - see open_dm3
+        self.cache_tags = cache_tags
         self.info = '' # should be a dictionary with the microscope info
         self.mode = ''
         self.record_by = record_by
@@ -765,7 +957,8 @@ class DM3ImageFile(object):
         return message
 
     def open(self):        
-        self.data_dict = open_dm3(self.filename)
+        self.data_dict = open_dm3(self.filename, lazy=self.lazy_tags,
+                                  cache_tags=self.cache_tags)
         byte_order = self.data_dict.ls(DM3ImageFile.endian)[1][1]
         if byte_order == 1:
             self.byte_order = 'little'
@@ -812,7 +1005,8 @@ class DM3ImageFile(object):
         except IndexError:
             raise ImageIDError(self.data_id)
 
-        self.data_dict.cd(image_id[self.data_id - 1]) # enter Group[ID]
+        self.image_group = image_id[self.data_id - 1]
+        self.data_dict.cd(self.image_group) # enter Group[ID]
 
         try:
             self.exposure =  self.data_dict.ls(DM3ImageFile.dwelltime)[1][1]
@@ -823,10 +1017,19 @@ class DM3ImageFile(object):
         except:
             self.vsm = None
             
-        self.old_code_tags = parseDM3(self.filename)
+        if self.lazy_tags:
+            # parseDM3 would crawl the whole file again.  Only the Format 
+            #   and Signal tags are needed here, so read just those.
+            self.old_code_tags = None
+            tags = ((tag, value[1]) for tag, value 
+                    in _iter_tags(self.data_dict.home)
+                    if 'Format' in tag or 'Signal' in tag)
+        else:
+            self.old_code_tags = parseDM3(self.filename)
+            tags = self.old_code_tags.iteritems()
         self.SI_format = None
         self.signal = None
-        for tag, value in self.old_code_tags.iteritems():
+        for tag, value in tags:
             if 'Format' in tag and 'Spectrum image' in str(value):
                 self.SI_format = value
             if 'Signal' in tag and 'EELS' in str(value):
@@ -981,7 +1184,16 @@ class DM3ImageFile(object):
 
         # self.data = self.read_image_data()
 #        try:
-        self.data = self.read_image_data()
+        if self.load_data or not self._can_stream():
+            self.data = self.read_image_data()
+            shape = list(self.data.shape)
+        else:
+            self.data = None
+            shape = self.imsize.tolist()
+            if 'packed' in self.imdtype:
+                # check the shape now, rather than when the data is read.
+                self._map_packed_complex()
+                self.mode += 'FFT_'
 
 #        except AttributeError:
 #            print('Error. Could not read data.')
@@ -989,11 +1201,19 @@ class DM3ImageFile(object):
 #            return None
         
         # remove axes whose dimension is 1, they are useless:
-        while 1 in self.data.shape:
-            i = self.data.shape.index(1)
+        while 1 in shape:
+            i = shape.index(1)
             self.dimensions = np.delete(self.dimensions, i)
             self.imsize = np.delete(self.imsize, i)
+            shape.pop(i)
+        self.shape = tuple(shape)
+        if self.data is not None:
             self.data = self.data.squeeze()
+            self.dtype = self.data.dtype
+        elif 'packed' in self.imdtype:
+            self.dtype = np.dtype('complex64')
+        else:
+            self.dtype = np.dtype(self.imdtype)
 
         d = len(self.dimensions)
         if d == 0: # could also implement a 'mode' dictionary...
@@ -1009,8 +1229,12 @@ class DM3ImageFile(object):
         elif ('rgb' in self.imdtype):
             return self.read_rgb()
         else:
+            # map the data rather than reading it.  The reshaping below
+            #   gives views for images, so nothing is read from disk until 
+            #   it is used.
             data = binIO.read_data_array(self.filename, self.imbytes,
-                                   self.byte_offset, self.imdtype)
+                                   self.byte_offset, self.imdtype,
+                                   write=False, memmap=True)
             imsize = self.imsize.tolist()
             if self.order == 'F':
                 if self.record_by == 'spectrum':
@@ -1027,12 +1251,94 @@ class DM3ImageFile(object):
                     data = data.reshape(self.imsize, order = self.order)                    
             return data
             
+    def _can_stream(self):
+        # images stored in C order map directly onto rows of the file, and
+        #   packed FFTs can be unpacked a few rows at a time.  Spectrum 
+        #   images are stored as a stack of energy planes, which can be 
+        #   transposed a few rows of pixels at a time.  Everything else
+        #   needs to be rearranged after it is read.
+        if self.record_by == 'spectrum':
+            return len(self.imsize) == 3 and 'rgb' not in self.imdtype \
+                   and 'packed' not in self.imdtype
+        return self.record_by == 'image' and 'rgb' not in self.imdtype
+
+    def get_image_tags(self):
+        """Returns the tags of the image as a flat dictionary, keyed by
+        the path of each tag below the image's ImageData group (e.g.
+        'ImageTags.Microscope Info.Indicated Magnification').  Only numbers
+        and strings are kept - not the image data, arrays or structs, which
+        are not read at all when the tags are lazy.
+        """
+        tree = self.data_dict.home
+        for key in DM3ImageFile.imlistdir + [self.image_group, 'ImageData']:
+            tree = tree[key]
+        tags = {}
+        for key, tag in _iter_tags(tree):
+            if key.split('.')[-1] == 'Data':
+                continue
+            if isinstance(tag, LazyTag):
+                # arrays are only worth reading if they hold a string
+                if tag.infoarray[0] == 15 or (tag.infoarray[0] == 20 and
+                                              tag.infoarray[1] != 4):
+                    continue
+            value = tag[1]
+            if isinstance(value, (basestring, bool, int, long, float, 
+                                  np.number)):
+                tags[key] = value
+        return tags
+
+    def iter_data_chunks(self, chunk_bytes=2**24):
+        """Yields (start, stop, data) tuples, where data holds the rows 
+        start:stop (along the first axis) of the squeezed image data.
+
+        Each block is mapped straight from the file and released before the
+        next one is mapped, so no more than about chunk_bytes of image data
+        are held at once.  Packed complex data is unpacked block by block
+        from the mapped file.  Spectrum images (rows, columns, energy) are 
+        transposed from the energy planes in the file a block of rows at a
+        time.  Data that can't be read this way (other spectra and RGB 
+        data) is always read when the file is opened, and is yielded in one
+        piece.
+        """
+        if self.data is not None:
+            yield 0, self.data.shape[0], self.data
+            return
+        row_shape = self.shape[1:]
+        row_bytes = int(np.prod(row_shape)) * self.dtype.itemsize
+        rows_per_chunk = max(1, chunk_bytes // row_bytes)
+        if self.record_by == 'spectrum':
+            # the file holds one image per energy channel
+            planes = binIO.read_data_array(self.filename, self.imbytes,
+                                           self.byte_offset, self.dtype,
+                                           write=False, memmap=True)
+            planes = planes.reshape(self.shape[-1:] + self.shape[:-1])
+            for start in xrange(0, self.shape[0], rows_per_chunk):
+                stop = min(start + rows_per_chunk, self.shape[0])
+                yield start, stop, np.rollaxis(planes[:, start:stop], 0, 
+                                               len(self.shape))
+            del planes
+            return
+        if 'packed' in self.imdtype:
+            packed = self._map_packed_complex()
+            for start in xrange(0, self.shape[0], rows_per_chunk):
+                stop = min(start + rows_per_chunk, self.shape[0])
+                yield start, stop, unpack_complex_rows(packed, start, stop)
+            return
+        for start in xrange(0, self.shape[0], rows_per_chunk):
+            stop = min(start + rows_per_chunk, self.shape[0])
+            data = binIO.read_data_array(self.filename, 
+                                         (stop - start) * row_bytes,
+                                         self.byte_offset + start * row_bytes,
+                                         self.dtype, write=False, memmap=True)
+            yield start, stop, data.reshape((stop - start,) + row_shape)
+            del data
+
     def read_rgb(self):
         self.imsize = list(self.imsize)
         self.imsize.append(4)
         self.imsize = tuple(self.imsize)
         data = binIO.read_data_array(self.filename, self.imbytes,
-                               self.byte_offset)
+                               self.byte_offset, write=False, memmap=True)
         data = data.reshape(self.imsize, order='C') # (B, G, R, A)
         if self.imdtype == 'rgb':
             data = data[:, :, -2::-1] # (R, G, B)
@@ -1046,80 +1352,78 @@ class DM3ImageFile(object):
             self.mode += 'rgba_'
         return data
 
-    def read_packed_complex(self):
+    def _map_packed_complex(self):
+        """Map the packed complex data as a (2N, N) array of complex64.
+        """
         if (self.imsize[0] != self.imsize[1]) or (len(self.imsize)>2):
             msg = "Packed complex format works only for a 2Nx2N image"
             msg += " -> width == height"
             print msg
             raise ImageModeError('FFT')
+        N = int(self.imsize[0] / 2)      # think about a 2Nx2N matrix
+        # map all the bytes as 1D array of 4-Byte float, and pair them up
+        tmpdata = binIO.read_data_array(self.filename, self.imbytes,
+                                   self.byte_offset, 'float32',
+                                   write=False, memmap=True)
+        return tmpdata.view('complex64').reshape(2 * N, N)
+
+    def read_packed_complex(self):
         # print "This image is likely a FFT and each pixel is a complex number"
         # print "You might want to display its complex norm"
         # print "with a logarithmic intensity scale: log(abs(IMAGE))"
         self.mode += 'FFT_'
-        N = int(self.imsize[0] / 2)      # think about a 2Nx2N matrix
-        # read all the bytes as 1D array of 4-Byte float
-        tmpdata = binIO.read_data_array(self.filename, self.imbytes,
-                                   self.byte_offset, 'float32')
-        
-        # create an empty 2Nx2N ndarray of complex
-        data = np.zeros(self.imsize, 'complex64', 'C')
-        
-        # fill in the real values:
-        data[N, 0] = tmpdata[0]
-        data[0, 0] = tmpdata[1]
-        data[N, N] = tmpdata[2*N**2] # Nyquist frequency
-        data[0, N] = tmpdata[2*N**2+1] # Nyquist frequency
-                
-        # fill in the non-redundant complex values:
-        # top right quarter, except 1st column
-        for i in xrange(N): # this could be optimized
-            start = 2 * i * N + 2
-            stop = start + 2 * (N - 1) - 1
-            step = 2
-            realpart = tmpdata[start:stop:step]
-            imagpart = tmpdata[start+1:stop+1:step]
-            data[i, N+1:2*N] = realpart + imagpart * 1j
-        # 1st column, bottom left quarter
-        start = 2 * N
-        stop = start + 2 * N * (N - 1) - 1
-        step = 2 * N
-        realpart = tmpdata[start:stop:step]
-        imagpart = tmpdata[start+1:stop+1:step]
-        data[N+1:2*N, 0] = realpart + imagpart * 1j
-        # 1st row, bottom right quarter
-        start = 2 * N**2 + 2
-        stop = start + 2 * (N - 1) - 1
-        step = 2
-        realpart = tmpdata[start:stop:step]
-        imagpart = tmpdata[start+1:stop+1:step]
-        data[N, N+1:2*N] = realpart + imagpart * 1j
-        # bottom right quarter, except 1st row
-        start = stop + 1
-        stop = start + 2 * N * (N - 1) - 1
-        step = 2
-        realpart = tmpdata[start:stop:step]
-        imagpart = tmpdata[start+1:stop+1:step]
-        complexdata = realpart + imagpart * 1j
-        data[N+1:2*N, N:2*N] = complexdata.reshape(N-1, N)
-
-        # fill in the empty pixels: A(i)(j) = A(2N-i)(2N-j)*
-        # 1st row, top left quarter, except 1st element
-        data[0, 1:N] = np.conjugate(data[0, -1:-N:-1])
-        # 1st row, bottom left quarter, except 1st element
-        data[N, 1:N] = np.conjugate(data[N, -1:-N:-1])
-        # 1st column, top left quarter, except 1st element
-        data[1:N, 0] = np.conjugate(data[-1:-N:-1, 0])
-        # 1st column, top right quarter, except 1st element
-        data[1:N, N] = np.conjugate(data[-1:-N:-1, N])
-        # top left quarter, except 1st row and 1st column
-        data[1:N, 1:N] = np.conjugate(data[-1:-N:-1, -1:-N:-1])
-        # bottom left quarter, except 1st row and 1st column
-        data[N+1:2*N, 1:N] = np.conjugate(data[-N-1:-2*N:-1, -1:-N:-1])
-
+        packed = self._map_packed_complex()
+        N2 = packed.shape[0]
+        data = np.empty((N2, N2), 'complex64')
+        # unpack a block of rows at a time to keep the temporaries small
+        rows_per_block = max(1, 2**24 // (N2 * data.itemsize))
+        for start in xrange(0, N2, rows_per_block):
+            stop = min(start + rows_per_block, N2)
+            unpack_complex_rows(packed, start, stop, data[start:stop])
         return data
 
+def unpack_complex_rows(packed, start, stop, data=None):
+    """Return rows start:stop of the 2Nx2N complex image (FFT) stored in
+    the packed complex format.  packed is the (2N, N) complex64 view of
+    the stored data: its row i holds the non-redundant half of row i, 
+    except that column 0 holds the left column of the image and the
+    purely real values at (0, 0), (N, 0), (0, N) and (N, N).
+    The missing half is filled in from A(i)(j) = A(2N-i)(2N-j)*.
+
+    Only the rows needed for the block are read from packed, so an FFT
+    can be unpacked a few rows at a time from a memory-mapped file.  If 
+    given, data is the (stop - start, 2N) complex64 array to fill.
+    """
+    N = packed.shape[1]
+    rows = np.arange(start, stop)
+    # row i of the image mirrors row 2N-i (rows 0 and N mirror themselves)
+    mirror = (2 * N - rows) % (2 * N)
+    if data is None:
+        data = np.empty((stop - start, 2 * N), 'complex64')
+    # right half, except the middle column
+    data[:, N+1:] = packed[start:stop, 1:]
+    # left half, except the 1st column
+    np.conjugate(packed[mirror, N-1:0:-1], data[:, 1:N])
+    # 1st and middle columns
+    column = packed[:, 0]
+    top = (rows > 0) & (rows < N)
+    bottom = rows > N
+    data[top, 0] = np.conjugate(column[N - rows[top]])
+    data[top, N] = np.conjugate(column[2 * N - rows[top]])
+    data[bottom, 0] = column[rows[bottom] - N]
+    data[bottom, N] = column[rows[bottom]]
+    # the real values, with the Nyquist frequency in the middle column
+    if start == 0:
+        data[0, 0] = column[0].imag
+        data[0, N] = column[N].imag
+    if start <= N < stop:
+        data[N - start, 0] = column[0].real
+        data[N - start, N] = column[N].real
+    return data
+
 def file_reader(filename,record_by=None, order = None, data_id=1, 
-                dump = False, output_level=1):
+                dump = False, output_level=1, load_data=True, 
+                lazy_tags=False, cache_tags=True):
     """Reads a DM3 file and loads the data into the appropriate class.
     data_id can be specified to load a given image within a DM3 file that
     contains more than one dataset.
@@ -1132,10 +1436,21 @@ def file_reader(filename,record_by=None, order = None, data_id=1,
         One of 'C' or 'F'
     dump: Bool
         If True it dumps the tags into a txt file
+    load_data: Bool
+        If False, the image data is not read.  Use the iter_data_chunks
+        method of the returned object to read it in pieces.
+    lazy_tags: Bool
+        If True, tag values are only read from the file when they are used,
+        and the tag index is cached so the file is not crawled again.  The
+        returned tags then hold LazyTag objects - use their value attribute.
+    cache_tags: Bool
+        With lazy_tags, if False the tag index isn't cached.  Use this when
+        each file is only read once, as when importing.
     """
          
     dm3 = DM3ImageFile(filename, data_id, order = order, record_by = record_by,
-                       output_level=output_level)
+                       output_level=output_level, load_data=load_data,
+                       lazy_tags=lazy_tags, cache_tags=cache_tags)
     
     if dump is True:
         import codecs
@@ -1143,8 +1458,12 @@ def file_reader(filename,record_by=None, order = None, data_id=1,
         f.close()
 
     tags = {}
-    for tag in dm3.old_code_tags.items():
-        node_valve(tag[0].split('.'), tag[1], tags)
+    if dm3.old_code_tags is None:
+        # the lazy tag index is already nested.
+        tags = dm3.data_dict.home
+    else:
+        for tag in dm3.old_code_tags.items():
+            node_valve(tag[0].split('.'), tag[1], tags)
 
     return dm3, tags
 
@@ -3,8 +3,18 @@
 import tables as tb
 import os
 import time
+import hashlib
+from collections import deque
 
-from data_structure import get_image_h5file, get_spectrum_h5file, filters
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from data_structure import get_image_h5file, get_spectrum_h5file, \
+     get_filters, get_chunkshape, get_import_manifest, upgrade_image_ids, \
+     add_image_metadata, append_rows, RowBuffer
+from concurrency import share_chest, start_workers
 
 img_extensions = ['.png', '.bmp', '.dib', '.gif', '.jpeg', '.jpe', '.jpg', '.msp', '.pcx', '.ppm', ".pbm", ".pgm", '.xbm', '.spi',]
 
@@ -12,19 +22,74 @@ tiff_extensions = ['.tiff', '.tif',]
 
 dm_extensions = ['.dm3',]
 
+mrc_extensions = ['.mrc', '.mrcs',]
 
-# I don't give a rat's ass about FEI's MRC files or other spectral formats.  
-# Sorry.
-
-def new_treasure_chest(filename):
+def new_treasure_chest(filename, concurrent=False):
+    """
+    With concurrent, the chest can be read by other processes while it is
+    open (see concurrency.py), such as the workers used by 
+    concurrency.map_chest.  Writes must then go through concurrency.writing.
+    The session must have been started with ANALYZARR_CONCURRENT=1.
+    """
+    if concurrent:
+        # before the chest is opened - see concurrency.py
+        start_workers()
     h5file = get_image_h5file(filename)
+    if concurrent:
+        share_chest(h5file)
     return h5file
 
-def open_treasure_chest(filename):
+def new_spectrum_chest(filename):
+    """
+    Makes a chest for spectrum images - see import_spectra.
+    """
+    return get_spectrum_h5file(filename)
+
+def open_treasure_chest(filename, concurrent=False):
+    if concurrent:
+        start_workers()
     h5file = tb.open_file(filename, 'a')
+    if concurrent:
+        share_chest(h5file)
+    upgrade_image_ids(h5file)
     return h5file
 
-def import_files(h5file, file_string):
+def import_files(h5file, file_string, processes=1, queue_depth=None,
+                 stream=False, stack=False, frames=None, journal=False,
+                 tiff_workers=1):
+    """
+    Imports files into the chest.
+
+    processes - the number of worker processes used to decode files.  The 
+        default (1) decodes everything in this process.  None uses one
+        worker per CPU.  Writing to the chest always happens in this process.
+    queue_depth - the maximum number of decoded files held in memory, 
+        waiting to be written.  Defaults to twice the number of workers.
+    stream - for DM3 files, copy the image data into the chest in chunks
+        straight from the file, instead of reading whole files into memory.
+        Use this for stacks that are too big to hold in memory.  Streaming
+        imports are done one file at a time; processes is ignored.
+    stack - for TIFF files, store all the pages of each file as one 3-D 
+        array (frames, rows, columns), copying one page at a time.  Use 
+        this for multi-page movies.  processes is ignored.  MRC files are
+        always imported this way.
+    frames - with stack (or for MRC files), the pages to import from each
+        file: a slice, a (start, stop[, step]) tuple or a list of page 
+        indices.  Defaults to all pages.
+
+        A file is imported once for each way of importing it: as a stack 
+        or not, and for each frame selection.  Importing a file again with
+        the same stack and frames is skipped (a message says so), even if 
+        it was renamed; a new selection of frames from it is stored as 
+        another image, under a numbered name.
+    journal - keep track of the import in the chest's import_manifest table,
+        and store each file so that a crash never leaves a half-written image
+        behind.  Running the same import again after a crash (or on a folder
+        that has grown since) picks up where it left off.
+    tiff_workers - for compressed TIFF files, the number of threads (or,
+        for LZW and PackBits, processes) decompressing the strips of each 
+        page.  Worth raising for big compressed images when processes is 1.
+    """
     # match supported file input types - check extension
     if '*' in file_string:
         from glob import glob
@@ -36,96 +101,592 @@ def import_files(h5file, file_string):
         flist = [file_string]
 
     if os.path.splitext(flist[0])[1] in img_extensions:
-        import_image(h5file, flist)
+        import_image(h5file, flist, processes=processes, 
+                     queue_depth=queue_depth, journal=journal)
     elif os.path.splitext(flist[0])[1] in tiff_extensions:
-        import_tiff(h5file, flist)
+        import_tiff(h5file, flist, processes=processes, 
+                    queue_depth=queue_depth, stack=stack, frames=frames,
+                    journal=journal, tiff_workers=tiff_workers)
     elif os.path.splitext(flist[0])[1] in dm_extensions:
-        import_dm(h5file, flist)
+        import_dm(h5file, flist, processes=processes, 
+                  queue_depth=queue_depth, stream=stream, journal=journal)
+    elif os.path.splitext(flist[0])[1] in mrc_extensions:
+        import_mrc(h5file, flist, frames=frames, journal=journal)
     h5file.flush()
 
 #TODO: add ways to add/remove member data
 
-def import_image(h5file, flist, output_filename=None):
+# The readers below are run in worker processes when importing in parallel,
+#    so they need to stay importable, module-level functions.
+def _read_image(f):
     from scipy.misc import imread
-    data_record = h5file.root.image_description.row
-    # any kind of jpg, png can be lumped together
-    for f in flist:
-        filename = os.path.splitext(os.path.split(f)[1])[0]
-        if len(h5file.root.image_description.get_where_list('filename=="%s"'%filename)) == 0:
-            # get data as numpy array
-            d = imread(f)
-            # add a CArray for this data in the h5file
-            ds = h5file.create_carray(h5file.root.rawdata, 
-                            filename,
-                            tb.Atom.from_dtype(d.dtype),
-                            d.shape,
-                            filters=filters
-                            )
-            # assigns the data to the array
-            ds[:] = d
-            # add the record for this image to the table in the h5file
-            data_record['filename'] = filename
-            data_record['idx'] = flist.index(f)
-            data_record.append()
-    h5file.root.image_description.flush()
-    h5file.flush()
+    # get data as numpy array
+    return imread(f)
 
-def import_tiff(h5file, flist):
+def _read_tiff(f, maxworkers=1):
     # for tiff, we use Christoph Gohlke's reader
     from analyzarr.lib.io.libs.tifffile import imread
-    data_record = h5file.root.image_description.row
+    return imread(f, maxworkers=maxworkers)
+
+class _TiffReader(object):
+    # _read_tiff with the number of strip decoders, in a form that can be 
+    #    sent to worker processes
+    def __init__(self, maxworkers=1):
+        self.maxworkers = maxworkers
+
+    def __call__(self, f):
+        return _read_tiff(f, self.maxworkers)
+
+def _read_dm(f):
+    # returns the image's tags too - see _import_flist
+    from analyzarr.lib.io.digital_micrograph import file_reader
+    print "loading file: %s" %f
+    # each file is read once, so its tag index isn't worth caching
+    tmp_dm3, tmp_tags = file_reader(f, lazy_tags=True, cache_tags=False)
+    return tmp_dm3.data, tmp_dm3.get_image_tags()
+
+def _get_node_name(f):
+    return os.path.splitext(os.path.split(f)[1])[0]
+
+def _is_imported(h5file, filename):
+    return len(h5file.root.image_description.get_where_list(
+        'filename=="%s"'%filename)) > 0
+
+def _hash_file(f, block_size=2**20):
+    """
+    Returns a digest of the bytes of file f, prefixed by the name of the 
+    hash used (xxhash if it is installed, otherwise sha1).
+    """
+    if xxhash is not None:
+        name, digest = 'xxh64', xxhash.xxh64()
+    else:
+        name, digest = 'sha1', hashlib.sha1()
+    with open(f, 'rb') as fobj:
+        for block in iter(lambda: fobj.read(block_size), b''):
+            digest.update(block)
+    return '%s:%s' % (name, digest.hexdigest())
+
+def _unique_node_name(h5file, name, taken):
+    node_name = name
+    count = 1
+    while node_name in taken or node_name in h5file.root.rawdata:
+        node_name = '%s_%i' % (name, count)
+        count += 1
+    return node_name
+
+def _import_variant(stack=False, frames=None):
+    """
+    Returns a string naming the part of a file an import stores, so that
+    the same file imported as a stack or with other frames isn't taken for
+    one that is already in the chest.  Plain imports give ''.  frames is 
+    normalized, so equivalent selections (a tuple or the same slice) give
+    the same string.
+    """
+    parts = []
+    if stack:
+        parts.append('stack')
+    if frames is not None:
+        if isinstance(frames, tuple):
+            frames = slice(*frames)
+        if isinstance(frames, slice):
+            start = 0 if frames.start is None else frames.start
+            stop = '' if frames.stop is None else frames.stop
+            step = 1 if frames.step is None else frames.step
+            selection = '%i:%s:%i' % (start, stop, step)
+        else:
+            selection = ','.join(str(int(idx)) for idx in frames)
+        parts.append('frames=' + selection)
+    return ';'.join(parts)
+
+def _variant_hash(content_hash, variant=''):
+    # the content_hash column holds the hash of the file and the variant, 
+    #   which is just the file's hash for plain imports.
+    if not variant:
+        return content_hash
+    return 'sha1:' + hashlib.sha1('%s|%s' % (content_hash, variant)
+                                  ).hexdigest()
+
+def _new_files(h5file, flist, journal=False, variant=''):
+    """
+    Returns (idx, file, node name, content hash) for each file in flist 
+    that isn't in the chest yet, where idx is its position in flist.  
+    variant (see _import_variant) says which part of each file is imported;
+    a file is only skipped if it was imported with the same variant.
+
+    Files the import manifest lists as imported, that haven't changed since
+    (same path, size and modification time) and are still in the chest, are
+    skipped without reading them.  With journal, an interrupted journaled 
+    import is cleaned up first, and the new files are entered in the 
+    manifest.
+
+    The other files are recognized by a hash of their contents, looked up 
+    in the indexed content_hash column, so renamed copies are skipped, and 
+    different files with the same name are both imported - the later one 
+    gets a numbered node name.  Chests made before the content_hash column
+    existed are checked by file name, and their hash is None.
+    """
+    table = h5file.root.image_description
+    new_files = []
+    if journal:
+        manifest = _recover_journal(h5file)
+    elif '/import_manifest' in h5file:
+        manifest = get_import_manifest(h5file)
+    else:
+        manifest = None
+    if manifest is not None:
+        candidates = [(idx, f) for idx, f in enumerate(flist) if not 
+                      _is_unchanged_import(h5file, manifest, f, variant)]
+    else:
+        candidates = list(enumerate(flist))
+    if 'content_hash' not in table.colnames:
+        for idx, f in candidates:
+            if not _is_imported(h5file, _get_node_name(f)):
+                new_files.append((idx, f, _get_node_name(f), None))
+    else:
+        _find_new_contents(h5file, candidates, new_files, variant)
+    if variant:
+        # say why, as the file may have been imported another way before
+        new = set(item[1] for item in new_files)
+        for f in flist:
+            if f not in new:
+                print "already imported this way, skipping: %s" %f
+    if journal:
+        _journal_files(manifest, new_files, variant)
+    return new_files
+
+def _find_new_contents(h5file, flist, new_files, variant=''):
+    table = h5file.root.image_description
+    # rows added during this import aren't searchable until the table is 
+    #    flushed, so keep track of those here.
+    hashes = set()
+    names = set()
+    for idx, f in flist:
+        content_hash = _variant_hash(_hash_file(f), variant)
+        if content_hash in hashes or len(table.get_where_list(
+                'content_hash == value', condvars={'value': content_hash})):
+            continue
+        node_name = _unique_node_name(h5file, _get_node_name(f), names)
+        hashes.add(content_hash)
+        names.add(node_name)
+        new_files.append((idx, f, node_name, content_hash))
+
+# Journaled imports write each image under a temporary name, and only give
+#    it its real name once all of its data is in the file.
+_journal_prefix = '_importing_'
+
+def _file_stat(f):
+    stat = os.stat(f)
+    return os.path.abspath(f), stat.st_size, stat.st_mtime
+
+def _is_unchanged_import(h5file, manifest, f, variant=''):
+    # done the same way, not changed since, and its image is still in the 
+    #   chest
+    path, size, mtime = _file_stat(f)
+    for row in manifest.where('(path == value) & (state == "done") & '
+                              '(variant == part)', 
+                              condvars={'value': path, 'part': variant}):
+        if (row['size'] == size and row['mtime'] == mtime and 
+                row['node_name'] in h5file.root.rawdata and
+                _is_imported(h5file, row['node_name'])):
+            return True
+    return False
+
+def _journal_files(manifest, new_files, variant=''):
+    if not new_files:
+        return
+    paths, sizes, mtimes = zip(*[_file_stat(item[1]) for item in new_files])
+    append_rows(manifest, len(new_files), path=paths, size=sizes, 
+                mtime=mtimes, node_name=[item[2] for item in new_files], 
+                state='pending', variant=variant)
+
+def _recover_journal(h5file):
+    """
+    Cleans up after a journaled import that didn't finish, and returns the
+    import manifest.  Pending files whose image was recorded are marked
+    done; the images of the others are removed, and their manifest entries
+    marked aborted, so that they are imported again.
+    """
+    manifest = get_import_manifest(h5file)
+    table = h5file.root.image_description
+    rawdata = h5file.root.rawdata
+    for row in manifest.where('state == "pending"'):
+        node_name = row['node_name']
+        if len(table.get_where_list('filename == value', 
+                                    condvars={'value': node_name})):
+            row['state'] = 'done'
+        else:
+            for name in (_journal_prefix + node_name, node_name):
+                if name in rawdata:
+                    h5file.remove_node(rawdata, name)
+            row['state'] = 'aborted'
+        row.update()
+    manifest.flush()
+    if '/image_metadata' in h5file:
+        # tags are stored just before their image is recorded, so the tags
+        #   of an image that wasn't recorded are the last rows.
+        metadata = h5file.root.image_metadata
+        orphans = metadata.get_where_list('image_id >= nrows', 
+                                          condvars={'nrows': table.nrows})
+        if len(orphans):
+            metadata.remove_rows(orphans.min())
+    h5file.flush()
+    return manifest
+
+def _mark_journaled(h5file, f, state='done'):
+    manifest = h5file.root.import_manifest
+    for row in manifest.where('(path == value) & (state == "pending")', 
+                              condvars={'value': os.path.abspath(f)}):
+        row['state'] = state
+        row.update()
+
+def _record_import(h5file, f, node_name, variant=''):
+    # enters a file imported without journaling in the manifest, so that 
+    #   later imports can skip it without hashing it again
+    path, size, mtime = _file_stat(f)
+    append_rows(get_import_manifest(h5file), path=path, size=size, 
+                mtime=mtime, node_name=node_name, state='done', 
+                variant=variant)
+
+def _decode_files(reader, flist, processes=1, queue_depth=None):
+    """
+    Yields (file, data) pairs in the order of flist.
+    
+    With more than one process, files are decoded by a pool of workers 
+    while the caller is busy writing the previous results.  At most 
+    queue_depth files are decoded ahead of the caller, so memory use stays
+    flat no matter how many files there are.
+    """
+    if processes == 1:
+        for f in flist:
+            yield f, reader(f)
+        return
+    from multiprocessing import Pool, cpu_count
+    if processes is None:
+        processes = cpu_count()
+    if queue_depth is None:
+        queue_depth = 2 * processes
+    pool = Pool(processes)
+    pending = deque()
+    finished = False
+    try:
+        for f in flist:
+            pending.append((f, pool.apply_async(reader, (f,))))
+            if len(pending) >= queue_depth:
+                f, result = pending.popleft()
+                yield f, result.get()
+        while pending:
+            f, result = pending.popleft()
+            yield f, result.get()
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            # the writer stopped early (or failed) - don't decode any more.
+            pool.terminate()
+        pool.join()
+
+def _create_image_array(h5file, filename, dtype, shape, chunkshape=None,
+                        journal=False):
+    if journal:
+        filename = _journal_prefix + filename
+    if chunkshape is None:
+        chunkshape = get_chunkshape('raw', shape, dtype)
+    # add a CArray for this data in the h5file
+    return h5file.create_carray(h5file.root.rawdata, 
+                    filename,
+                    tb.Atom.from_dtype(dtype),
+                    shape,
+                    filters=get_filters('raw'),
+                    chunkshape=chunkshape
+                    )
+
+def _add_image_record(data_record, filename, idx, content_hash=None):
+    # add the record for this image to the table in the h5file.  
+    #   data_record is a RowBuffer, so the records of a batch of files are 
+    #   appended together.
+    if content_hash is not None:
+        data_record.add(filename=filename, idx=idx, content_hash=content_hash)
+    else:
+        data_record.add(filename=filename, idx=idx)
+
+def _finish_image(h5file, data_record, ds, f, filename, idx, 
+                  content_hash=None, journal=False, metadata=None, 
+                  variant=''):
+    """
+    Records an image once all of its data is written, with its metadata 
+    (a dictionary of tags), if any, and the variant it was imported with.  For journaled imports, the image is 
+    flushed, given its real name, recorded and marked done in the manifest,
+    and then everything is flushed again.  A crash part way through leaves
+    either a finished image or one that _recover_journal removes.
+    """
+    if journal:
+        h5file.flush()
+        h5file.rename_node(ds, filename)
+    if metadata:
+        # the image's id will be the row its record is about to take
+        add_image_metadata(h5file, data_record.next_row, metadata)
+    _add_image_record(data_record, filename, idx, content_hash)
+    if journal:
+        data_record.flush()
+        _mark_journaled(h5file, f)
+        h5file.flush()
+    else:
+        _record_import(h5file, f, filename, variant)
+
+def _store_image(h5file, data_record, f, filename, data, idx, 
+                 content_hash=None, journal=False, metadata=None):
+    ds = _create_image_array(h5file, filename, data.dtype, data.shape,
+                             journal=journal)
+    # assigns the data to the array
+    ds[:] = data
+    _finish_image(h5file, data_record, ds, f, filename, idx, content_hash,
+                  journal, metadata)
+
+def _store_image_chunks(h5file, data_record, f, filename, dtype, shape, 
+                        chunks, idx, content_hash=None, journal=False,
+                        metadata=None):
+    """
+    Like _store_image, but the data comes from an iterable of 
+    (start, stop, data) blocks along the first axis, so that only one block
+    needs to be in memory at a time.
+    """
+    ds = _create_image_array(h5file, filename, dtype, shape, journal=journal)
+    for start, stop, block in chunks:
+        ds[start:stop] = block
+    _finish_image(h5file, data_record, ds, f, filename, idx, content_hash,
+                  journal, metadata)
+
+def _import_flist(h5file, flist, reader, processes=1, queue_depth=None,
+                  journal=False, with_metadata=False):
+    """
+    With with_metadata, reader returns (data, tags) rather than just the
+    data, and the tags are stored in the image_metadata table.
+    """
+    # only hand files that aren't in the chest yet to the decoders
+    new_files = _new_files(h5file, flist, journal)
+    records = dict((f, (idx, node_name, content_hash)) 
+                   for idx, f, node_name, content_hash in new_files)
+    # the records of stored images are appended even if a later one fails
+    with RowBuffer(h5file.root.image_description) as data_record:
+        for f, d in _decode_files(reader, [item[1] for item in new_files], 
+                                  processes, queue_depth):
+            idx, node_name, content_hash = records[f]
+            metadata = None
+            if with_metadata:
+                d, metadata = d
+            _store_image(h5file, data_record, f, node_name, d, idx, 
+                         content_hash, journal, metadata)
+    # flush the data to commit our changes to the file.
+    h5file.flush()
+
+def import_image(h5file, flist, output_filename=None, processes=1, 
+                 queue_depth=None, journal=False):
     # any kind of jpg, png can be lumped together
-    for f in flist:
-        filename = os.path.splitext(os.path.split(f)[1])[0]
-        if len(h5file.root.image_description.get_where_list('filename=="%s"'%filename)) == 0:
-            # get data as numpy array
-            d = imread(f)
-            # add a CArray for this data in the h5file
-            ds = h5file.create_carray(h5file.root.rawdata, 
-                            filename,
-                            tb.Atom.from_dtype(d.dtype),
-                            d.shape,
-                            filters=filters
-                            )
-            # assigns the data to the array
-            ds[:] = d
-
-            # add the record for this image to the table in the h5file
-            data_record['filename'] = filename
-            data_record['idx'] = flist.index(f)
-            data_record.append()
-    h5file.root.image_description.flush()
+    _import_flist(h5file, flist, _read_image, processes, queue_depth, journal)
+
+def import_tiff(h5file, flist, processes=1, queue_depth=None, stack=False,
+                frames=None, journal=False, tiff_workers=1):
+    if stack:
+        _import_tiff_stacks(h5file, flist, frames, journal, tiff_workers)
+    else:
+        _import_flist(h5file, flist, _TiffReader(tiff_workers), processes,
+                      queue_depth, journal)
+
+def _select_frames(nframes, frames=None):
+    """
+    Returns the list of page indices selected by frames: None (all pages), 
+    a slice, a (start, stop[, step]) tuple or a list of page indices.
+    """
+    if frames is None:
+        return range(nframes)
+    if isinstance(frames, tuple):
+        frames = slice(*frames)
+    if isinstance(frames, slice):
+        return range(*frames.indices(nframes))
+    return [idx for idx in frames if 0 <= idx < nframes]
+
+def _import_tiff_stacks(h5file, flist, frames=None, journal=False, 
+                        tiff_workers=1):
+    """
+    Imports each multi-page tiff as one 3-D CArray, chunked by frame.  
+    Pages are copied one at a time, straight from a memory-map of the file
+    when they are stored uncompressed, so memory use doesn't depend on the
+    number of frames.  The page of the file that each frame came from is 
+    kept in the frame_index attribute of the array.
+    """
+    import numpy as np
+    from analyzarr.lib.io.libs.tifffile import tifffile
+    variant = _import_variant(True, frames)
+    data_record = RowBuffer(h5file.root.image_description)
+    for idx, f, filename, content_hash in _new_files(h5file, flist, journal,
+                                                     variant):
+        print "streaming file: %s" %f
+        with tifffile(f) as tif:
+            pages = tif.series[0].pages
+            indices = _select_frames(len(pages), frames)
+            if len(indices) == 0:
+                print "no frames selected from file: %s" %f
+                if journal:
+                    # nothing was stored - a later import may select some
+                    _mark_journaled(h5file, f, state='aborted')
+                    h5file.flush()
+                continue
+            frame_shape = pages[indices[0]].shape
+            ds = _create_image_array(h5file, filename, 
+                                     np.dtype(pages[indices[0]].dtype), 
+                                     (len(indices),) + frame_shape,
+                                     chunkshape=(1,) + frame_shape,
+                                     journal=journal)
+            for frame, page_idx in enumerate(indices):
+                page = pages[page_idx]
+                if page.shape != frame_shape:
+                    raise ValueError("page %i of %s has shape %s, not %s" % 
+                                     (page_idx, f, page.shape, frame_shape))
+                data = page.memmap()
+                if data is None:
+                    data = page.asarray(maxworkers=tiff_workers)
+                ds[frame] = data
+                del data
+            ds.attrs.frame_index = np.array(indices)
+        _finish_image(h5file, data_record, ds, f, filename, idx, 
+                      content_hash, journal, variant=variant)
+        data_record.flush()
+        h5file.flush()
+    data_record.flush()
     h5file.flush()
 
 # DM3 files
-def import_dm(h5file, flist):
+def import_dm(h5file, flist, processes=1, queue_depth=None, stream=False,
+              journal=False):
+    # the image tags of each file are kept in the image_metadata table.
+    if stream:
+        _import_dm_streaming(h5file, flist, journal=journal)
+    else:
+        _import_flist(h5file, flist, _read_dm, processes, queue_depth, 
+                      journal, with_metadata=True)
+
+def _import_dm_streaming(h5file, flist, chunk_bytes=2**24, journal=False):
     from analyzarr.lib.io.digital_micrograph import file_reader
-    tmp_dm3, tmp_tags = file_reader(flist[0])
-    
-    data_record = h5file.root.image_description.row
-    for f in flist:
-        filename = os.path.splitext(os.path.split(f)[1])[0]
-        if len(h5file.root.image_description.get_where_list('filename=="%s"'%filename)) == 0:
-            print "loading file: %s" %f
-            # this is a little wasteful (re-reading the first file), 
-            # but I'm vain and want to save a line or two of code.
-            tmp_dm3, tmp_tags = file_reader(f)
-            # add a CArray for this data in the h5file
-            ds = h5file.create_carray(h5file.root.rawdata, 
-                            filename, 
-                            tb.Atom.from_dtype(tmp_dm3.data.dtype),
-                            tmp_dm3.data.shape,
-                            filters=filters
-                            )
-            # assigns the data to the array
-            ds[:] = tmp_dm3.data
-
-            # TODO: add the tags as metadata for the CArray
-            
-            # add the record for this image to the table in the h5file
-            data_record['filename'] = filename
-            data_record['idx'] = flist.index(f)
-            data_record.append()
-    # flush the data to commit our changes to the file.
-    h5file.root.image_description.flush()
+    data_record = RowBuffer(h5file.root.image_description)
+    for idx, f, filename, content_hash in _new_files(h5file, flist, journal):
+        print "streaming file: %s" %f
+        # open the file without reading the image data
+        tmp_dm3, tmp_tags = file_reader(f, load_data=False, lazy_tags=True,
+                                        cache_tags=False)
+        _store_image_chunks(h5file, data_record, f, filename, 
+                            tmp_dm3.dtype, tmp_dm3.shape, 
+                            tmp_dm3.iter_data_chunks(chunk_bytes), 
+                            idx, content_hash, journal, 
+                            tmp_dm3.get_image_tags())
+        data_record.flush()
+        h5file.flush()
+    data_record.flush()
+    h5file.flush()
+
+# MRC files
+def import_mrc(h5file, flist, frames=None, chunk_bytes=2**24, journal=False):
+    """
+    Imports MRC (and MRCS) files.  Single images are stored as 2-D arrays,
+    stacks as 3-D arrays (frames, rows, columns).  Frames are copied a few
+    at a time from a memory-map of the file, so stacks bigger than memory 
+    can be imported.  When frames picks some of the frames, the frame of 
+    the file each came from is kept in the frame_index attribute of the 
+    array, as for TIFF stacks.
+    """
+    import numpy as np
+    from analyzarr.lib.io.mrc import MRCFile
+    # MRC files are always stored whole, so only frames tells imports apart
+    variant = _import_variant(frames=frames)
+    data_record = RowBuffer(h5file.root.image_description)
+    for idx, f, filename, content_hash in _new_files(h5file, flist, journal,
+                                                     variant):
+        print "streaming file: %s" %f
+        mrc = MRCFile(f)
+        if frames is None:
+            indices = None
+            chunks = mrc.iter_data_chunks(chunk_bytes)
+            nframes = len(mrc)
+        else:
+            indices = _select_frames(len(mrc), frames)
+            if len(indices) == 0:
+                print "no frames selected from file: %s" %f
+                if journal:
+                    # nothing was stored - a later import may select some
+                    _mark_journaled(h5file, f, state='aborted')
+                    h5file.flush()
+                continue
+            native = mrc.dtype.newbyteorder('=')
+            chunks = ((frame, frame + 1, 
+                       mrc.frame(index)[np.newaxis].astype(native))
+                      for frame, index in enumerate(indices))
+            nframes = len(indices)
+        if nframes == 1:
+            # a single image - drop the frame axis
+            shape = mrc.shape[1:]
+            chunks = ((0, shape[0], block[0]) for start, stop, block 
+                      in chunks)
+        else:
+            shape = (nframes,) + mrc.shape[1:]
+        ds = _create_image_array(h5file, filename, 
+                                 mrc.dtype.newbyteorder('='), shape,
+                                 journal=journal)
+        for start, stop, block in chunks:
+            ds[start:stop] = block
+        if indices is not None:
+            ds.attrs.frame_index = np.array(indices)
+        if mrc.pixel_size is not None:
+            ds.attrs.pixel_size = mrc.pixel_size
+        _finish_image(h5file, data_record, ds, f, filename, idx,
+                      content_hash, journal, variant=variant)
+        data_record.flush()
+        h5file.flush()
+    data_record.flush()
+    h5file.flush()
+
+# DM3 spectrum images
+def import_spectra(h5file, flist, chunk_bytes=2**24):
+    """
+    Imports DM3 spectrum images into a spectrum chest (see 
+    new_spectrum_chest), as (rows, columns, energy) CArrays chunked in tiles
+    of whole spectra (see data_structure.get_chunkshape).  Each file is 
+    copied a block of rows at a time, so spectrum images bigger than memory
+    can be imported.  Files that aren't spectrum images are skipped.
+
+    The energy axis of each is kept in the energy_offset, energy_scale and
+    energy_units attributes of its array - see spectra.energy_axis.
+    """
+    from analyzarr.lib.io.digital_micrograph import file_reader
+    if isinstance(flist, basestring):
+        flist = [flist]
+    data_record = RowBuffer(h5file.root.image_description)
+    for idx, f, filename, content_hash in _new_files(h5file, flist):
+        tmp_dm3, tmp_tags = file_reader(f, load_data=False, lazy_tags=True,
+                                        cache_tags=False)
+        if tmp_dm3.record_by != 'spectrum' or len(tmp_dm3.shape) < 2:
+            print "not a spectrum image, skipping: %s" %f
+            continue
+        print "streaming file: %s" %f
+        shape, dtype = tmp_dm3.shape, tmp_dm3.dtype
+        chunkshape = get_chunkshape('spectra', shape, dtype)
+        ds = h5file.create_carray(h5file.root.rawdata, filename,
+                                  tb.Atom.from_dtype(dtype), shape,
+                                  filters=get_filters('spectra'),
+                                  chunkshape=chunkshape)
+        # copy whole rows of chunks at a time, so each chunk is written once
+        tile_bytes = chunkshape[0] * (ds.size_in_memory // shape[0])
+        block_bytes = max(1, chunk_bytes // tile_bytes) * tile_bytes
+        for start, stop, block in tmp_dm3.iter_data_chunks(block_bytes):
+            ds[start:stop] = block
+        # DM keeps the origin in channels, counted negative
+        energy = tmp_dm3.dimensions[-1]
+        ds.attrs.energy_scale = float(energy['scales'])
+        ds.attrs.energy_offset = -float(energy['origins']) * \
+                                 float(energy['scales'])
+        ds.attrs.energy_units = str(energy['units'])
+        _finish_image(h5file, data_record, ds, f, filename, idx, 
+                      content_hash, metadata=tmp_dm3.get_image_tags())
+        data_record.flush()
+        h5file.flush()
+    data_record.flush()
     h5file.flush()
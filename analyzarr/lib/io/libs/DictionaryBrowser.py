@@ -24,7 +24,7 @@ def fsdict(nodes, value, dic):
 class DictionaryBrowser(object):
     """A class to comfortably access some parameters as attributes"""
 
-    def __init__(self, dictionary={}, pwd=[], sep='.'):
+    def __init__(self, dictionary={}, pwd=[], sep='.', load=True):
         super(DictionaryBrowser, self).__init__()
         self.sep = sep
         self.home = dictionary
@@ -32,7 +32,10 @@ class DictionaryBrowser(object):
         self.pwd = []
         self.cd(pwd) # update self.dic and self.pwd
         self.oldpwd = self.pwd[:]
-        self.load_dictionary(dictionary)
+        # the browsers made by ls and cd only walk the dictionary, and
+        #   loading would build a browser for every sub-dictionary.
+        if load:
+            self.load_dictionary(dictionary)
 
 
     def load_dictionary(self, dictionary):
@@ -167,7 +170,8 @@ class DictionaryBrowser(object):
         pwd = pwd[:] # don't modify the input object, work with a copy
 
         if pwd == '..':
-            dic = DictionaryBrowser(dictionary=self.home, pwd=self.pwd[:-1])
+            dic = DictionaryBrowser(dictionary=self.home, pwd=self.pwd[:-1],
+                                    load=False)
             return dic.ls()
 
         if type(pwd) is str:
@@ -179,7 +183,8 @@ class DictionaryBrowser(object):
         if cdir:
             if pwd:
                 try:
-                    dic = DictionaryBrowser(dictionary=self.dic[cdir])
+                    dic = DictionaryBrowser(dictionary=self.dic[cdir],
+                                            load=False)
                     return dic.ls(pwd)
                 except KeyError, key:
                     if dbg:
@@ -247,14 +252,16 @@ class DictionaryBrowser(object):
             self.pwd.pop()
             self.dic = self.home.copy()
             pwd = self.pwd[:]
-            newdic = DictionaryBrowser(dictionary=self.dic, pwd=pwd, sep=self.sep)
+            newdic = DictionaryBrowser(dictionary=self.dic, pwd=pwd, sep=self.sep,
+                                       load=False)
             self.dic = newdic.dic.copy() # update the 'dic' attribute
             self.pwd =  newdic.pwd[:]
         elif pwd == '-': # going to old directory (in *nix: cd -)
             self.dic = self.home.copy()
             pwd = self.oldpwd[:]
             self.oldpwd = self.pwd[:]
-            newdic = DictionaryBrowser(dictionary=self.dic, pwd=pwd, sep=self.sep)
+            newdic = DictionaryBrowser(dictionary=self.dic, pwd=pwd, sep=self.sep,
+                                       load=False)
             self.dic = newdic.dic.copy() # update the 'dic' attribute
             self.pwd =  newdic.pwd[:]
         else:
@@ -280,7 +287,7 @@ class DictionaryBrowser(object):
                         return None
                     if pwd:
                         newdic = DictionaryBrowser(dictionary=self.dic, pwd=pwd,
-                                                   sep=self.sep)
+                                                   sep=self.sep, load=False)
                         self.dic = newdic.dic.copy()
                         self.pwd += newdic.pwd
                 except KeyError, key: # non existing key (directory)
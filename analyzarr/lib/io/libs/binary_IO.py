@@ -205,7 +205,7 @@ def read_char(f, endian):
         return s.unpack(data)[0]
 
 def read_data_array(filename, byte_size=0, byte_address=0,
-                    data_type='uint8', write=True):
+                    data_type='uint8', write=True, memmap=False):
     # inspired by numpy's memmap
     """Return a 1-D numpy ndarray from data contained in a binary file.
 
@@ -228,6 +228,12 @@ def read_data_array(filename, byte_size=0, byte_address=0,
         Default is 'uint8'.
     write : bool, optional
         Whether the output array should be writeable
+    memmap : bool, optional
+        If True, don't copy anything: return a numpy memmap of the data in
+        the file.  Data is only read from disk when it is accessed, and the
+        mapping stays open for as long as the array (or any view of it) is
+        alive.  If write is True, the map is copy-on-write: the array can be
+        changed, but changes never reach the file.
     """
     # import here to minimize import overhead
     import mmap
@@ -235,10 +241,19 @@ def read_data_array(filename, byte_size=0, byte_address=0,
     if hasattr(filename,'read'):
         fobj = filename
     else:
-        fobj = file(filename, 'r+b')
+        fobj = file(filename, 'rb')
     if byte_size == 0:
         byte_size = os.fstat(fobj.fileno())[6]
-    # To be fast, we want to map just the bytes of the file
+    if memmap:
+        size = byte_size // np.dtype(data_type).itemsize
+        # numpy takes care of the allocation granularity, and holds on to
+        #   the mapping itself.  Closing the file doesn't invalidate it.
+        data = np.memmap(fobj, dtype=data_type, mode='c' if write else 'r',
+                         offset=byte_address, shape=(size,))
+        fobj.close()
+        return data
+    # Otherwise, the data is copied out of the map, which is closed
+    # before returning.  We want to map just the bytes of the file
     # where the image data is stored. However, the module mmap
     # only allows one to offset at multiples of ALLOCATIONGRANULARITY,
     # so we must set up a little trick to map as little bytes
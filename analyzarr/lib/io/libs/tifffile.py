@@ -409,6 +409,9 @@ def imread(filename, *args, **kwargs):
     series : int
         Defines which series of pages to return as array.
 
+    maxworkers : int
+        Number of threads or processes used to decompress each page.
+
     Example
     -------
 
@@ -597,7 +600,7 @@ class TIFFfile(object):
                       for s in shapes]
         return series
 
-    def asarray(self, key=None, series=None):
+    def asarray(self, key=None, series=None, maxworkers=1):
         """Return image data of multiple TIFF pages as numpy array.
 
         By default the first image series is returned.
@@ -611,6 +614,9 @@ class TIFFfile(object):
         series : int
             Defines which series of pages to return as array.
 
+        maxworkers : int
+            Number of threads or processes used to decompress each page.
+
         """
         if key is None and series is None:
             series = 0
@@ -631,10 +637,12 @@ class TIFFfile(object):
             raise TypeError('key must be an int, slice, or sequence')
 
         if len(pages) == 1:
-            return pages[0].asarray()
+            return pages[0].asarray(maxworkers=maxworkers)
         elif self.is_nih:
             result = numpy.vstack(p.asarray(colormapped=False,
-                                            squeeze=False) for p in pages)
+                                            squeeze=False,
+                                            maxworkers=maxworkers)
+                                  for p in pages)
             if pages[0].is_palette:
                 result = numpy.take(pages[0].color_map, result, axis=1)
                 result = numpy.swapaxes(result, 0, 1)
@@ -643,7 +651,8 @@ class TIFFfile(object):
                 firstpage = next(p for p in pages if p)
                 nopage = numpy.zeros_like(
                     firstpage.asarray())
-            result = numpy.vstack((p.asarray() if p else nopage)
+            result = numpy.vstack((p.asarray(maxworkers=maxworkers)
+                                   if p else nopage)
                                   for p in pages)
         if key is None:
             try:
@@ -1035,7 +1044,8 @@ class TIFFpage(object):
             self.strip_byte_counts = numpy.prod(self.shape) * (
                 self.bits_per_sample // 8)
 
-    def asarray(self, squeeze=True, colormapped=True, rgbonly=True):
+    def asarray(self, squeeze=True, colormapped=True, rgbonly=True,
+                maxworkers=1):
         """Read image data from file and return as numpy array.
 
         Raise ValueError if format is unsupported.
@@ -1055,6 +1065,10 @@ class TIFFpage(object):
         rgbonly : bool
             If True return RGB(A) image without additional extra samples.
 
+        maxworkers : int
+            Number of threads or processes used to decompress the strips
+            or tiles of compressed images.
+
         """
         fhandle = self.parent.fhandle
         if not fhandle:
@@ -1126,12 +1140,13 @@ class TIFFpage(object):
                 unpack = lambda x: unpackints(x, typecode, bits_per_sample,
                                               runlen)
             decompress = TIFF_DECOMPESSORS[self.compression]
+            strips = _decode_strips(fhandle, offsets, byte_counts,
+                                    decompress, maxworkers)
             if self.is_tiled:
                 result = numpy.empty(shape, dtype)
                 tw, tl, pl = 0, 0, 0
-                for offset, bytecount in zip(offsets, byte_counts):
-                    fhandle.seek(offset, 0)
-                    tile = unpack(decompress(fhandle.read(bytecount)))
+                for strip in strips:
+                    tile = unpack(strip)
                     tile.shape = tile_shape
                     result[0, pl, tl:tl+tile_length,
                            tw:tw+tile_width, :] = tile
@@ -1145,9 +1160,8 @@ class TIFFpage(object):
             else:
                 result = numpy.empty(shape, dtype).reshape(-1)
                 index = 0
-                for offset, bytecount in zip(offsets, byte_counts):
-                    fhandle.seek(offset, 0)
-                    stripe = unpack(decompress(fhandle.read(bytecount)))
+                for strip in strips:
+                    stripe = unpack(strip)
                     size = min(result.size, stripe.size)
                     result[index:index+size] = stripe[:size]
                     del stripe
@@ -1190,6 +1204,41 @@ class TIFFpage(object):
 
         return result
 
+    def memmap(self):
+        """Return read-only memory-map of image data, or None.
+
+        Only uncompressed image data that is stored in one contiguous block
+        and needs no further processing (no predictor, palette or extra
+        samples) can be mapped. Use asarray for everything else.
+
+        """
+        fhandle = self.parent.fhandle
+        if not fhandle:
+            raise IOError("TIFF file is not open")
+        if (self.dtype is None or self.compression or self.is_tiled or
+                self.is_stk or self.is_palette or
+                self.predictor == 'horizontal' or
+                'extra_samples' in self.tags or
+                self.bits_per_sample not in (8, 16, 32, 64)):
+            return None
+        offsets = self.strip_offsets
+        byte_counts = self.strip_byte_counts
+        try:
+            offsets[0]
+        except TypeError:
+            offsets = (offsets, )
+            byte_counts = (byte_counts, )
+        if any(offsets[i] != offsets[i+1] - byte_counts[i]
+               for i in range(len(offsets)-1)):
+            return None
+        result = numpy.memmap(fhandle, self.parent.byte_order + self._dtype,
+                              'r', offsets[0], self._shape)
+        try:
+            result.shape = self.shape
+        except ValueError:
+            pass
+        return result
+
     def __str__(self):
         """Return string containing information about page."""
         s = ', '.join(s for s in (
@@ -1578,22 +1627,21 @@ def decodepackbits(encoded):
     PackBits is a simple byte-oriented run-length compression scheme.
 
     """
-    func = ord if sys.version[0] == '2' else lambda x: x
+    counts = bytearray(encoded)
+    end = len(counts)
     result = []
+    append = result.append
     i = 0
-    try:
-        while True:
-            n = func(encoded[i]) + 1
+    while i < end:
+        n = counts[i] + 1
+        i += 1
+        if n < 129:
+            append(encoded[i:i+n])
+            i += n
+        elif n > 129:
+            append(encoded[i:i+1] * (258-n))
             i += 1
-            if n < 129:
-                result.extend(encoded[i:i+n])
-                i += n
-            elif n > 129:
-                result.extend(encoded[i:i+1] * (258-n))
-                i += 1
-    except IndexError:
-        pass
-    return b''.join(result) if sys.version[0] == '2' else bytes(result)
+    return b''.join(result)
 
 
 @_replace_by('_tifffile.decodelzw')
@@ -1605,8 +1653,13 @@ def decodelzw(encoded):
     This is an implementation of the LZW decoding algorithm described in (1).
     It is not compatible with old style LZW compressed files like quad-lzw.tif.
 
+    The bit width of each code only depends on how many codes were read
+    since the last CLEAR code, so all codes up to the next CLEAR code are
+    cut out of the strip at once with numpy.
+
     """
-    unpack = struct.unpack
+    if len(encoded) < 4:
+        raise ValueError("strip must be at least 4 characters long")
 
     if sys.version[0] == '2':
         newtable = [chr(i) for i in range(256)]
@@ -1614,49 +1667,47 @@ def decodelzw(encoded):
         newtable = [bytes([i]) for i in range(256)]
     newtable.extend((0, 0))
 
-    def next_code():
-        """Return integer of `bitw` bits at `bitcount` position in encoded."""
-        start = bitcount // 8
-        s = encoded[start:start+4]
-        try:
-            code = unpack('>I', s)[0]
-        except Exception:
-            code = unpack('>I', s + b'\x00'*(4-len(s)))[0]
-        code = code << (bitcount % 8)
-        code = code & mask
-        return code >> shr
-
-    switchbitch = {  # code: bit-width, shr-bits, bit-mask
-        255: (9, 23, int(9*'1'+'0'*23, 2)),
-        511: (10, 22, int(10*'1'+'0'*22, 2)),
-        1023: (11, 21, int(11*'1'+'0'*21, 2)),
-        2047: (12, 20, int(12*'1'+'0'*20, 2)), }
-    bitw, shr, mask = switchbitch[255]
-    bitcount = 0
-
-    if len(encoded) < 4:
-        raise ValueError("strip must be at least 4 characters long")
+    # 24 bits starting at each byte; a code is at most 12 bits wide and
+    # starts anywhere in its first byte, so it fits in one of these.
+    data = numpy.zeros(len(encoded) + 2, numpy.uint32)
+    data[:-2] = numpy.frombuffer(encoded, numpy.uint8)
+    window = data[:-2] << 16 | data[1:-1] << 8 | data[2:]
+    nbits = len(encoded) * 8
 
-    if next_code() != 256:
+    if window[0] >> 15 != 256:
         raise ValueError("strip must begin with CLEAR code")
 
-    code = oldcode = 0
+    # bit width, mask and offset of the codes following a CLEAR code
+    widths = 9 + numpy.searchsorted([511, 1023, 2047],
+                                    numpy.arange(257, 4096), 'right')
+    masks = (1 << widths) - 1
+    ends = numpy.cumsum(widths)
+    offsets = ends - widths
+
+    code = 256
+    bitcount = 9
     result = []
-    while True:
-        code = next_code()  # ~5% faster when inlining this function
-        bitcount += bitw
-        if code == 257:  # EOI
+    append = result.append
+    while code == 256:  # CLEAR
+        ncodes = numpy.searchsorted(bitcount + ends, nbits, 'right')
+        positions = bitcount + offsets[:ncodes]
+        codes = ((window[positions >> 3] >> (24 - widths[:ncodes] -
+                  (positions & 7))) & masks[:ncodes]).tolist()
+        if not codes:
             break
-        if code == 256:  # CLEAR
-            table = newtable[:]
-            lentable = 258
-            bitw, shr, mask = switchbitch[255]
-            code = next_code()
-            bitcount += bitw
-            if code == 257:  # EOI
+        code = codes[0]
+        if code == 257 or code == 256:
+            bitcount += int(widths[0])
+            continue
+        table = newtable[:]
+        lentable = 258
+        append(table[code])
+        oldcode = code
+        for index in range(1, ncodes):
+            code = codes[index]
+            if code == 257 or code == 256:
+                bitcount += int(ends[index])
                 break
-            result.append(table[code])
-        else:
             if code < lentable:
                 decoded = table[code]
                 newcode = table[oldcode] + decoded[:1]
@@ -1664,12 +1715,10 @@ def decodelzw(encoded):
                 newcode = table[oldcode]
                 newcode += newcode[:1]
                 decoded = newcode
-            result.append(decoded)
+            append(decoded)
             table.append(newcode)
             lentable += 1
-        oldcode = code
-        if lentable in switchbitch:
-            bitw, shr, mask = switchbitch[lentable]
+            oldcode = code
 
     if code != 257:
         raise ValueError("unexpected end of stream (code %i)" % code)
@@ -1677,6 +1726,67 @@ def decodelzw(encoded):
     return b''.join(result)
 
 
+# Worker pools of _decode_strips, by (kind, size).  They are shared by all
+# pages, and closed when the interpreter exits.
+_decode_pools = {}
+
+
+def _decode_pool(maxworkers, processes):
+    """Return a shared pool of maxworkers threads or processes."""
+    import multiprocessing
+    if processes and multiprocessing.current_process().daemon:
+        # daemonic processes (e.g. pool workers) can't start processes
+        processes = False
+    key = (processes, maxworkers)
+    pool = _decode_pools.get(key)
+    if pool is None:
+        if processes:
+            pool = multiprocessing.Pool(maxworkers)
+        else:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(maxworkers)
+        if not _decode_pools:
+            import atexit
+            atexit.register(_close_decode_pools)
+        _decode_pools[key] = pool
+    return pool
+
+
+def _close_decode_pools():
+    for pool in _decode_pools.values():
+        pool.terminate()
+        pool.join()
+    _decode_pools.clear()
+
+
+def _decode_strips(fhandle, offsets, byte_counts, decompress, maxworkers=1):
+    """Yield decompressed strips or tiles of a page in file order.
+
+    The compressed data is always read in the calling thread. If maxworkers
+    is larger than 1, it is decompressed in a shared pool of that many
+    workers: threads for the zlib and C extension decoders, which release
+    the GIL, and processes for the pure Python ones, which don't.
+    Uncompressed strips are never sent to a pool.
+
+    """
+    if (maxworkers > 1 and len(offsets) > 1 and
+            decompress is not TIFF_DECOMPESSORS[None]):
+        compressed = []
+        for offset, bytecount in zip(offsets, byte_counts):
+            fhandle.seek(offset, 0)
+            compressed.append(fhandle.read(bytecount))
+        pool = _decode_pool(
+            maxworkers, getattr(decompress, '__module__', None) == __name__)
+        decompressed = pool.map(decompress, compressed)
+        del compressed
+        for strip in decompressed:
+            yield strip
+    else:
+        for offset, bytecount in zip(offsets, byte_counts):
+            fhandle.seek(offset, 0)
+            yield decompress(fhandle.read(bytecount))
+
+
 @_replace_by('_tifffile.unpackints')
 def unpackints(data, dtype, itemsize, runlen=0):
     """Decompress byte string to array of integers of any bit size <= 32.
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2012, Michael Sarahan
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+    Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+    Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# MRC (and MRCS) files, as written by direct detectors and most EM software.
+#   A 1024-byte header, an optional extended header, then the frames as one
+#   C-ordered (frames, rows, columns) block.  See 
+#   http://www.ccpem.ac.uk/mrc_format/mrc2014.php
+
+import numpy as np
+
+import libs.binary_IO as binIO
+
+header_bytes = 1024
+
+# the main header fields, in order.  The rest of the header is the labels.
+_header_fields = [
+    ('nx', 'i4'), ('ny', 'i4'), ('nz', 'i4'), ('mode', 'i4'),
+    ('nxstart', 'i4'), ('nystart', 'i4'), ('nzstart', 'i4'),
+    ('mx', 'i4'), ('my', 'i4'), ('mz', 'i4'),
+    ('cella', 'f4', (3,)), ('cellb', 'f4', (3,)),
+    ('mapc', 'i4'), ('mapr', 'i4'), ('maps', 'i4'),
+    ('dmin', 'f4'), ('dmax', 'f4'), ('dmean', 'f4'),
+    ('ispg', 'i4'), ('nsymbt', 'i4'), ('extra1', 'V8'), ('exttyp', 'S4'),
+    ('nversion', 'i4'), ('extra2', 'V84'), ('origin', 'f4', (3,)),
+    ('map', 'S4'), ('machst', 'u1', (4,)), ('rms', 'f4'), ('nlabl', 'i4'),
+    ('label', 'S80', (10,)),
+    ]
+
+# data type of each mode.  Mode 0 is signed in MRC2014 (older files may 
+#   hold unsigned bytes).  Modes 3 (complex short) and 101 (4-bit) aren't 
+#   supported.
+mode_dtypes = {0: 'i1', 1: 'i2', 2: 'f4', 4: 'c8', 6: 'u2', 12: 'f2'}
+
+class MRCFormatError(ValueError):
+    pass
+
+def _guess_byte_order(raw):
+    # the machine stamp says, if it was written.  Otherwise, the byte order
+    #   that gives a known mode.
+    stamp = ord(raw[212:213])
+    if stamp == 0x44:
+        return '<'
+    if stamp == 0x11:
+        return '>'
+    for order in '<>':
+        mode = np.frombuffer(raw[12:16], order + 'i4')[0]
+        if mode in mode_dtypes:
+            return order
+    return '<'
+
+def read_header(filename):
+    """
+    Returns the main header of an MRC file as a dictionary, with its byte
+    order ('<' or '>') under 'byte_order'.
+    """
+    with open(filename, 'rb') as f:
+        raw = f.read(header_bytes)
+    if len(raw) < header_bytes:
+        raise MRCFormatError("%s is too short to be an MRC file." % filename)
+    order = _guess_byte_order(raw)
+    dtype = np.dtype([(field[0], order + field[1]) + field[2:] 
+                      for field in _header_fields])
+    record = np.frombuffer(raw, dtype)[0]
+    header = dict((name, record[name]) for name in dtype.names)
+    header['byte_order'] = order
+    header['label'] = [label.strip() for label in 
+                       header['label'][:max(0, header['nlabl'])]]
+    return header
+
+class MRCFile(object):
+    """
+    An MRC file, with its frames mapped rather than read.  data is a 
+    (frames, rows, columns) memmap of the file, and frames are read from 
+    disk only when they are used.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = read_header(filename)
+        mode = int(self.header['mode'])
+        if mode not in mode_dtypes:
+            raise MRCFormatError("MRC mode %i (in %s) is not supported." % (
+                mode, filename))
+        self.dtype = np.dtype(mode_dtypes[mode]).newbyteorder(
+            self.header['byte_order'])
+        self.shape = (int(self.header['nz']), int(self.header['ny']), 
+                      int(self.header['nx']))
+        if min(self.shape) < 1:
+            raise MRCFormatError("%s has no frames." % filename)
+        self.byte_offset = header_bytes + int(self.header['nsymbt'])
+        self.imbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = binIO.read_data_array(self.filename, self.imbytes,
+                                               self.byte_offset, self.dtype,
+                                               write=False, memmap=True
+                                               ).reshape(self.shape)
+        return self._data
+
+    @property
+    def pixel_size(self):
+        """
+        The (x, y) pixel size in Angstroms, or None if the header lacks it.
+        """
+        mx, my = self.header['mx'], self.header['my']
+        if mx <= 0 or my <= 0 or self.header['cella'][0] <= 0:
+            return None
+        return (float(self.header['cella'][0]) / mx, 
+                float(self.header['cella'][1]) / my)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def frame(self, index):
+        return self.data[index]
+
+    def iter_data_chunks(self, chunk_bytes=2**24):
+        """
+        Yields (start, stop, data) tuples, where data holds frames 
+        start:stop, in the platform's byte order.  No more than about 
+        chunk_bytes of frames are held at once (but always at least one).
+        """
+        frame_bytes = self.shape[1] * self.shape[2] * self.dtype.itemsize
+        frames = max(1, chunk_bytes // frame_bytes)
+        for start in xrange(0, self.shape[0], frames):
+            stop = min(start + frames, self.shape[0])
+            yield start, stop, self.data[start:stop].astype(
+                self.dtype.newbyteorder('='))
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2012, Michael Sarahan
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+    Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+    Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Image pyramids: copies of a raw image downsampled 2x, 4x, 8x ... so that
+#   big images can be shown at the resolution of the screen, rather than
+#   reading and drawing every pixel.  The pyramid of /rawdata/<name> is kept
+#   in /pyramids/<name>, as datasets level1 (2x), level2 (4x), and so on.
+#   Pyramids are built under a temporary name and only given their real one
+#   once complete, so a build that fails part way never leaves a pyramid
+#   that looks usable.
+
+import math
+
+import numpy as np
+import tables as tb
+
+from data_structure import get_filters, get_chunkshape
+
+# levels are made until the image fits in this many pixels on a side
+min_size = 512
+
+_building_prefix = '_building_'
+
+def _halve(block):
+    # average 2x2 blocks of pixels.  An odd last row or column is averaged
+    #   with itself.
+    block = block.astype(np.float32)
+    if block.shape[0] % 2:
+        block = np.concatenate((block, block[-1:]), axis=0)
+    if block.shape[1] % 2:
+        block = np.concatenate((block, block[:, -1:]), axis=1)
+    return (block[0::2, 0::2] + block[1::2, 0::2] +
+            block[0::2, 1::2] + block[1::2, 1::2]) / 4
+
+def _downsample(h5file, group, name, source, block_bytes=2**24):
+    shape = ((source.shape[0] + 1) // 2, (source.shape[1] + 1) // 2)
+    level = h5file.create_carray(group, name,
+                                 tb.Atom.from_dtype(source.dtype), shape,
+                                 filters=get_filters('raw'),
+                                 chunkshape=get_chunkshape('raw', shape,
+                                                           source.dtype))
+    # read an even number of source rows at a time, so memory use is flat
+    row_bytes = source.shape[1] * source.dtype.itemsize
+    rows = max(2, block_bytes // row_bytes // 2 * 2)
+    integer = np.issubdtype(source.dtype, np.integer)
+    for start in xrange(0, source.shape[0], rows):
+        block = _halve(source[start:start + rows])
+        if integer:
+            block = np.rint(block)
+        level[start // 2:start // 2 + block.shape[0]] = \
+            block.astype(source.dtype)
+    return level
+
+def build_pyramid(h5file, node, min_size=min_size):
+    """
+    (Re)builds the pyramid for a 2D dataset in /rawdata, and returns its
+    levels: the dataset itself, then the 2x, 4x, ... downsampled copies.
+    Each level is made from the one before it.
+    """
+    if '/pyramids' not in h5file:
+        h5file.create_group('/', 'pyramids')
+    pyramids = h5file.root.pyramids
+    # left over from a build that didn't finish
+    if _building_prefix + node.name in pyramids:
+        h5file.remove_node(pyramids, _building_prefix + node.name, 
+                           recursive=True)
+    group = h5file.create_group(pyramids, _building_prefix + node.name)
+    try:
+        levels = [node]
+        while max(levels[-1].shape) > min_size:
+            levels.append(_downsample(h5file, group, 
+                                      'level%i' % len(levels), levels[-1]))
+        group._v_attrs.source_shape = node.shape
+    except:
+        h5file.remove_node(group, recursive=True)
+        raise
+    if node.name in pyramids:
+        h5file.remove_node(pyramids, node.name, recursive=True)
+    h5file.rename_node(group, node.name)
+    h5file.flush()
+    return levels
+
+def _is_complete(group, node, min_size):
+    # built for a dataset of this size, with levels 1, 2, ... each half the
+    #   size of the one before, down to min_size
+    if ('source_shape' not in group._v_attrs or 
+            tuple(group._v_attrs.source_shape) != tuple(node.shape)):
+        return False
+    shape = tuple(node.shape)
+    nlevels = 0
+    while max(shape) > min_size:
+        nlevels += 1
+        shape = ((shape[0] + 1) // 2, (shape[1] + 1) // 2)
+        name = 'level%i' % nlevels
+        if (name not in group._v_children or 
+                tuple(group._v_children[name].shape) != shape):
+            return False
+    return True
+
+def get_levels(h5file, node, min_size=min_size):
+    """
+    Returns the pyramid levels of a 2D dataset in /rawdata, building the
+    pyramid the first time it is asked for.  A pyramid that doesn't match 
+    the dataset (it was replaced by one of another size, or the pyramid is
+    missing levels) is rebuilt.
+    """
+    if '/pyramids' in h5file and node.name in h5file.root.pyramids:
+        group = h5file.get_node(h5file.root.pyramids, node.name)
+        if _is_complete(group, node, min_size):
+            names = sorted(group._v_children.keys(),
+                           key=lambda name: int(name[len('level'):]))
+            return [node] + [group._v_children[name] for name in names]
+    return build_pyramid(h5file, node, min_size)
+
+def build_pyramids(h5file, names=None, min_size=min_size):
+    """
+    Builds the pyramids of the 2D datasets in /rawdata larger than min_size,
+    or of only the named ones.  Pyramids are otherwise made the first time
+    an image is shown.
+    """
+    for node in h5file.list_nodes('/rawdata'):
+        if names is not None and node.name not in names:
+            continue
+        if len(node.shape) == 2 and max(node.shape) > min_size:
+            get_levels(h5file, node, min_size)
+
+def choose_level(nlevels, scale):
+    """
+    Returns the pyramid level to show when each screen pixel covers scale
+    pixels of the full-resolution image: the coarsest level that still has
+    at least one pixel per screen pixel.
+    """
+    if scale < 2:
+        return 0
+    return min(nlevels - 1, int(math.floor(math.log(scale, 2))))
+
+def read_region(levels, level, x0, x1, y0, y1):
+    """
+    Reads the part of a pyramid level that covers columns x0 to x1 and rows
+    y0 to y1 of the full-resolution image.
+
+    Returns the data and its bounds (x0, x1, y0, y1) in full-resolution
+    pixels.
+    """
+    factor = 2 ** level
+    data = levels[level]
+    rows, cols = [int(size) for size in data.shape]
+    c0 = min(max(0, int(x0 // factor)), cols - 1)
+    c1 = min(cols, max(c0 + 1, int(math.ceil(x1 / float(factor)))))
+    r0 = min(max(0, int(y0 // factor)), rows - 1)
+    r1 = min(rows, max(r0 + 1, int(math.ceil(y1 / float(factor)))))
+    return data[r0:r1, c0:c1], (c0 * factor, c1 * factor,
+                                r0 * factor, r1 * factor)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2012, Michael Sarahan
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+    Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+    Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Reading spectrum images stored by file_import.import_spectra.  These are
+#   (rows, columns, energy) arrays, chunked in tiles of pixels that each hold
+#   whole spectra: a pixel's spectrum is in one chunk, and an energy window
+#   map is made in one sweep over the chunks, a row of chunks at a time.
+
+import numpy as np
+
+def energy_axis(node):
+    """
+    Returns the energy of each channel of a spectrum image.
+    """
+    return node.attrs.energy_offset + \
+           node.attrs.energy_scale * np.arange(node.shape[-1])
+
+def get_channels(node, e0, e1):
+    """
+    Returns the (start, stop) channels of the energy window e0 to e1, in 
+    the units of the spectrum image's energy axis.
+    """
+    offset, scale = node.attrs.energy_offset, node.attrs.energy_scale
+    start = int(np.ceil((e0 - offset) / scale))
+    stop = int(np.floor((e1 - offset) / scale)) + 1
+    return max(0, start), min(node.shape[-1], stop)
+
+def get_spectrum(node, row, col):
+    """
+    Returns the spectrum of one pixel (from a single chunk).
+    """
+    return node[row, col]
+
+def energy_window_map(node, e0, e1):
+    """
+    Returns the map of the counts in the energy window e0 to e1 - each 
+    pixel's spectrum summed over the window.  The spectrum image is read a
+    row of chunks at a time, so each chunk is read once, and only one row of
+    chunks is held in memory.
+    """
+    start, stop = get_channels(node, e0, e1)
+    if start >= stop:
+        raise ValueError("No channels between %s and %s %s." % (
+            e0, e1, node.attrs.energy_units))
+    rows = node.chunkshape[0]
+    result = np.zeros(node.shape[:-1], dtype=np.float64)
+    for row in xrange(0, node.shape[0], rows):
+        result[row:row + rows] = node[row:row + rows, ..., start:stop].sum(
+            axis=-1)
+    return result
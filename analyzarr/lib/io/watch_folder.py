@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2012, Michael Sarahan
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+    Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+    Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+
+import file_import
+
+class FolderWatcher(object):
+    """
+    Imports new files from a folder into a chest as they are written there.
+
+    Call poll() every so often - HighSeasAdventure does this from a GUI 
+    timer.  A file is imported once its size and modification time are the
+    same on two polls in a row, so files that are still being written are
+    left alone until they are done.  Imports are journaled: a crash doesn't
+    leave half an image in the chest, and a new watcher on the same folder
+    doesn't import anything twice.  A file that can't be imported is 
+    reported, kept in failed, and skipped until it changes.
+
+    import_options are passed on to file_import.import_files.
+    """
+    def __init__(self, h5file, folder, **import_options):
+        self.h5file = h5file
+        self.folder = folder
+        self.import_options = import_options
+        self.extensions = (file_import.img_extensions + 
+                           file_import.tiff_extensions + 
+                           file_import.dm_extensions +
+                           file_import.mrc_extensions)
+        # size and modification time of unfinished files on the last poll
+        self._growing = {}
+        # files that have been imported (or skipped as duplicates)
+        self._done = set()
+        # files that couldn't be imported, with their size and modification 
+        #   time at the time
+        self.failed = {}
+
+    def poll(self):
+        """
+        Imports the files that have finished writing since the last poll.
+        Returns the names of the new nodes in /rawdata.
+        """
+        finished = []
+        growing = {}
+        for name in sorted(os.listdir(self.folder)):
+            path = os.path.join(self.folder, name)
+            if (path in self._done or 
+                    os.path.splitext(name)[1] not in self.extensions):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed since we listed the folder
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            if self.failed.get(path) == signature:
+                continue
+            if stat.st_size > 0 and self._growing.get(path) == signature:
+                finished.append(path)
+            else:
+                growing[path] = signature
+        self._growing = growing
+        if not finished:
+            return []
+        table = self.h5file.root.image_description
+        nrows = table.nrows
+        # import_files picks the reader from the first file, so import each
+        #    kind of file separately.
+        for extensions in (file_import.img_extensions, 
+                           file_import.tiff_extensions,
+                           file_import.dm_extensions,
+                           file_import.mrc_extensions):
+            flist = [f for f in finished 
+                     if os.path.splitext(f)[1] in extensions]
+            if flist:
+                self._import(flist)
+        self._done.update(f for f in finished if f not in self.failed)
+        return [row['filename'] for row in table.iterrows(start=nrows)]
+
+    def _import(self, flist):
+        try:
+            file_import.import_files(self.h5file, flist, journal=True,
+                                     **self.import_options)
+            for f in flist:
+                self.failed.pop(f, None)
+            return
+        except Exception:
+            if len(flist) == 1:
+                self._fail(flist[0])
+                return
+        # find the bad ones - the journal skips those already imported
+        for f in flist:
+            try:
+                file_import.import_files(self.h5file, [f], journal=True,
+                                         **self.import_options)
+                self.failed.pop(f, None)
+            except Exception:
+                self._fail(f)
+
+    def _fail(self, f):
+        import traceback
+        print "could not import %s:" % f
+        traceback.print_exc()
+        try:
+            stat = os.stat(f)
+            self.failed[f] = (stat.st_size, stat.st_mtime)
+        except OSError:
+            # gone - nothing to retry
+            self.failed[f] = None
@@ -0,0 +1,40 @@
+import numpy as np
+
+from analyzarr.lib.cv import ncc
+
+def brute_force_xcorr(template, image):
+    # CV_TM_CCOEFF_NORMED, one window at a time
+    template = np.asarray(template, dtype=np.float64)
+    image = np.asarray(image, dtype=np.float64)
+    th, tw = template.shape
+    template = template - template.mean()
+    result = np.zeros((image.shape[0] - th + 1, image.shape[1] - tw + 1))
+    for row in xrange(result.shape[0]):
+        for col in xrange(result.shape[1]):
+            window = image[row:row + th, col:col + tw]
+            window = window - window.mean()
+            norm = np.sqrt(np.sum(window**2) * np.sum(template**2))
+            if norm > 0:
+                result[row, col] = np.sum(window * template) / norm
+    return result
+
+def test_xcorr_offset_uint16():
+    # a big offset and little contrast, as from a 16-bit detector
+    rng = np.random.RandomState(0)
+    image = (30000 + 3 * rng.randn(100, 110)).astype(np.uint16)
+    template = image[40:72, 25:57]
+    result = ncc.xcorr(template, image)
+    expected = brute_force_xcorr(template, image)
+    assert result.shape == expected.shape
+    assert np.abs(result - expected).max() < 1e-5
+    assert abs(result[40, 25] - 1) < 1e-5
+
+def test_xcorr_tiles_match_xcorr():
+    rng = np.random.RandomState(1)
+    image = rng.rand(300, 250)
+    template = image[100:121, 50:69]
+    expected = ncc.xcorr(template, image)
+    result = np.zeros_like(expected)
+    for top, left, tile in ncc.xcorr_tiles(template, image, tile_size=64):
+        result[top:top + tile.shape[0], left:left + tile.shape[1]] = tile
+    assert np.abs(result - expected).max() < 1e-4
@@ -0,0 +1,37 @@
+import numpy as np
+
+from analyzarr.lib.cv.peak_char import _kill_duplicates
+
+def greedy_suppression(arr, minimum_distance, heights):
+    # the highest peak left is kept, and its neighbours dropped, one at a time
+    order = np.argsort(-heights, kind='mergesort')
+    suppressed = np.zeros(len(arr), dtype=bool)
+    kept = np.zeros(len(arr), dtype=bool)
+    for peak in order:
+        if suppressed[peak]:
+            continue
+        kept[peak] = True
+        distances = np.sqrt(np.sum((arr[:, :2] - arr[peak, :2])**2, axis=1))
+        suppressed |= distances <= minimum_distance
+    return arr[kept]
+
+def test_kill_duplicates_matches_greedy():
+    rng = np.random.RandomState(0)
+    arr = rng.randint(0, 300, (2000, 2)).astype(float)
+    heights = rng.rand(2000)
+    result = _kill_duplicates(arr, 10, heights=heights)
+    assert np.array_equal(result, greedy_suppression(arr, 10, heights))
+
+def test_kill_duplicates_heights_column():
+    rng = np.random.RandomState(1)
+    arr = np.column_stack((rng.randint(0, 200, (500, 2)), rng.rand(500)))
+    result = _kill_duplicates(arr, 10)
+    assert np.array_equal(result, greedy_suppression(arr, 10, arr[:, 2]))
+
+def test_kill_duplicates_chain():
+    # a line of peaks getting steadily lower: every other one survives
+    arr = np.column_stack((np.arange(1000) * 5.0, np.zeros(1000)))
+    heights = -np.arange(1000.0)
+    result = _kill_duplicates(arr, 6, heights=heights)
+    assert np.array_equal(result, greedy_suppression(arr, 6, heights))
+    assert len(result) == 500
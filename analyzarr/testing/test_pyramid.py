@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import tables as tb
+
+from analyzarr.lib.io import pyramid
+
+def _make_chest():
+    folder = tempfile.mkdtemp()
+    h5file = tb.open_file(os.path.join(folder, 'test.chest'), 'w')
+    h5file.create_group('/', 'rawdata')
+    node = h5file.create_array('/rawdata', 'image',
+                               np.arange(1500 * 1100).reshape(1500, 1100))
+    return folder, h5file, node
+
+def _close_chest(folder, h5file):
+    h5file.close()
+    shutil.rmtree(folder)
+
+def test_failed_build_leaves_no_pyramid():
+    folder, h5file, node = _make_chest()
+    downsample = pyramid._downsample
+    calls = []
+    def failing_downsample(*args, **kw):
+        calls.append(1)
+        if len(calls) == 2:
+            raise IOError("disk full")
+        return downsample(*args, **kw)
+    pyramid._downsample = failing_downsample
+    try:
+        try:
+            pyramid.get_levels(h5file, node, min_size=256)
+        except IOError:
+            pass
+        else:
+            raise AssertionError("the build should have failed")
+    finally:
+        pyramid._downsample = downsample
+    try:
+        assert len(h5file.root.pyramids._v_children) == 0
+        levels = pyramid.get_levels(h5file, node, min_size=256)
+        assert [level.shape for level in levels] == [
+            (1500, 1100), (750, 550), (375, 275), (188, 138)]
+        assert list(h5file.root.pyramids._v_children) == ['image']
+    finally:
+        _close_chest(folder, h5file)
+
+def test_incomplete_pyramid_is_rebuilt():
+    folder, h5file, node = _make_chest()
+    try:
+        pyramid.get_levels(h5file, node, min_size=256)
+        group = h5file.root.pyramids.image
+        # as left by an interrupted build: no source_shape, a level missing
+        del group._v_attrs.source_shape
+        h5file.remove_node(group, 'level3')
+        levels = pyramid.get_levels(h5file, node, min_size=256)
+        assert len(levels) == 4
+        assert tuple(h5file.root.pyramids.image._v_attrs.source_shape) == \
+            (1500, 1100)
+        # a level missing from a pyramid that otherwise looks finished
+        h5file.remove_node(h5file.root.pyramids.image, 'level2')
+        levels = pyramid.get_levels(h5file, node, min_size=256)
+        assert [level.shape for level in levels][2] == (375, 275)
+        data = node[:4, :4].astype(float)
+        means = (data[0::2, 0::2] + data[1::2, 0::2] + 
+                 data[0::2, 1::2] + data[1::2, 1::2]) / 4
+        assert np.array_equal(levels[1][:2, :2], np.rint(means))
+    finally:
+        _close_chest(folder, h5file)
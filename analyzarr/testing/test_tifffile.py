@@ -0,0 +1,177 @@
+import io
+import os
+import struct
+import tempfile
+import zlib
+
+import numpy as np
+
+from analyzarr.lib.io.libs import tifffile
+
+# the pure Python decoders, even if the C extension replaced them
+decodelzw = getattr(tifffile, '__old_decodelzw', tifffile.decodelzw)
+decodepackbits = getattr(tifffile, '__old_decodepackbits',
+                         tifffile.decodepackbits)
+
+def _byte(value):
+    return bytes(bytearray([value]))
+
+def _lzw_width(next_code):
+    # codes get wider once the table holds code 511, 1023 and 2047
+    if next_code <= 511:
+        return 9
+    elif next_code <= 1023:
+        return 10
+    elif next_code <= 2047:
+        return 11
+    return 12
+
+def lzw_encode(data):
+    """
+    Returns data LZW encoded the way TIFF writers do it, and the list of
+    (code, bit width) pairs written.  The table is cleared whenever it is
+    full.
+    """
+    codes = [(256, 9)]
+    table = dict((_byte(i), i) for i in xrange(256))
+    next_code = 258
+    string = b''
+    for value in bytearray(data):
+        char = _byte(value)
+        if string + char in table:
+            string += char
+            continue
+        codes.append((table[string], _lzw_width(next_code)))
+        table[string + char] = next_code
+        next_code += 1
+        if next_code == 4094:
+            codes.append((256, 12))
+            table = dict((_byte(i), i) for i in xrange(256))
+            next_code = 258
+        string = char
+    if string:
+        codes.append((table[string], _lzw_width(next_code)))
+        # the decoder makes an entry for the last code too
+        next_code += 1
+    codes.append((257, _lzw_width(next_code)))
+    bits = ''.join(format(code, '0%ib' % width) for code, width in codes)
+    bits += '0' * (-len(bits) % 8)
+    encoded = bytearray(int(bits[i:i + 8], 2)
+                        for i in xrange(0, len(bits), 8))
+    return bytes(encoded), codes
+
+def packbits_encode(data):
+    """
+    Returns data PackBits encoded, with a no-op byte (128) before every
+    third run.
+    """
+    data = bytearray(data)
+    encoded = bytearray()
+    start = 0
+    runs = 0
+    while start < len(data):
+        runs += 1
+        if runs % 3 == 0:
+            encoded.append(128)
+        count = 1
+        while (start + count < len(data) and count < 128 and
+               data[start + count] == data[start]):
+            count += 1
+        if count > 1:
+            encoded.append((1 - count) & 0xff)
+            encoded.append(data[start])
+        else:
+            # a literal, up to where the next repeat starts
+            while (start + count < len(data) and count < 128 and not
+                   (start + count + 1 < len(data) and
+                    data[start + count] == data[start + count + 1])):
+                count += 1
+            encoded.append(count - 1)
+            encoded.extend(data[start:start + count])
+        start += count
+    return bytes(encoded)
+
+def _test_data():
+    rng = np.random.RandomState(0)
+    # random data fills the LZW table many times over
+    yield rng.randint(0, 256, 60000).astype(np.uint8).tostring()
+    yield b'\x00' * 100000
+    yield b'abcab' * 20000
+    yield np.arange(70000).astype(np.uint16).tostring()
+    yield np.repeat(rng.randint(0, 256, 2000),
+                    rng.randint(1, 300, 2000)).astype(np.uint8).tostring()
+    yield b'a'
+
+def test_decodelzw_round_trip():
+    for data in _test_data():
+        encoded, codes = lzw_encode(data)
+        assert decodelzw(encoded) == data
+
+def test_lzw_encoder_covers_widths_and_clears():
+    encoded, codes = lzw_encode(next(_test_data()))
+    assert set(width for code, width in codes) == set([9, 10, 11, 12])
+    assert [code for code, width in codes].count(256) > 3
+
+def test_decodepackbits_round_trip():
+    for data in _test_data():
+        encoded = packbits_encode(data)
+        assert decodepackbits(encoded) == data
+    assert b'\x80' in packbits_encode(b'\x00' * 1000)
+
+def test_decode_strips_workers():
+    rng = np.random.RandomState(1)
+    strips = [rng.randint(0, 16, 5000).astype(np.uint8).tostring()
+              for i in xrange(7)]
+    try:
+        for name, encode in (('lzw', lambda x: lzw_encode(x)[0]),
+                             ('packbits', packbits_encode),
+                             ('deflate', zlib.compress)):
+            encoded = [encode(strip) for strip in strips]
+            offsets = np.cumsum([0] + [len(e) for e in encoded[:-1]])
+            fhandle = io.BytesIO(b''.join(encoded))
+            decoded = tifffile._decode_strips(
+                fhandle, offsets, [len(e) for e in encoded],
+                tifffile.TIFF_DECOMPESSORS[name], maxworkers=3)
+            assert list(decoded) == strips
+    finally:
+        tifffile._close_decode_pools()
+
+def _write_lzw_tiff(fname, image, rows_per_strip):
+    # a minimal little-endian greyscale TIFF, with LZW compressed strips
+    strips = [lzw_encode(image[row:row + rows_per_strip].tostring())[0]
+              for row in xrange(0, image.shape[0], rows_per_strip)]
+    offsets = np.cumsum([8] + [len(strip) for strip in strips[:-1]])
+    counts_at = 8 + sum(len(strip) for strip in strips)
+    offsets_at = counts_at + 4 * len(strips)
+    ifd_at = offsets_at + 4 * len(strips)
+    tags = [(256, 4, 1, image.shape[1]), (257, 4, 1, image.shape[0]),
+            (258, 3, 1, 8), (259, 3, 1, 5), (262, 3, 1, 1),
+            (273, 4, len(strips), offsets_at), (277, 3, 1, 1),
+            (278, 4, 1, rows_per_strip), (279, 4, len(strips), counts_at)]
+    with open(fname, 'wb') as f:
+        f.write(b'II*\x00' + struct.pack('<I', ifd_at))
+        f.write(b''.join(strips))
+        f.write(struct.pack('<%iI' % len(strips),
+                            *[len(strip) for strip in strips]))
+        f.write(struct.pack('<%iI' % len(strips), *offsets))
+        f.write(struct.pack('<H', len(tags)))
+        for tag, dtype, count, value in tags:
+            if dtype == 3:
+                f.write(struct.pack('<HHIHH', tag, dtype, count, value, 0))
+            else:
+                f.write(struct.pack('<HHII', tag, dtype, count, value))
+        f.write(struct.pack('<I', 0))
+
+def test_read_lzw_page_workers():
+    rng = np.random.RandomState(2)
+    image = rng.randint(0, 32, (64, 50)).astype(np.uint8)
+    fd, fname = tempfile.mkstemp(suffix='.tif')
+    os.close(fd)
+    try:
+        _write_lzw_tiff(fname, image, rows_per_strip=8)
+        for maxworkers in (1, 3):
+            data = tifffile.imread(fname, maxworkers=maxworkers)
+            assert np.array_equal(data, image)
+    finally:
+        tifffile._close_decode_pools()
+        os.remove(fname)
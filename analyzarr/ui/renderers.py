@@ -32,15 +32,34 @@ def _render_plot(self, array_plot_data, tools=[]):
         plot.overlays.append(zoom)
     return plot
 
-def _render_image(array_plot_data, title=None, tools=["zoom","pan"]):
+def _render_image(array_plot_data, title=None, tools=["zoom","pan"],
+                  bounds=None, view=None):
+    """
+    bounds - (x0, x1, y0, y1): where the image data sits, in image pixels.
+        Used when imagedata is only part of an image, or a downsampled copy.
+    view - (x0, x1, y0, y1): the region of the image to show.  The view
+        then stays put when imagedata changes.
+    """
     plot = Plot(array_plot_data, default_origin="top left")        
     # the cursor tool, if any
     csr = None
-    img_renderer = plot.img_plot("imagedata", colormap=gray, name="base_plot")[0]
+    if bounds is None:
+        img_renderer = plot.img_plot("imagedata", colormap=gray, 
+                                     name="base_plot")[0]
+    else:
+        img_renderer = plot.img_plot("imagedata", colormap=gray, 
+                                     name="base_plot",
+                                     xbounds=tuple(bounds[:2]),
+                                     ybounds=tuple(bounds[2:]))[0]
     # todo: generalize title and aspect ratio
     plot.title = title
-    data_array = array_plot_data.arrays['imagedata']
-    plot.aspect_ratio=float(data_array.shape[1]) / float(data_array.shape[0])
+    if view is None:
+        data_array = array_plot_data.arrays['imagedata']
+        plot.aspect_ratio=float(data_array.shape[1]) / float(data_array.shape[0])
+    else:
+        plot.index_range.set_bounds(view[0], view[1])
+        plot.value_range.set_bounds(view[2], view[3])
+        plot.aspect_ratio=float(view[1] - view[0]) / float(view[3] - view[2])
     # attach the rectangle tool
     if "pan" in tools:
         plot.tools.append(PanTool(plot,drag_button="right"))
@@ -167,6 +186,11 @@ class HasRenderer(HasTraits):
     _quiver_plot = Instance(Plot)
     _csr=Instance(BaseCursorTool)
     _labels=Dict(value={})
+    # where imagedata sits in the image and the part of the image in view,
+    #   as (x0, x1, y0, y1), for images shown from their pyramid.  None 
+    #   when imagedata is the whole image.
+    _image_bounds = Trait(None, None, Tuple)
+    _view_bounds = Trait(None, None, Tuple)
     
     thresh = Trait([0,1],None,List,Tuple,Array)
     thresh_upper = Range(-1.0, 1.0, 1.0)
@@ -183,7 +207,9 @@ class HasRenderer(HasTraits):
 
     def get_simple_image_plot(self, array_plot_data, title='', tools=["zoom", "pan"]):
         image_plot, csr = _render_image(array_plot_data=array_plot_data, 
-                                        title=title, tools=tools)
+                                        title=title, tools=tools,
+                                        bounds=self._image_bounds,
+                                        view=self._view_bounds)
         # container isn't necessary here, but we do it to keep it consistent
         #   with how the other plot types return data.
         image_container = OverlayPlotContainer(image_plot)
@@ -213,7 +239,9 @@ class HasRenderer(HasTraits):
         'inspector' - the peak-picking tool that uses clicks to select cells
             from the parent image
         """
-        image_plot, csr = _render_image(array_plot_data, title, tools=tools)
+        image_plot, csr = _render_image(array_plot_data, title, tools=tools,
+                                        bounds=self._image_bounds,
+                                        view=self._view_bounds)
         scatter_plot, colorbar = _render_scatter_overlay(image_plot, 
                                                               array_plot_data,
                                                               tools=tools,)
@@ -248,7 +276,9 @@ class HasRenderer(HasTraits):
     def get_scatter_quiver_plot(self, array_plot_data, title='',
                                 tools=[]):
         colorbar = None
-        image_plot, csr = _render_image(array_plot_data, title)
+        image_plot, csr = _render_image(array_plot_data, title,
+                                        bounds=self._image_bounds,
+                                        view=self._view_bounds)
         scatter_plot, colorbar = _render_scatter_overlay(image_plot,
                                                          array_plot_data,
                                                          tools=tools)